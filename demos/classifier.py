@@ -23,20 +23,36 @@ import time
 start = time.time()
 
 import argparse
+import base64
 import cv2
+import json
 import os
 import pickle
+import socket
 import sys
 
+from collections import OrderedDict
 from operator import itemgetter
 
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import SocketServer as socketserver
+    from urllib2 import HTTPError, Request, urlopen
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import socketserver
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+    from urllib.parse import parse_qs, urlparse
+
 import numpy as np
 np.set_printoptions(precision=2)
-import pandas as pd
 
 import openface
 
 from sklearn.pipeline import Pipeline
+from sklearn.linear_model import SGDClassifier
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
 from sklearn.preprocessing import LabelEncoder
 from sklearn.svm import SVC
@@ -51,9 +67,10 @@ dlibModelDir = os.path.join(modelDir, 'dlib')
 openfaceModelDir = os.path.join(modelDir, 'openface')
 
 
-def getRep(imgPath, multiple=False):
+def getRep(imgPath, multiple=False, bgrImg=None):
     start = time.time()
-    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        bgrImg = cv2.imread(imgPath)
     if bgrImg is None:
         raise Exception("Unable to load image: {}".format(imgPath))
 
@@ -100,15 +117,69 @@ def getRep(imgPath, multiple=False):
     return sreps
 
 
+def loadClassifier(fName):
+    with open(fName, 'rb') as f:
+        if sys.version_info[0] < 3:
+                (le, clf) = pickle.load(f)
+        else:
+                (le, clf) = pickle.load(f, encoding='latin1')
+    return (le, clf)
+
+
+def trainedPathsFile(fName):
+    # The images a classifier has learned, so `--update` only adds new ones.
+    return os.path.splitext(fName)[0] + '-paths.txt'
+
+
+def saveClassifier(fName, le, clf, paths, append=False):
+    print("Saving classifier to '{}'".format(fName))
+    with open(fName, 'w') as f:
+        pickle.dump((le, clf), f)
+    with open(trainedPathsFile(fName), 'a' if append else 'w') as f:
+        for path in paths:
+            f.write(path + '\n')
+
+
+def update(le, clf, embeddings, labels):
+    if not hasattr(clf, 'partial_fit'):
+        raise Exception("Only NearestClassMean and SGD classifiers can be updated.")
+    newLe = LabelEncoder().fit(list(le.classes_) + list(labels))
+    if len(newLe.classes_) > len(le.classes_):
+        if not isinstance(clf, openface.NearestClassMean):
+            raise Exception("Only a NearestClassMean classifier can learn new people.")
+        # Both encoders sort the names, so the known people keep their order.
+        clf.classes_ = newLe.transform(le.classes_)[clf.classes_]
+    print("Updating for {} classes.".format(len(newLe.classes_)))
+    clf.partial_fit(embeddings, newLe.transform(labels))
+    return newLe
+
+
 def train(args):
     print("Loading embeddings.")
-    fname = "{}/labels.csv".format(args.workDir)
-    labels = pd.read_csv(fname, header=None).as_matrix()[:, 1]
-    labels = map(itemgetter(1),
-                 map(os.path.split,
-                     map(os.path.dirname, labels)))  # Get the directory.
-    fname = "{}/reps.csv".format(args.workDir)
-    embeddings = pd.read_csv(fname, header=None).as_matrix()
+    store = openface.data.EmbeddingStore.load(args.workDir)
+    labels = list(map(itemgetter(1),
+                      map(os.path.split,
+                          map(os.path.dirname, store.paths))))  # Get the directory.
+    embeddings = store.reps
+    fName = "{}/classifier.pkl".format(args.workDir)
+    if args.update:
+        (le, clf) = loadClassifier(fName)
+        pathsFile = trainedPathsFile(fName)
+        if not os.path.isfile(pathsFile):
+            raise Exception("'{}' doesn't list the images the classifier was trained on. "
+                            "Train a new classifier to update it later.".format(pathsFile))
+        with open(pathsFile, 'r') as f:
+            trained = set(line.rstrip('\n') for line in f)
+        # Only learn the embeddings of new images, since the
+        # classifier would otherwise count the old ones again.
+        new = [i for (i, path) in enumerate(store.paths) if path not in trained]
+        print("Found {} new embeddings.".format(len(new)))
+        if len(new) == 0:
+            return
+        le = update(le, clf, embeddings[np.array(new)], [labels[i] for i in new])
+        saveClassifier(fName, le, clf, [store.paths[i] for i in new], append=True)
+        return
+
     le = LabelEncoder().fit(labels)
     labelsNum = le.transform(labels)
     nClasses = len(le.classes_)
@@ -157,6 +228,13 @@ def train(args):
                   # dropouts = 0.25, # Express the percentage of nodes that
                   # will be randomly dropped as a decimal.
                   verbose=1)
+    elif args.classifier == 'NearestClassMean':
+        # Trains in one pass and can be updated with `--update`.
+        clf = openface.NearestClassMean(metric=args.metric, threshold=args.threshold)
+    elif args.classifier == 'SGD':
+        # A linear model with probabilities that trains in
+        # linear time and can be updated with `--update`.
+        clf = SGDClassifier(loss='log', n_jobs=-1)
 
     if args.ldaDim > 0:
         clf_final = clf
@@ -165,42 +243,242 @@ def train(args):
 
     clf.fit(embeddings, labelsNum)
 
-    fName = "{}/classifier.pkl".format(args.workDir)
-    print("Saving classifier to '{}'".format(fName))
-    with open(fName, 'w') as f:
-        pickle.dump((le, clf), f)
+    saveClassifier(fName, le, clf, store.paths)
 
 
-def infer(args, multiple=False):
-    with open(args.classifierModel, 'rb') as f:
-        if sys.version_info[0] < 3:
-                (le, clf) = pickle.load(f)
+def predict(le, clf, reps):
+    faces = []
+    for r in reps:
+        rep = r[1].reshape(1, -1)
+        bbx = r[0]
+        start = time.time()
+        predictions = clf.predict_proba(rep).ravel()
+        maxI = np.argmax(predictions)
+        person = le.inverse_transform(maxI)
+        confidence = predictions[maxI]
+        if args.verbose:
+            print("Prediction took {} seconds.".format(time.time() - start))
+        face = {'x': bbx, 'person': person.decode('utf-8'),
+                'confidence': float(confidence)}
+        if isinstance(clf, GMM):
+            face['distance'] = float(np.linalg.norm(rep - clf.means_[maxI]))
+        if isinstance(clf, openface.NearestClassMean):
+            face['known'] = bool(clf.isKnown(rep)[0])
+        faces.append(face)
+    return faces
+
+
+def printPredictions(faces, multiple):
+    if len(faces) > 1:
+        print("List of faces in image from left to right")
+    for face in faces:
+        if multiple:
+            print("Predict {} @ x={} with {:.2f} confidence.".format(face['person'], face['x'],
+                                                                     face['confidence']))
         else:
-                (le, clf) = pickle.load(f, encoding='latin1')
+            print("Predict {} with {:.2f} confidence.".format(face['person'], face['confidence']))
+        if 'distance' in face:
+            print("  + Distance from the mean: {}".format(face['distance']))
+        if not face.get('known', True):
+            print("  + Not within the threshold of any known person.")
+
+
+def infer(args, multiple=False):
+    if args.server is not None:
+        inferRemote(args, multiple)
+        return
+
+    (le, clf) = loadClassifier(args.classifierModel)
 
     for img in args.imgs:
         print("\n=== {} ===".format(img))
         reps = getRep(img, multiple)
-        if len(reps) > 1:
-            print("List of faces in image from left to right")
-        for r in reps:
-            rep = r[1].reshape(1, -1)
-            bbx = r[0]
-            start = time.time()
-            predictions = clf.predict_proba(rep).ravel()
-            maxI = np.argmax(predictions)
-            person = le.inverse_transform(maxI)
-            confidence = predictions[maxI]
-            if args.verbose:
-                print("Prediction took {} seconds.".format(time.time() - start))
-            if multiple:
-                print("Predict {} @ x={} with {:.2f} confidence.".format(person.decode('utf-8'), bbx,
-                                                                         confidence))
+        printPredictions(predict(le, clf, reps), multiple)
+
+
+def sendRequest(server, request):
+    data = json.dumps(request).encode('utf-8')
+    if server.startswith('http://'):
+        try:
+            raw = urlopen(Request(server, data, {'Content-Type': 'application/json'})).read()
+        except HTTPError as e:
+            raw = e.read()
+    else:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(server)
+            s.sendall(data + b'\n')
+            raw = s.makefile('rb').readline()
+        finally:
+            s.close()
+    return json.loads(raw.decode('utf-8'))
+
+
+def inferRemote(args, multiple):
+    # Only the images' contents and the classifier's name are sent,
+    # so the server's models are used instead of loading them for
+    # every invocation.
+    name = os.path.splitext(os.path.basename(args.classifierModel))[0]
+    request = {'classifier': name, 'multi': multiple, 'images': []}
+    for img in args.imgs:
+        with open(img, 'rb') as f:
+            request['images'].append({'name': img,
+                                      'data': base64.b64encode(f.read()).decode('ascii')})
+
+    response = sendRequest(args.server, request)
+    if 'error' in response:
+        raise Exception(response['error'])
+    for (img, result) in zip(args.imgs, response['results']):
+        print("\n=== {} ===".format(img))
+        if 'error' in result:
+            raise Exception(result['error'])
+        printPredictions(result['faces'], multiple)
+
+
+class RequestError(Exception):
+    """A malformed request, as opposed to a failure of the server."""
+
+
+# The classifiers loaded at startup, by name: [path, mtime, (le, clf)].
+# Requests can only select one of these, since unpickling a file
+# the client chose would let it run arbitrary code.
+classifiers = OrderedDict()
+
+
+def loadClassifiers(fNames):
+    for fName in fNames:
+        name = os.path.splitext(os.path.basename(fName))[0]
+        if name in classifiers:
+            raise Exception("Two classifiers are named '{}'.".format(name))
+        fName = os.path.abspath(fName)
+        classifiers[name] = [fName, os.path.getmtime(fName), loadClassifier(fName)]
+
+
+def getClassifier(name=None):
+    # A classifier is selected by its name or index, defaulting to the first.
+    names = list(classifiers.keys())
+    if name is None:
+        name = names[0]
+    elif isinstance(name, int) and not isinstance(name, bool) and 0 <= name < len(names):
+        name = names[name]
+    if name not in names:
+        raise RequestError("Unknown classifier: {}".format(name))
+
+    # Reload a classifier retrained since it was loaded.
+    entry = classifiers[name]
+    mtime = os.path.getmtime(entry[0])
+    if mtime != entry[1]:
+        entry[2] = loadClassifier(entry[0])
+        entry[1] = mtime
+    return entry[2]
+
+
+def inferImage(le, clf, name, data, multiple):
+    bgrImg = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgrImg is None:
+        return {'img': name, 'error': "Unable to decode image: {}".format(name)}
+    try:
+        return {'img': name, 'faces': predict(le, clf, getRep(name, multiple, bgrImg))}
+    except Exception as e:
+        return {'img': name, 'error': str(e)}
+
+
+def parseImages(request):
+    if not isinstance(request, dict) or not isinstance(request.get('images'), list):
+        raise RequestError("Expected a JSON object with a list of 'images'.")
+    images = []
+    for image in request['images']:
+        try:
+            images.append((str(image['name']), base64.b64decode(image['data'])))
+        except (KeyError, TypeError, ValueError) as e:
+            raise RequestError("Invalid image: {}".format(e))
+    return images
+
+
+def handleRequest(request):
+    # The images are base64 encoded files in 'images'.
+    # Returns the response and whether the request was malformed.
+    try:
+        images = parseImages(request)
+        (le, clf) = getClassifier(request.get('classifier'))
+        multiple = bool(request.get('multi', False))
+        results = [inferImage(le, clf, name, data, multiple) for (name, data) in images]
+        return ({'results': results}, False)
+    except RequestError as e:
+        return ({'error': str(e)}, True)
+    except Exception as e:
+        return ({'error': "Server error: {}".format(e)}, False)
+
+
+class UnixRequestHandler(socketserver.StreamRequestHandler):
+    # One JSON request and response line per connection.
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            (response, _) = handleRequest(request)
+        except ValueError as e:
+            response = {'error': "Invalid request: {}".format(e)}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class HTTPRequestHandler(BaseHTTPRequestHandler):
+    # A POST of a JSON request, or of an image file with
+    # optional `?multi=1` and `?classifier=<name>` queries.
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        url = urlparse(self.path)
+        try:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                (response, malformed) = handleRequest(json.loads(body.decode('utf-8')))
             else:
-                print("Predict {} with {:.2f} confidence.".format(person.decode('utf-8'), confidence))
-            if isinstance(clf, GMM):
-                dist = np.linalg.norm(rep - clf.means_[maxI])
-                print("  + Distance from the mean: {}".format(dist))
+                query = parse_qs(url.query)
+                multiple = query.get('multi', ['0'])[0] not in ['0', 'false']
+                (response, malformed) = handleRequest({
+                    'classifier': query.get('classifier', [None])[0],
+                    'multi': multiple,
+                    'images': [{'name': url.path,
+                                'data': base64.b64encode(body).decode('ascii')}]})
+        except ValueError as e:
+            (response, malformed) = ({'error': "Invalid request: {}".format(e)}, True)
+
+        data = json.dumps(response).encode('utf-8')
+        if 'error' not in response:
+            self.send_response(200)
+        else:
+            self.send_response(400 if malformed else 500)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args_):
+        if args.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args_)
+
+
+def serve(args):
+    loadClassifiers(args.classifierModels)
+
+    # Requests are handled one at a time since they share the aligner and network.
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = socketserver.UnixStreamServer(args.socket, UnixRequestHandler)
+        print("Serving on '{}'.".format(args.socket))
+    else:
+        server = HTTPServer((args.host, args.port), HTTPRequestHandler)
+        print("Serving on http://{}:{}/".format(args.host, args.port))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None:
+            os.remove(args.socket)
 
 
 if __name__ == '__main__':
@@ -221,6 +499,7 @@ if __name__ == '__main__':
         default=os.path.join(
             openfaceModelDir,
             'nn4.small2.v1.t7'))
+    openface.helper.addNetworkBackendArgument(parser)
     parser.add_argument('--imgDim', type=int,
                         help="Default image dimension.", default=96)
     parser.add_argument('--cuda', action='store_true')
@@ -240,13 +519,24 @@ if __name__ == '__main__':
             'RadialSvm',
             'DecisionTree',
             'GaussianNB',
-            'DBN'],
+            'DBN',
+            'NearestClassMean',
+            'SGD'],
         help='The type of classifier to use.',
         default='LinearSvm')
+    trainParser.add_argument('--metric', type=str, choices=['cosine', 'l2'],
+                             help="How NearestClassMean compares faces with the class means.",
+                             default='cosine')
+    trainParser.add_argument('--threshold', type=float,
+                             help="""The minimum cosine similarity, or maximum squared L2 distance,
+                             to a class mean for NearestClassMean to consider a face known.""")
+    trainParser.add_argument('--update', action='store_true',
+                             help="""Update the NearestClassMean or SGD classifier in the work
+                             directory with its embeddings instead of training a new one.""")
     trainParser.add_argument(
         'workDir',
         type=str,
-        help="The input work directory containing 'reps.csv' and 'labels.csv'. Obtained from aligning a directory with 'align-dlib' and getting the representations with 'batch-represent'.")
+        help="The input work directory containing 'reps.csv' and 'labels.csv', or their binary version from 'util/convert-reps.py'. Obtained from aligning a directory with 'align-dlib' and getting the representations with 'batch-represent'.")
 
     inferParser = subparsers.add_parser(
         'infer', help='Predict who an image contains from a trained classifier.')
@@ -258,13 +548,33 @@ if __name__ == '__main__':
                              help="Input image.")
     inferParser.add_argument('--multi', help="Infer multiple faces in image",
                              action="store_true")
+    inferParser.add_argument('--server', type=str,
+                             help="""Send the images to a running 'serve' mode instead of
+                             loading the models: the path of its Unix socket or its
+                             'http://host:port/' URL. The server's classifier with the
+                             classifierModel's file name is used.""")
+
+    serveParser = subparsers.add_parser(
+        'serve', help='Load the models once and answer infer requests from a Unix socket or HTTP.')
+    serveParser.add_argument('classifierModels', type=str, nargs='+',
+                             help="""Python pickles of the classifiers to serve. Requests select
+                             one by its file name without '.pkl', or by its index, and the first
+                             is used by requests that don't select one. A pickle is loaded again
+                             once it's modified.""")
+    serveParser.add_argument('--socket', type=str,
+                             help="Listen on this Unix socket instead of HTTP.")
+    serveParser.add_argument('--host', type=str, default='127.0.0.1',
+                             help="The HTTP address to listen on.")
+    serveParser.add_argument('--port', type=int, default=8000,
+                             help="The HTTP port to listen on.")
 
     args = parser.parse_args()
     if args.verbose:
         print("Argument parsing and import libraries took {} seconds.".format(
             time.time() - start))
 
-    if args.mode == 'infer' and args.classifierModel.endswith(".t7"):
+    if args.mode == 'infer' and args.classifierModel.endswith(".t7") or \
+            args.mode == 'serve' and any(fName.endswith(".t7") for fName in args.classifierModels):
         raise Exception("""
 Torch network model passed as the classification model,
 which should be a Python pickle (.pkl)
@@ -276,11 +586,15 @@ network and classification models:
         http://cmusatyalab.github.io/openface/training-new-models/
 
 Use `--networkModel` to set a non-standard Torch network model.""")
+    if args.mode == 'infer' and args.server is not None:
+        infer(args, args.multi)
+        sys.exit(0)
+
     start = time.time()
 
     align = openface.AlignDlib(args.dlibFacePredictor)
-    net = openface.TorchNeuralNet(args.networkModel, imgDim=args.imgDim,
-                                  cuda=args.cuda)
+    net = openface.loadNet(args.networkModel, imgDim=args.imgDim, cuda=args.cuda,
+                           backend=args.networkBackend)
 
     if args.verbose:
         print("Loading the dlib and OpenFace models took {} seconds.".format(
@@ -291,3 +605,5 @@ Use `--networkModel` to set a non-standard Torch network model.""")
         train(args)
     elif args.mode == 'infer':
         infer(args, args.multi)
+    elif args.mode == 'serve':
+        serve(args)
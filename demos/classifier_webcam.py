@@ -60,39 +60,18 @@ def getRep(bgrImg):
 
     start = time.time()
 
-    # Get the largest face bounding box
-    # bb = align.getLargestFaceBoundingBox(rgbImg) #Bounding box
+    # Detect the faces every few frames and track them in between.
+    tracks = videoAligner.process(rgbImg)
+    bb = [track.bb for track in tracks]
+    alignedFaces = [track.alignedFace for track in tracks]
 
-    # Get all bounding boxes
-    bb = align.getAllFaceBoundingBoxes(rgbImg)
-
-    if bb is None:
-        # raise Exception("Unable to find a face: {}".format(imgPath))
-        return None
-    if args.verbose:
-        print("Face detection took {} seconds.".format(time.time() - start))
-
-    start = time.time()
-
-    alignedFaces = []
-    for box in bb:
-        alignedFaces.append(
-            align.align(
-                args.imgDim,
-                rgbImg,
-                box,
-                landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE))
-
-    if alignedFaces is None:
-        raise Exception("Unable to align the frame")
     if args.verbose:
-        print("Alignment took {} seconds.".format(time.time() - start))
+        print("Face detection, tracking and alignment took {} seconds.".format(
+            time.time() - start))
 
     start = time.time()
 
-    reps = []
-    for alignedFace in alignedFaces:
-        reps.append(net.forward(alignedFace))
+    reps = list(net.forwardBatch(alignedFaces))
 
     if args.verbose:
         print("Neural network forward pass took {} seconds.".format(
@@ -157,6 +136,7 @@ if __name__ == '__main__':
         default=os.path.join(
             openfaceModelDir,
             'nn4.small2.v1.t7'))
+    openface.helper.addNetworkBackendArgument(parser)
     parser.add_argument('--imgDim', type=int,
                         help="Default image dimension.", default=96)
     parser.add_argument(
@@ -167,6 +147,8 @@ if __name__ == '__main__':
     parser.add_argument('--width', type=int, default=320)
     parser.add_argument('--height', type=int, default=240)
     parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--detectEvery', type=int, default=10,
+                        help="Run the face detector every this many frames and track faces in between.")
     parser.add_argument('--cuda', action='store_true')
     parser.add_argument('--verbose', action='store_true')
     parser.add_argument(
@@ -177,10 +159,13 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     align = openface.AlignDlib(args.dlibFacePredictor)
-    net = openface.TorchNeuralNet(
-        args.networkModel,
-        imgDim=args.imgDim,
-        cuda=args.cuda)
+    videoAligner = openface.VideoAligner(
+        align,
+        args.imgDim,
+        detectEvery=args.detectEvery,
+        landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+    net = openface.loadNet(args.networkModel, imgDim=args.imgDim, cuda=args.cuda,
+                           backend=args.networkBackend)
 
     # Capture device. Usually 0 will be webcam and 1 will be usb cam.
     video_capture = cv2.VideoCapture(args.captureDevice)
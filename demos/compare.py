@@ -44,6 +44,7 @@ parser.add_argument('--dlibFacePredictor', type=str, help="Path to dlib's face p
                     default=os.path.join(dlibModelDir, "shape_predictor_68_face_landmarks.dat"))
 parser.add_argument('--networkModel', type=str, help="Path to Torch network model.",
                     default=os.path.join(openfaceModelDir, 'nn4.small2.v1.t7'))
+openface.helper.addNetworkBackendArgument(parser)
 parser.add_argument('--imgDim', type=int,
                     help="Default image dimension.", default=96)
 parser.add_argument('--verbose', action='store_true')
@@ -56,7 +57,8 @@ if args.verbose:
 
 start = time.time()
 align = openface.AlignDlib(args.dlibFacePredictor)
-net = openface.TorchNeuralNet(args.networkModel, args.imgDim)
+net = openface.loadNet(args.networkModel, imgDim=args.imgDim,
+                       backend=args.networkBackend)
 if args.verbose:
     print("Loading the dlib and OpenFace models took {} seconds.".format(
         time.time() - start))
@@ -59,10 +59,11 @@ class Classifier(object):
         self.args = args
            
         self.align = openface.AlignDlib(self.args.dlibFacePredictor)
-        self.net = openface.TorchNeuralNet(
+        self.net = openface.loadNet(
             self.args.networkModel,
             imgDim=self.args.imgDim,
-            cuda=self.args.cuda)
+            cuda=self.args.cuda,
+            backend=self.args.networkBackend)
         
         self.noFaceDetected = False
     
@@ -215,6 +215,7 @@ class OpenFaceRecognition(object):
     @qi.bind(returnType=qi.Void, paramsType=[])          
     def setArgs(self, robotName="pepper", captureDevice=0,
                 dlibFacePredictor="68FACE", classifierModel="CELEB", networkModel="CELEB",
+                networkBackend="torch",
                 imgDim=96, width=320, height=240, threshold=0.5, cuda=False, verbose=False,
                 imageDirectory="demos/robot/images/", databaseFolder="celeb_images", saveImageFolder="recog_images", 
                 serverDir="LOCAL"):
@@ -238,6 +239,7 @@ class OpenFaceRecognition(object):
             argus.networkModel = os.path.join(openfaceselfModelDir, "nn4.small2.v1.t7")
         else:
             argus.networkModel = networkModel
+        argus.networkBackend = networkBackend
         argus.imgDim = imgDim
         argus.width = width
         argus.height = height
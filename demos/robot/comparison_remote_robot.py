@@ -248,6 +248,13 @@ def parserArgs():
                 openfaceselfModelDir,
                 'nn4.small2.v1.t7'),
             help='Path to Torch network model.') #celebrity trained model. You can change this to another trained model.
+    parser.add_argument(
+            '--networkBackend',
+            type=str,
+            choices=['torch', 'opencv'],
+            default='torch',
+            help="Run the network model in a Torch subprocess or in-process with OpenCV's DNN module. "
+                 "Passed to the Classifier, which loads the network.")
     parser.add_argument('--imgDim', type=int,
                         help='Default image dimension.', default=96)
     parser.add_argument('--width', type=int, default=320)
@@ -8,7 +8,6 @@ start = time.time()
 import argparse
 import cv2
 import os
-import dlib
 
 import numpy as np
 np.set_printoptions(precision=2)
@@ -46,25 +45,18 @@ def getRep(bgrImg):
 
     start = time.time()
 
-    alignedFaces = []
-    for box in bb:
-        alignedFaces.append(
-            align.align(
-                args.imgDim,
-                rgbImg,
-                box,
-                landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE))
-
-    if alignedFaces is None:
-        raise Exception("Unable to align the frame")
+    alignedFaces = align.alignMany(
+        args.imgDim,
+        rgbImg,
+        bb,
+        landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+
     if args.verbose:
         print("Alignment took {} seconds.".format(time.time() - start))
 
     start = time.time()
 
-    reps = []
-    for alignedFace in alignedFaces:
-        reps.append(net.forward(alignedFace))
+    reps = list(net.forwardBatch(alignedFaces))
 
     if args.verbose:
         print("Neural network forward pass took {} seconds.".format(
@@ -161,6 +153,7 @@ if __name__ == '__main__':
         default='nn4.small2.3d.v1.t7')
     # Download the 3D model from:
     # https://storage.cmusatyalab.org/openface-models/nn4.small2.3d.v1.t7
+    openface.helper.addNetworkBackendArgument(parser)
     parser.add_argument('--imgDim', type=int,
                         help="Default image dimension.", default=96)
     parser.add_argument(
@@ -174,16 +167,16 @@ if __name__ == '__main__':
     parser.add_argument('--height', type=int, default=800)
     parser.add_argument('--scale', type=int, default=0.25)
     parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--detectEvery', type=int, default=10,
+                        help="Run the face detector every this many frames and track faces in between.")
     parser.add_argument('--cuda', action='store_true')
     parser.add_argument('--verbose', action='store_true')
 
     args = parser.parse_args()
 
     align = openface.AlignDlib(args.dlibFacePredictor)
-    net = openface.TorchNeuralNet(
-        args.networkModel,
-        imgDim=args.imgDim,
-        cuda=args.cuda)
+    net = openface.loadNet(args.networkModel, imgDim=args.imgDim, cuda=args.cuda,
+                           backend=args.networkBackend)
 
     # Capture device. Usually 0 will be webcam and 1 will be usb cam.
     video_capture = cv2.VideoCapture(args.captureDevice)
@@ -192,29 +185,13 @@ if __name__ == '__main__':
 
     cv2.namedWindow('video', cv2.WINDOW_NORMAL)
 
-    class Tracker:
-
-        def __init__(self, img, bb, rep):
-            self.t = dlib.correlation_tracker()
-            self.t.start_track(img, bb)
-            self.rep = rep
-            self.bb = bb
-            self.pings = 0
-
-        def updateRep(self, rep):
-            self.pings = 0
-            alpha = 0.9
-            self.rep = alpha * self.rep + (1. - alpha) * rep
-            return self.rep
-
-        def overlap(self, bb):
-            p = float(self.bb.intersect(bb).area()) / float(self.bb.area())
-            return p > 0.3
-
-        def ping(self):
-            self.pings += 1
-
-    trackers = []
+    videoAligner = openface.VideoAligner(
+        align,
+        96,
+        detectEvery=args.detectEvery,
+        landmarkIndices=openface.AlignDlib.INNER_EYES_AND_BOTTOM_LIP)
+    # Smoothed representation of each tracked face.
+    trackReps = {}
 
     while True:
         ret, frame = video_capture.read()
@@ -222,13 +199,12 @@ if __name__ == '__main__':
         frameSmall = cv2.resize(frame, (int(args.width * args.scale),
                                         int(args.height * args.scale)))
 
-        bbs = align.getAllFaceBoundingBoxes(frameSmall)
+        tracks = videoAligner.process(frameSmall)
+        reps = net.forwardBatch([track.alignedFace for track in tracks])
 
         pts, clrs = [], []
-        for i, bb in enumerate(bbs):
-            alignedFace = align.align(96, frameSmall, bb,
-                                      landmarkIndices=openface.AlignDlib.INNER_EYES_AND_BOTTOM_LIP)
-            rep = net.forward(alignedFace)
+        for track, rep in zip(tracks, reps):
+            bb = track.bb
 
             center = bb.center()
             centerI = 0.7 * center.x * center.y / \
@@ -240,34 +216,17 @@ if __name__ == '__main__':
             tr = (int(bb.right() / args.scale), int(bb.top() / args.scale))
             cv2.rectangle(frame, bl, tr, color=color_cv, thickness=3)
 
-            tracked = False
-            for i in xrange(len(trackers) - 1, -1, -1):
-                t = trackers[i]
-                t.t.update(frame)
-                if t.overlap(bb):
-                    rep = t.updateRep(rep)
-                    pts.append(rep)
-                    clrs.append(color_cv)
-                    tracked = True
-                    break
-
-            if not tracked:
-                trackers.append(Tracker(frame, bb, rep))
-                pts.append(rep)
-                clrs.append(color_cv)
-
-        for i in xrange(len(trackers) - 1, -1, -1):
-            t = trackers[i]
-            t.ping()
-            if t.pings > 10:
-                del trackers[i]
-                continue
-
-            for j in range(i):
-                if t.t.get_position().intersect(trackers[j].t.get_position()).area() / \
-                   t.t.get_position().area() > 0.4:
-                    del trackers[i]
-                    continue
+            if track.trackId in trackReps:
+                alpha = 0.9
+                rep = alpha * trackReps[track.trackId] + (1. - alpha) * rep
+            trackReps[track.trackId] = rep
+            pts.append(rep)
+            clrs.append(color_cv)
+
+        trackIds = set(track.trackId for track in tracks)
+        for trackId in list(trackReps):
+            if trackId not in trackIds:
+                del trackReps[trackId]
 
         cSz = 450
         sphere = np.copy(frame)
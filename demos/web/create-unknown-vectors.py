@@ -22,10 +22,8 @@ import numpy as np
 import os
 import random
 
-import cv2
-
 import openface
-from openface.data import iterImgs
+from openface.data import iterImgs, iterRGB
 
 fileDir = os.path.dirname(os.path.realpath(__file__))
 modelDir = os.path.join(fileDir, '..', 'models')
@@ -37,6 +35,7 @@ parser.add_argument('imgDir', type=str, help="Input image directory.")
 parser.add_argument('--numImages', type=int, default=1000)
 parser.add_argument('--model', type=str, help="TODO",
                     default=os.path.join(openfaceModelDir, 'nn4.small2.v1.t7'))
+openface.helper.addNetworkBackendArgument(parser)
 parser.add_argument('--dlibFacePredictor', type=str, help="Path to dlib's face predictor.",
                     default=os.path.join(dlibModelDir, "shape_predictor_68_face_landmarks.dat"))
 parser.add_argument('--outputFile', type=str,
@@ -47,14 +46,12 @@ parser.add_argument('--imgDim', type=int, help="Default image size.",
 args = parser.parse_args()
 
 align = openface.AlignDlib(args.dlibFacePredictor)
-net = openface.TorchNeuralNet(args.model, imgDim=args.imgDim, cuda=False)
+net = openface.loadNet(args.model, imgDim=args.imgDim, backend=args.networkBackend)
 
 
-def getRep(imgPath):
-    bgrImg = cv2.imread(imgPath)
-    if bgrImg is None:
+def getRep(rgbImg):
+    if rgbImg is None:
         return None
-    rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
 
     bb = align.getLargestFaceBoundingBox(rgbImg)
     if bb is None:
@@ -72,8 +69,9 @@ if __name__ == '__main__':
     imgObjs = random.sample(allImgs, args.numImages)
 
     reps = []
-    for imgObj in imgObjs:
-        rep = getRep(imgObj.path)
+    # Load the next images while the current one is processed.
+    for (imgObj, rgbImg) in iterRGB(imgObjs):
+        rep = getRep(rgbImg)
 
         if rep is not None:
             reps.append(rep)
@@ -217,6 +217,8 @@ function createSocket(address, name) {
             BootstrapDialog.show({
                 message: "<img src='" + j['content'] + "' width='100%'></img>"
             });
+        } else if (j.type == "ERROR") {
+            console.log("Server error: " + j.message);
         } else {
             console.log("Unrecognized message type: " + j.type);
         }
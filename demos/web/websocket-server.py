@@ -64,6 +64,7 @@ parser.add_argument('--dlibFacePredictor', type=str, help="Path to dlib's face p
                     default=os.path.join(dlibModelDir, "shape_predictor_68_face_landmarks.dat"))
 parser.add_argument('--networkModel', type=str, help="Path to Torch network model.",
                     default=os.path.join(openfaceModelDir, 'nn4.small2.v1.t7'))
+openface.helper.addNetworkBackendArgument(parser)
 parser.add_argument('--imgDim', type=int,
                     help="Default image dimension.", default=96)
 parser.add_argument('--cuda', action='store_true')
@@ -71,12 +72,15 @@ parser.add_argument('--unknown', type=bool, default=False,
                     help='Try to predict unknown people')
 parser.add_argument('--port', type=int, default=9000,
                     help='WebSocket Port')
+parser.add_argument('--galleryDir', type=str,
+                    help="Directory to persist enrolled faces in across connections.")
 
 args = parser.parse_args()
 
 align = openface.AlignDlib(args.dlibFacePredictor)
-net = openface.TorchNeuralNet(args.networkModel, imgDim=args.imgDim,
-                              cuda=args.cuda)
+net = openface.loadNet(args.networkModel, imgDim=args.imgDim, cuda=args.cuda,
+                       backend=args.networkBackend)
+gallery = openface.Gallery(args.galleryDir) if args.galleryDir else None
 
 
 class Face:
@@ -101,6 +105,20 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
         self.svm = None
         if args.unknown:
             self.unknownImgs = np.load("./examples/web/unknown.npy")
+        self.loadGallery()
+
+    def loadGallery(self):
+        # The gallery is shared by every connection, so the images
+        # are reloaded from it to see the other connections' changes.
+        if gallery is not None:
+            self.images = {}
+            for h in gallery.keys():
+                (rep, identity) = gallery.get(h)
+                self.images[h] = Face(rep, identity)
+
+    def sendError(self, message):
+        print(message)
+        self.sendMessage(json.dumps({"type": "ERROR", "message": message}))
 
     def onConnect(self, request):
         print("Client connecting: {0}".format(request.peer))
@@ -124,13 +142,22 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
         elif msg['type'] == "TRAINING":
             self.training = msg['val']
             if not self.training:
+                self.loadGallery()
                 self.trainSVM()
         elif msg['type'] == "ADD_PERSON":
             self.people.append(msg['val'].encode('ascii', 'ignore'))
             print(self.people)
         elif msg['type'] == "UPDATE_IDENTITY":
             h = msg['hash'].encode('ascii', 'ignore')
-            if h in self.images:
+            if gallery is not None:
+                try:
+                    gallery.relabel(h, msg['idx'])
+                except KeyError:
+                    self.sendError("Image not found.")
+                self.loadGallery()
+                if not self.training:
+                    self.trainSVM()
+            elif h in self.images:
                 self.images[h].identity = msg['idx']
                 if not self.training:
                     self.trainSVM()
@@ -138,7 +165,15 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
                 print("Image not found.")
         elif msg['type'] == "REMOVE_IMAGE":
             h = msg['hash'].encode('ascii', 'ignore')
-            if h in self.images:
+            if gallery is not None:
+                try:
+                    gallery.remove(h)
+                except KeyError:
+                    self.sendError("Image not found.")
+                self.loadGallery()
+                if not self.training:
+                    self.trainSVM()
+            elif h in self.images:
                 del self.images[h]
                 if not self.training:
                     self.trainSVM()
@@ -159,6 +194,9 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
             h = jsImage['hash'].encode('ascii', 'ignore')
             self.images[h] = Face(np.array(jsImage['representation']),
                                   jsImage['identity'])
+            if gallery is not None and h not in gallery:
+                gallery.add(h, self.images[h].rep, self.images[h].identity)
+        self.loadGallery()
 
         for jsPerson in jsPeople:
             self.people.append(jsPerson.encode('ascii', 'ignore'))
@@ -290,6 +328,8 @@ class OpenFaceServerProtocol(WebSocketServerProtocol):
                 # print(rep)
                 if self.training:
                     self.images[phash] = Face(rep, identity)
+                    if gallery is not None:
+                        gallery.add(phash, rep, identity)
                     # TODO: Transferring as a string is suboptimal.
                     # content = [str(x) for x in cv2.resize(alignedFace, (0,0),
                     # fx=0.5, fy=0.5).flatten()]
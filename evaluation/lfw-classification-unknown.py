@@ -37,7 +37,6 @@ from operator import itemgetter
 
 import numpy as np
 np.set_printoptions(precision=2)
-import pandas as pd
 
 import openface
 
@@ -76,13 +75,11 @@ def train(args):
     start = time.time()
     for clfChoice in clfChoices:
         print("Loading embeddings.")
-        fname = "{}/labels.csv".format(args.workDir)
-        labels = pd.read_csv(fname, header=None).as_matrix()[:, 1]
+        store = openface.data.EmbeddingStore.load(args.workDir)
         labels = map(itemgetter(1),
                      map(os.path.split,
-                         map(os.path.dirname, labels)))  # Get the directory.
-        fname = "{}/reps.csv".format(args.workDir)
-        embeddings = pd.read_csv(fname, header=None).as_matrix()
+                         map(os.path.dirname, store.paths)))  # Get the directory.
+        embeddings = store.reps
         le = LabelEncoder().fit(labels)
         labelsNum = le.transform(labels)
         nClasses = len(le.classes_)
@@ -230,7 +230,8 @@ def openfaceExp(lfwAligned, net, cls):
                                'predictTimeSecMean', 'predictTimeSecStd',
                                'accsMean', 'accsStd'))
 
-    repCache = {}
+    # Each face is used for training in many of the splits.
+    cachedNet = openface.EmbeddingCache(net, maxEntries=nImgs * max(nPplVals))
 
     df_i = 0
     for nPpl in nPplVals:
@@ -246,13 +247,7 @@ def openfaceExp(lfwAligned, net, cls):
         for train, test in ss:
             X_train = []
             for img in X[train]:
-                h = hash(str(img.data))
-                if h in repCache:
-                    rep = repCache[h]
-                else:
-                    rep = net.forward(img)
-                    repCache[h] = rep
-                X_train.append(rep)
+                X_train.append(cachedNet.forward(img))
 
             start = time.time()
             X_train = np.array(X_train)
@@ -22,7 +22,6 @@ import pandas as pd
 from scipy.interpolate import interp1d
 
 from sklearn.cross_validation import KFold
-from sklearn.metrics import accuracy_score
 
 import matplotlib as mpl
 mpl.use('Agg')
@@ -36,13 +35,15 @@ import argparse
 
 from scipy import arange
 
+from openface.data import EmbeddingStore
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'tag', type=str, help='The label/tag to put on the ROC curve.')
     parser.add_argument('workDir', type=str,
-                        help='The work directory with labels.csv and reps.csv.')
+                        help='The work directory with labels.csv and reps.csv or reps.npy.')
     pairsDefault = os.path.expanduser("~/openface/data/lfw/pairs.txt")
     parser.add_argument('--lfwPairs', type=str,
                         default=os.path.expanduser(
@@ -63,14 +64,11 @@ or pass it as --lfwPairs.
         sys.exit(-1)
 
     print("Loading embeddings.")
-    fname = "{}/labels.csv".format(args.workDir)
-    paths = pd.read_csv(fname, header=None).as_matrix()[:, 1]
-    paths = map(os.path.basename, paths)  # Get the filename.
+    store = EmbeddingStore.load(args.workDir)
+    paths = map(os.path.basename, store.paths)  # Get the filename.
     # Remove the extension.
     paths = map(lambda path: os.path.splitext(path)[0], paths)
-    fname = "{}/reps.csv".format(args.workDir)
-    rawEmbeddings = pd.read_csv(fname, header=None).as_matrix()
-    embeddings = dict(zip(*[paths, rawEmbeddings]))
+    embeddings = dict(zip(*[paths, store.reps]))
 
     pairs = loadPairs(args.lfwPairs)
     verifyExp(args.workDir, pairs, embeddings)
@@ -105,27 +103,32 @@ def getEmbeddings(pair, embeddings):
     return (x1, x2, actual_same)
 
 
-def writeROC(fname, thresholds, embeddings, pairsTest):
+def getDistances(embeddings, pairs):
+    x1, x2, actual_same = zip(*[getEmbeddings(pair, embeddings) for pair in pairs])
+    diff = np.array(x1, dtype=np.float64) - np.array(x2, dtype=np.float64)
+    return np.sum(diff * diff, axis=1), np.array(actual_same)
+
+
+def getConfusionCounts(thresholds, distances, actual_same):
+    # Pairs are predicted to be the same if their distance is below the
+    # threshold, so after sorting the distances once, the true positives
+    # at every threshold are a cumulative sum of the same pairs.
+    order = np.argsort(distances, kind='mergesort')
+    nSameBelow = np.concatenate(([0], np.cumsum(actual_same[order])))
+    nBelow = np.searchsorted(distances[order], thresholds, side='left')
+    tp = nSameBelow[nBelow]
+    fp = nBelow - tp
+    fn = nSameBelow[-1] - tp
+    tn = len(distances) - nSameBelow[-1] - fp
+    return tp, tn, fp, fn
+
+
+def writeROC(fname, thresholds, distances, actual_same):
+    tps, tns, fps, fns = getConfusionCounts(thresholds, distances, actual_same)
     with open(fname, "w") as f:
         f.write("threshold,tp,tn,fp,fn,tpr,fpr\n")
-        tp = tn = fp = fn = 0
-        for threshold in thresholds:
-            tp = tn = fp = fn = 0
-            for pair in pairsTest:
-                (x1, x2, actual_same) = getEmbeddings(pair, embeddings)
-                diff = x1 - x2
-                dist = np.dot(diff.T, diff)
-                predict_same = dist < threshold
-
-                if predict_same and actual_same:
-                    tp += 1
-                elif predict_same and not actual_same:
-                    fp += 1
-                elif not predict_same and not actual_same:
-                    tn += 1
-                elif not predict_same and actual_same:
-                    fn += 1
-
+        for threshold, tp, tn, fp, fn in zip(thresholds, tps, tns, fps, fns):
+            (tp, tn, fp, fn) = (int(tp), int(tn), int(fp), int(fn))
             if tp + fn == 0:
                 tpr = 0
             else:
@@ -144,42 +147,20 @@ def writeROC(fname, thresholds, embeddings, pairsTest):
                 return
 
 
-def getDistances(embeddings, pairsTrain):
-    list_dist = []
-    y_true = []
-    for pair in pairsTrain:
-        (x1, x2, actual_same) = getEmbeddings(pair, embeddings)
-        diff = x1 - x2
-        dist = np.dot(diff.T, diff)
-        list_dist.append(dist)
-        y_true.append(actual_same)
-    return np.asarray(list_dist), np.array(y_true)
-
-
-def evalThresholdAccuracy(embeddings, pairs, threshold):
-    distances, y_true = getDistances(embeddings, pairs)
-    y_predict = np.zeros(y_true.shape)
-    y_predict[np.where(distances < threshold)] = 1
-
-    y_true = np.array(y_true)
-    accuracy = accuracy_score(y_true, y_predict)
-    return accuracy, pairs[np.where(y_true != y_predict)]
-
-
-def findBestThreshold(thresholds, embeddings, pairsTrain):
-    bestThresh = bestThreshAcc = 0
-    distances, y_true = getDistances(embeddings, pairsTrain)
-    for threshold in thresholds:
-        y_predlabels = np.zeros(y_true.shape)
-        y_predlabels[np.where(distances < threshold)] = 1
-        accuracy = accuracy_score(y_true, y_predlabels)
-        if accuracy >= bestThreshAcc:
-            bestThreshAcc = accuracy
-            bestThresh = threshold
-        else:
-            # No further improvements.
-            return bestThresh
-    return bestThresh
+def evalThresholdAccuracy(distances, actual_same, pairs, threshold):
+    y_predict = distances < threshold
+    accuracy = np.mean(y_predict == actual_same)
+    return accuracy, pairs[np.where(y_predict != actual_same)]
+
+
+def findBestThreshold(thresholds, distances, actual_same):
+    tp, tn, fp, fn = getConfusionCounts(thresholds, distances, actual_same)
+    accuracies = (tp + tn) / float(len(distances))
+    # Stop at the first threshold where the accuracy decreases.
+    decreases = np.where(np.diff(accuracies) < 0)[0]
+    if len(decreases) > 0:
+        return thresholds[decreases[0]]
+    return thresholds[-1]
 
 
 def verifyExp(workDir, pairs, embeddings):
@@ -190,17 +171,18 @@ def verifyExp(workDir, pairs, embeddings):
     if os.path.exists("{}/accuracies.txt".format(workDir)):
         print("{}/accuracies.txt already exists. Skipping processing.".format(workDir))
     else:
+        distances, actual_same = getDistances(embeddings, pairs)
         accuracies = []
         with open("{}/accuracies.txt".format(workDir), "w") as f:
             f.write('fold, threshold, accuracy\n')
             for idx, (train, test) in enumerate(folds):
                 fname = "{}/l2-roc.fold-{}.csv".format(workDir, idx)
-                writeROC(fname, thresholds, embeddings, pairs[test])
+                writeROC(fname, thresholds, distances[test], actual_same[test])
 
                 bestThresh = findBestThreshold(
-                    thresholds, embeddings, pairs[train])
+                    thresholds, distances[train], actual_same[train])
                 accuracy, pairs_bad = evalThresholdAccuracy(
-                    embeddings, pairs[test], bestThresh)
+                    distances[test], actual_same[test], pairs[test], bestThresh)
                 accuracies.append(accuracy)
                 f.write('{}, {:0.2f}, {:0.2f}\n'.format(
                     idx, bestThresh, accuracy))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python2
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This evaluates face verification on any set of embeddings.
+#
+# Pairs are either read from a pairs file, randomly sampled from the
+# labels or every pair of images is compared. They are processed in
+# chunks against the memory-mapped embeddings and the squared distances
+# of the genuine and impostor pairs are accumulated in histograms,
+# so the number of pairs isn't limited by memory.
+
+import time
+
+start = time.time()
+
+import argparse
+from collections import deque
+import itertools
+import multiprocessing
+import os
+
+import numpy as np
+
+from openface.data import EmbeddingStore
+
+# The number of rows compared with every later row in each chunk
+# when comparing all pairs.
+blockSize = 1024
+
+
+def initWorker(args):
+    global workerReps, workerLabels, workerPairs, workerArgs, workerClasses
+    store = EmbeddingStore.load(args.workDir)
+    workerReps = store.reps
+    workerLabels = np.asarray(store.labels)
+    workerArgs = args
+    workerPairs = None
+    workerClasses = None
+    if args.pairs is not None and args.pairs.endswith('.npy'):
+        workerPairs = np.load(args.pairs, mmap_mode='r')
+
+
+def histogram(distances, genuine):
+    # A bin index is cheaper to compute than `np.histogram`
+    # since all bins have the same width.
+    nBins = workerArgs.bins
+    bins = (distances * (nBins / workerArgs.maxDistance)).astype(np.int64)
+    np.clip(bins, 0, nBins - 1, out=bins)
+    return (np.bincount(bins[genuine], minlength=nBins),
+            np.bincount(bins[~genuine], minlength=nBins))
+
+
+def pairDistances(idx1, idx2):
+    # Sort the pairs so the rows are read from the
+    # memory-mapped embeddings mostly in order.
+    order = np.argsort(idx1, kind='mergesort')
+    (idx1, idx2) = (idx1[order], idx2[order])
+    diff = np.asarray(workerReps[idx1], dtype=np.float32) - workerReps[idx2]
+    distances = np.einsum('ij,ij->i', diff, diff)
+    return histogram(distances, workerLabels[idx1] == workerLabels[idx2])
+
+
+def getClasses():
+    # The images sorted by label, so the images of a class are contiguous.
+    global workerClasses
+    if workerClasses is None:
+        order = np.argsort(workerLabels, kind='mergesort')
+        (_, classStart, classCount) = np.unique(workerLabels[order], return_index=True,
+                                                return_counts=True)
+        pos = np.arange(len(order)) - np.repeat(classStart, classCount)
+        eligible = np.flatnonzero(np.repeat(classCount, classCount) > 1)
+        if len(eligible) == 0:
+            raise Exception("No class has more than one image.")
+        workerClasses = (order, classStart, classCount, pos, eligible)
+    return workerClasses
+
+
+def samplePairs(chunk, n):
+    # Every chunk has its own seed, so the sampled pairs don't
+    # depend on the number of workers or the order of the chunks.
+    rng = np.random.RandomState(workerArgs.seed + chunk)
+    labels = workerLabels
+    nGenuine = int(round(n * workerArgs.genuineFraction))
+
+    # Sample the genuine pairs within the classes with more than one image.
+    (order, classStart, classCount, pos, eligible) = getClasses()
+    i = eligible[rng.randint(len(eligible), size=nGenuine)]
+    cls = np.searchsorted(classStart, i, side='right') - 1
+    count = classCount[cls]
+    j = classStart[cls] + (pos[i] + rng.randint(1, count)) % count
+    (gen1, gen2) = (order[i], order[j])
+
+    # Resample the impostor pairs that happen to have the same label,
+    # which would never end with a single class.
+    if n > nGenuine and len(classStart) < 2:
+        raise ValueError("Impostor pairs need at least two classes.")
+    imp1 = rng.randint(len(labels), size=n - nGenuine)
+    imp2 = rng.randint(len(labels), size=n - nGenuine)
+    same = np.flatnonzero(labels[imp1] == labels[imp2])
+    while len(same) > 0:
+        imp2[same] = rng.randint(len(labels), size=len(same))
+        same = same[labels[imp1[same]] == labels[imp2[same]]]
+
+    return (np.concatenate((gen1, imp1)), np.concatenate((gen2, imp2)))
+
+
+def blockDistances(i0, i1):
+    # Compare rows [i0, i1) with every later row, using
+    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b so that
+    # about `chunkSize` distances are a single matrix product.
+    step = max(1, workerArgs.chunkSize // blockSize)
+    genHist = np.zeros(workerArgs.bins, dtype=np.int64)
+    impHist = np.zeros(workerArgs.bins, dtype=np.int64)
+    a = np.asarray(workerReps[i0:i1], dtype=np.float32)
+    aNorms = np.einsum('ij,ij->i', a, a)
+    for j0 in range(i0, len(workerReps), step):
+        j1 = min(j0 + step, len(workerReps))
+        b = np.asarray(workerReps[j0:j1], dtype=np.float32)
+        distances = aNorms[:, None] + np.einsum('ij,ij->i', b, b)[None, :] - \
+            2.0 * np.dot(a, b.T)
+        np.maximum(distances, 0.0, out=distances)
+        upper = np.arange(i0, i1)[:, None] < np.arange(j0, j1)[None, :]
+        genuine = workerLabels[i0:i1, None] == workerLabels[None, j0:j1]
+        (gen, imp) = histogram(distances[upper], genuine[upper])
+        genHist += gen
+        impHist += imp
+    return (genHist, impHist)
+
+
+def evalChunk(chunk):
+    (kind, a, b) = chunk
+    if kind == 'indices':
+        return pairDistances(a, b)
+    elif kind == 'file':
+        pairs = np.asarray(workerPairs[a:b], dtype=np.int64)
+        return pairDistances(pairs[:, 0], pairs[:, 1])
+    elif kind == 'sample':
+        return pairDistances(*samplePairs(a, b))
+    elif kind == 'block':
+        return blockDistances(a, b)
+    else:
+        raise Exception("Unrecognized chunk: {}".format(kind))
+
+
+def readTextPairs(args, store):
+    # Pairs of indices into the embeddings or of image paths.
+    pathIdx = None
+    with open(args.pairs, 'r') as f:
+        lines = (line.split() for line in f)
+        lines = (line for line in lines if len(line) > 0 and not line[0].startswith('#'))
+        while True:
+            rows = list(itertools.islice(lines, args.chunkSize))
+            if len(rows) == 0:
+                break
+            try:
+                pairs = np.array([(int(row[0]), int(row[1])) for row in rows], dtype=np.int64)
+            except ValueError:
+                if pathIdx is None:
+                    pathIdx = dict((path, i) for (i, path) in enumerate(store.paths))
+                try:
+                    pairs = np.array([(pathIdx[row[0]], pathIdx[row[1]]) for row in rows],
+                                     dtype=np.int64)
+                except KeyError as e:
+                    raise Exception("Image not in the embeddings: {}".format(e.args[0]))
+            yield ('indices', pairs[:, 0], pairs[:, 1])
+
+
+def getChunks(args, store):
+    n = len(store)
+    if args.pairs is not None and args.pairs.endswith('.npy'):
+        nPairs = len(np.load(args.pairs, mmap_mode='r'))
+        return (('file', i, min(i + args.chunkSize, nPairs))
+                for i in range(0, nPairs, args.chunkSize))
+    elif args.pairs is not None:
+        return readTextPairs(args, store)
+    elif args.numPairs > 0:
+        return (('sample', chunk, min(args.chunkSize, args.numPairs - i))
+                for (chunk, i) in enumerate(range(0, args.numPairs, args.chunkSize)))
+    else:
+        # Blocks of rows compared with every later row.
+        return (('block', i, min(i + blockSize, n)) for i in range(0, n, blockSize))
+
+
+def imapBounded(pool, fn, chunks, window):
+    # Like `pool.imap`, but only reads `window` chunks ahead, so a
+    # large pairs file isn't read into memory faster than it's compared.
+    chunks = iter(chunks)
+    pending = deque(pool.apply_async(fn, (chunk,))
+                    for chunk in itertools.islice(chunks, window))
+    while len(pending) > 0:
+        result = pending.popleft().get()
+        for chunk in itertools.islice(chunks, 1):
+            pending.append(pool.apply_async(fn, (chunk,)))
+        yield result
+
+
+def getROC(genHist, impHist, maxDistance):
+    # Pairs closer than the upper edge of a bin are accepted.
+    thresholds = np.linspace(0.0, maxDistance, len(genHist) + 1)[1:]
+    tar = np.cumsum(genHist) / float(max(1, genHist.sum()))
+    far = np.cumsum(impHist) / float(max(1, impHist.sum()))
+    return thresholds, tar, far
+
+
+def getTARatFAR(thresholds, tar, far, targetFar):
+    # The highest threshold with a false accept rate of at most the target.
+    k = np.searchsorted(far, targetFar, side='right') - 1
+    if k < 0:
+        return (0.0, 0.0)
+    return (tar[k], thresholds[k])
+
+
+def getEER(thresholds, tar, far):
+    # Interpolate where the false reject rate crosses the false accept rate.
+    frr = 1.0 - tar
+    k = np.argmax(far >= frr)
+    if k == 0:
+        return (far[0], thresholds[0])
+    (d0, d1) = (frr[k - 1] - far[k - 1], frr[k] - far[k])
+    t = d0 / (d0 - d1) if d0 != d1 else 0.0
+    eer = far[k - 1] + t * (far[k] - far[k - 1])
+    threshold = thresholds[k - 1] + t * (thresholds[k] - thresholds[k - 1])
+    return (eer, threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('workDir', type=str,
+                        help='The work directory with labels.csv and reps.csv or reps.npy.')
+    parser.add_argument('--pairs', type=str,
+                        help="""File of pairs to compare. Either a '.npy' array of shape (N, 2)
+                        with indices into the embeddings, or a text file with two indices
+                        or two image paths from labels.csv per line.""")
+    parser.add_argument('--numPairs', type=int, default=0,
+                        help="""Without '--pairs', randomly sample this many pairs
+                        from the labels. By default, every pair of images is compared.""")
+    parser.add_argument('--genuineFraction', type=float, default=0.5,
+                        help='The fraction of sampled pairs with the same label.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for sampling pairs.')
+    parser.add_argument('--chunkSize', type=int, default=1000000,
+                        help='The number of pairs compared at a time by each worker.')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='The number of processes comparing chunks of pairs.')
+    parser.add_argument('--bins', type=int, default=10000,
+                        help='The number of distance histogram bins.')
+    parser.add_argument('--maxDistance', type=float, default=4.0,
+                        help="""The largest squared distance in the histograms.
+                        Normalized embeddings are at most 4 apart.""")
+    parser.add_argument('--far', type=float, nargs='+',
+                        default=[1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1],
+                        help='False accept rates to report the true accept rates at.')
+    parser.add_argument('--outDir', type=str,
+                        help='Directory to write roc.csv to. Defaults to the work directory.')
+    args = parser.parse_args()
+
+    print("Argument parsing and loading libraries took {:0.4f} seconds.".format(
+        time.time() - start))
+
+    evalStart = time.time()
+    store = EmbeddingStore.load(args.workDir)
+    print("Loaded {} embeddings.".format(len(store)))
+
+    genHist = np.zeros(args.bins, dtype=np.int64)
+    impHist = np.zeros(args.bins, dtype=np.int64)
+    chunks = getChunks(args, store)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=initWorker,
+                                    initargs=(args,))
+        results = imapBounded(pool, evalChunk, chunks, 2 * args.workers)
+    else:
+        pool = None
+        initWorker(args)
+        results = (evalChunk(chunk) for chunk in chunks)
+    for (gen, imp) in results:
+        genHist += gen
+        impHist += imp
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    (nGenuine, nImpostor) = (int(genHist.sum()), int(impHist.sum()))
+    elapsed = time.time() - evalStart
+    print("Compared {} genuine and {} impostor pairs in {:0.2f} seconds ({:0.0f} pairs/s).".format(
+        nGenuine, nImpostor, elapsed, (nGenuine + nImpostor) / max(elapsed, 1e-6)))
+    if nGenuine == 0 or nImpostor == 0:
+        raise Exception("Both genuine and impostor pairs are needed.")
+
+    (thresholds, tar, far) = getROC(genHist, impHist, args.maxDistance)
+    outDir = args.outDir or args.workDir
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    fName = os.path.join(outDir, 'roc.csv')
+    with open(fName, 'w') as f:
+        f.write("threshold,genuine,impostor,tar,far\n")
+        for row in zip(thresholds, genHist, impHist, tar, far):
+            f.write("{:.6g},{},{},{:.8g},{:.8g}\n".format(*row))
+    print("Wrote the ROC to '{}'.".format(fName))
+
+    (eer, threshold) = getEER(thresholds, tar, far)
+    print("EER: {:0.4f} at threshold {:0.4f}".format(eer, threshold))
+    for targetFar in sorted(args.far):
+        if targetFar * nImpostor < 1:
+            print("TAR@FAR={:g}: too few impostor pairs".format(targetFar))
+            continue
+        (rate, threshold) = getTARatFAR(thresholds, tar, far, targetFar)
+        print("TAR@FAR={:g}: {:0.4f} at threshold {:0.4f}".format(targetFar, rate, threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,14 @@
 from __future__ import absolute_import
 
 from .align_dlib import AlignDlib
-from .torch_neural_net import TorchNeuralNet
+from .video_align import VideoAligner, FaceTrack
+from .torch_neural_net import TorchNeuralNet, TorchNeuralNetPool
+from .opencv_neural_net import OpenCVNeuralNet
+from .embedding_cache import EmbeddingCache
+from .helper import loadNet
+from .search import FlatIndex, IVFPQIndex
+from .gallery import Gallery
+from .nearest_class_mean import NearestClassMean
 
 from . import data
 from . import helper
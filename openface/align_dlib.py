@@ -77,37 +77,86 @@ class AlignDlib:
     INNER_EYES_AND_BOTTOM_LIP = [39, 42, 57]
     OUTER_EYES_AND_NOSE = [36, 45, 33]
 
-    def __init__(self, facePredictor):
+    def __init__(self, facePredictor, detectionScale=1.0, upsample=1):
         """
         Instantiate an 'AlignDlib' object.
 
         :param facePredictor: The path to dlib's
         :type facePredictor: str
+        :param detectionScale: Scale images by this factor before detecting \
+                               faces. Bounding boxes are mapped back to the \
+                               original image, so values below 1 speed up \
+                               detection on large images at the cost of \
+                               missing small faces.
+        :type detectionScale: float
+        :param upsample: The number of times the detector upsamples \
+                         images to find smaller faces.
+        :type upsample: int
         """
         assert facePredictor is not None
+        assert detectionScale > 0
+        assert upsample >= 0
 
+        self.detectionScale = detectionScale
+        self.upsample = upsample
         self.detector = dlib.get_frontal_face_detector()
         self.predictor = dlib.shape_predictor(facePredictor)
+        self._templateTargets = {}
 
-    def getAllFaceBoundingBoxes(self, rgbImg):
+    def _templateTarget(self, imgDim, landmarkIndices):
+        # The locations the landmarks are transformed to only
+        # depend on imgDim and the indices, so compute them once.
+        key = (imgDim, tuple(landmarkIndices))
+        target = self._templateTargets.get(key)
+        if target is None:
+            target = np.float32(imgDim * MINMAX_TEMPLATE[np.array(landmarkIndices)])
+            self._templateTargets[key] = target
+        return target
+
+    def getAllFaceBoundingBoxes(self, rgbImg, detectionScale=None, upsample=None):
         """
         Find all face bounding boxes in an image.
 
         :param rgbImg: RGB image to process. Shape: (height, width, 3)
         :type rgbImg: numpy.ndarray
-        :return: All face bounding boxes in an image.
+        :param detectionScale: Overrides the `detectionScale` \
+                               the object was created with.
+        :type detectionScale: float
+        :param upsample: Overrides the `upsample` the object was created with.
+        :type upsample: int
+        :return: All face bounding boxes in an image, \
+                 in the original image's coordinates.
         :rtype: dlib.rectangles
         """
         assert rgbImg is not None
 
+        if detectionScale is None:
+            detectionScale = self.detectionScale
+        if upsample is None:
+            upsample = self.upsample
+
         try:
-            return self.detector(rgbImg, 1)
+            if detectionScale == 1.0:
+                return self.detector(rgbImg, upsample)
+            smallImg = cv2.resize(rgbImg, (0, 0), fx=detectionScale,
+                                  fy=detectionScale,
+                                  interpolation=cv2.INTER_AREA)
+            smallBbs = self.detector(smallImg, upsample)
         except Exception as e:
             print("Warning: {}".format(e))
             # In rare cases, exceptions are thrown.
             return []
 
-    def getLargestFaceBoundingBox(self, rgbImg, skipMulti=False):
+        bbs = dlib.rectangles()
+        for bb in smallBbs:
+            bbs.append(dlib.rectangle(int(round(bb.left() / detectionScale)),
+                                      int(round(bb.top() / detectionScale)),
+                                      int(round(bb.right() / detectionScale)),
+                                      int(round(bb.bottom() / detectionScale))))
+        return bbs
+
+    def getLargestFaceBoundingBox(self, rgbImg, skipMulti=False,
+                                  detectionScale=None, upsample=None):
         """
         Find the largest face bounding box in an image.
 
@@ -115,12 +164,17 @@ class AlignDlib:
         :type rgbImg: numpy.ndarray
         :param skipMulti: Skip image if more than one face detected.
         :type skipMulti: bool
+        :param detectionScale: Overrides the `detectionScale` \
+                               the object was created with.
+        :type detectionScale: float
+        :param upsample: Overrides the `upsample` the object was created with.
+        :type upsample: int
         :return: The largest face bounding box in an image, or None.
         :rtype: dlib.rectangle
         """
         assert rgbImg is not None
 
-        faces = self.getAllFaceBoundingBoxes(rgbImg)
+        faces = self.getAllFaceBoundingBoxes(rgbImg, detectionScale, upsample)
         if (not skipMulti and len(faces) > 0) or len(faces) == 1:
             return max(faces, key=lambda rect: rect.width() * rect.height())
         else:
@@ -183,7 +237,48 @@ class AlignDlib:
         npLandmarkIndices = np.array(landmarkIndices)
 
         H = cv2.getAffineTransform(npLandmarks[npLandmarkIndices],
-                                   imgDim * MINMAX_TEMPLATE[npLandmarkIndices])
+                                   self._templateTarget(imgDim, landmarkIndices))
         thumbnail = cv2.warpAffine(rgbImg, H, (imgDim, imgDim))
 
         return thumbnail
+
+    def alignMany(self, imgDim, rgbImg, bbs,
+                  landmarkIndices=INNER_EYES_AND_BOTTOM_LIP):
+        r"""alignMany(imgDim, rgbImg, bbs, landmarkIndices=INNER_EYES_AND_BOTTOM_LIP)
+
+        Transform and align every face in an image.
+
+        Only the landmarks in `landmarkIndices` are read from dlib's
+        predictions, and the result can be passed directly to a
+        batched forward pass such as
+        :meth:`openface.TorchNeuralNet.forwardBatch`.
+
+        :param imgDim: The edge length in pixels of the square the images are resized to.
+        :type imgDim: int
+        :param rgbImg: RGB image to process. Shape: (height, width, 3)
+        :type rgbImg: numpy.ndarray
+        :param bbs: Bounding boxes around the faces to align.
+        :type bbs: list of dlib.rectangle or dlib.rectangles
+        :param landmarkIndices: The indices to transform to.
+        :type landmarkIndices: list of ints
+        :return: The aligned RGB images, in the order of `bbs`. \
+                 Shape: (N, imgDim, imgDim, 3)
+        :rtype: numpy.ndarray
+        """
+        assert imgDim is not None
+        assert rgbImg is not None
+        assert bbs is not None
+        assert landmarkIndices is not None
+
+        target = self._templateTarget(imgDim, landmarkIndices)
+        thumbnails = np.empty((len(bbs), imgDim, imgDim, 3), dtype=np.uint8)
+        npLandmarks = np.empty((len(landmarkIndices), 2), dtype=np.float32)
+        for i, bb in enumerate(bbs):
+            points = self.predictor(rgbImg, bb)
+            for j, idx in enumerate(landmarkIndices):
+                p = points.part(idx)
+                npLandmarks[j] = (p.x, p.y)
+            H = cv2.getAffineTransform(npLandmarks, target)
+            thumbnails[i] = cv2.warpAffine(rgbImg, H, (imgDim, imgDim))
+
+        return thumbnails
@@ -16,14 +16,22 @@
 
 """Module for image data."""
 
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+import json
 import os
 
 import cv2
+import numpy as np
 
 
-class Image:
+class Image(object):
     """Object containing image metadata."""
 
+    __slots__ = ('cls', 'name', 'path')
+
     def __init__(self, cls, name, path):
         """
         Instantiate an 'Image' object.
@@ -43,32 +51,29 @@ class Image:
         self.name = name
         self.path = path
 
-    def getBGR(self):
+    def getBGR(self, reduce=1):
         """
         Load the image from disk in BGR format.
 
+        :param reduce: Decode the image at 1/2, 1/4 or 1/8 of its \
+                       resolution, which is faster for large images.
+        :type reduce: int
         :return: BGR image. Shape: (height, width, 3)
         :rtype: numpy.ndarray
         """
-        try:
-            bgr = cv2.imread(self.path)
-        except:
-            bgr = None
-        return bgr
+        return _readBGR(self.path, reduce)
 
-    def getRGB(self):
+    def getRGB(self, reduce=1):
         """
         Load the image from disk in RGB format.
 
+        :param reduce: Decode the image at 1/2, 1/4 or 1/8 of its \
+                       resolution, which is faster for large images.
+        :type reduce: int
         :return: RGB image. Shape: (height, width, 3)
         :rtype: numpy.ndarray
         """
-        bgr = self.getBGR()
-        if bgr is not None:
-            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-        else:
-            rgb = None
-        return rgb
+        return _readRGB(self.path, reduce)
 
     def __repr__(self):
         """String representation for printing."""
@@ -112,3 +117,604 @@ def iterImgs(directory):
             (imageName, ext) = os.path.splitext(fName)
             if ext.lower() in exts:
                 yield Image(imageClass, imageName, os.path.join(subdir, fName))
+
+
+def _encodePath(path):
+    if isinstance(path, bytes):
+        return path
+    return path.encode('utf-8', 'surrogateescape')
+
+
+def _decodePath(path):
+    if bytes is str:
+        return path
+    return path.decode('utf-8', 'surrogateescape')
+
+
+class ImageCatalog(object):
+    """
+    Compact list of the images in a directory, organized like
+    in :func:`iterImgs`.
+
+    Instead of an :class:`Image` object per image, the catalog
+    stores an array of class ids and the image paths in a single
+    buffer, so very large datasets take little memory.
+    :class:`Image` objects are only created when indexed.
+    A catalog can be saved and loaded again without walking the
+    directory.
+
+    .. code:: python
+
+        catalog = ImageCatalog.build(directory)
+        catalog.save('catalog.npz')
+        catalog = ImageCatalog.load('catalog.npz')
+        for img in catalog:
+            rgbImg = img.getRGB()
+    """
+
+    def __init__(self, root, classes, classIds, offsets, pathBuf):
+        """
+        Instantiate an 'ImageCatalog' object.
+        Use :meth:`build` or :meth:`load` to create a catalog.
+
+        :param root: The directory the paths are relative to.
+        :type root: str
+        :param classes: The names of the classes.
+        :type classes: list of str
+        :param classIds: The index in `classes` of each image's class.
+        :type classIds: numpy.ndarray
+        :param offsets: The start of each image's path in `pathBuf`, \
+                        followed by the end of the last path.
+        :type offsets: numpy.ndarray
+        :param pathBuf: The encoded paths, relative to `root`.
+        :type pathBuf: bytes
+        """
+        assert len(offsets) == len(classIds) + 1
+
+        self.root = root
+        self.classes = classes
+        self.classIds = classIds
+        self.offsets = offsets
+        self.pathBuf = pathBuf
+
+    @classmethod
+    def build(cls, directory):
+        """
+        Catalog the images in a directory.
+
+        The directory is walked in sorted order,
+        so the catalog's order is the same on every run.
+
+        :param directory: The directory to catalog.
+        :type directory: str
+        :return: The catalog.
+        :rtype: :class:`ImageCatalog`
+        """
+        assert directory is not None
+
+        exts = [".jpg", ".jpeg", ".png"]
+
+        classes = []
+        classIndex = {}
+        classIds = array('i')
+        # Python 2 has no 'q' typecode, but its 'l' is 64 bits on
+        # 64-bit Linux and macOS. The offsets are widened below either way.
+        offsets = array('l', [0])
+        pathBuf = bytearray()
+        for subdir, dirs, files in os.walk(directory):
+            dirs.sort()
+            imageClass = os.path.basename(subdir)
+            for fName in sorted(files):
+                if os.path.splitext(fName)[1].lower() not in exts:
+                    continue
+                if imageClass not in classIndex:
+                    classIndex[imageClass] = len(classes)
+                    classes.append(imageClass)
+                classIds.append(classIndex[imageClass])
+                # Store the path without the directory, exactly as
+                # it is added back by `path`.
+                pathBuf.extend(_encodePath(os.path.join(subdir, fName)[len(directory):]))
+                offsets.append(len(pathBuf))
+
+        offsets = np.frombuffer(offsets, dtype='i{}'.format(offsets.itemsize))
+        return cls(directory, classes,
+                   np.frombuffer(classIds, dtype=np.int32).copy(),
+                   offsets.astype(np.int64),
+                   bytes(pathBuf))
+
+    @classmethod
+    def load(cls, fName):
+        """
+        Load a catalog saved with :meth:`save`.
+
+        :param fName: The catalog's file.
+        :type fName: str
+        :return: The catalog.
+        :rtype: :class:`ImageCatalog`
+        """
+        assert fName is not None
+
+        with np.load(fName) as f:
+            return cls(_decodePath(f['root'].tobytes()),
+                       [_decodePath(c) for c in f['classes'].tobytes().split(b'\0')]
+                       if f['classes'].size > 0 else [],
+                       f['classIds'], f['offsets'], f['pathBuf'].tobytes())
+
+    def save(self, fName):
+        """
+        Save the catalog.
+
+        :param fName: The file to save the catalog to, usually ending in ``.npz``.
+        :type fName: str
+        """
+        assert fName is not None
+
+        def toArray(b):
+            return np.frombuffer(b, dtype=np.uint8)
+        with open(fName, 'wb') as f:
+            np.savez(f, root=toArray(_encodePath(self.root)),
+                     classes=toArray(b'\0'.join(_encodePath(c) for c in self.classes)),
+                     classIds=self.classIds, offsets=self.offsets,
+                     pathBuf=toArray(self.pathBuf))
+
+    def __len__(self):
+        """The number of images in the catalog."""
+        return len(self.classIds)
+
+    def __getitem__(self, i):
+        """
+        Get an image's metadata.
+
+        :param i: The index of the image.
+        :type i: int
+        :rtype: :class:`Image`
+        """
+        path = self.path(i)
+        name = os.path.splitext(os.path.basename(path))[0]
+        return Image(self.cls(i), name, path)
+
+    def __iter__(self):
+        """Iterate through the images' metadata."""
+        for i in range(len(self)):
+            yield self[i]
+
+    def cls(self, i):
+        """
+        Get an image's class.
+
+        :param i: The index of the image.
+        :type i: int
+        :return: The name of the image's class.
+        :rtype: str
+        """
+        return self.classes[self.classIds[i]]
+
+    def path(self, i):
+        """
+        Get an image's path.
+
+        :param i: The index of the image.
+        :type i: int
+        :return: The path to the image on disk.
+        :rtype: str
+        """
+        return self.root + _decodePath(self.pathBuf[self.offsets[i]:self.offsets[i + 1]])
+
+
+def _readBGR(path, reduce=1):
+    if reduce == 1:
+        flags = cv2.IMREAD_COLOR
+    else:
+        flags = {2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}[reduce]
+    try:
+        bgr = cv2.imread(path, flags)
+    except:
+        bgr = None
+    return bgr
+
+
+def _readRGB(path, reduce=1):
+    bgr = _readBGR(path, reduce)
+    if bgr is not None:
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    else:
+        rgb = None
+    return rgb
+
+
+def iterRGB(imgs, nWorkers=4, prefetch=16, reduce=1, processes=False):
+    """
+    Load images in the background while the caller processes them.
+
+    Images are decoded by a pool of threads, or processes if
+    `processes` is True, and at most `prefetch` of them are
+    kept in memory ahead of the caller. They are returned in
+    the same order as `imgs`.
+
+    .. code:: python
+
+        for (img, rgbImg) in iterRGB(iterImgs(directory)):
+            if rgbImg is not None:
+                bb = align.getLargestFaceBoundingBox(rgbImg)
+
+    :param imgs: The images to load.
+    :type imgs: iterable of :class:`Image`
+    :param nWorkers: The number of threads or processes decoding images.
+    :type nWorkers: int
+    :param prefetch: The maximum number of images loaded ahead.
+    :type prefetch: int
+    :param reduce: Decode the images at 1/2, 1/4 or 1/8 of their resolution.
+    :type reduce: int
+    :param processes: Decode the images in processes instead of threads.
+    :type processes: bool
+    :return: An iterator over (Image, RGB image) tuples, where the RGB \
+             image is None if the image couldn't be loaded.
+    """
+    assert imgs is not None
+    assert nWorkers > 0
+    assert prefetch > 0
+    assert reduce in (1, 2, 4, 8)
+
+    if processes:
+        executor = ProcessPoolExecutor(nWorkers)
+    else:
+        executor = ThreadPoolExecutor(nWorkers)
+    pending = deque()
+    try:
+        for img in imgs:
+            pending.append((img, executor.submit(_readRGB, img.path, reduce)))
+            if len(pending) >= prefetch:
+                (img, future) = pending.popleft()
+                yield (img, future.result())
+        while len(pending) > 0:
+            (img, future) = pending.popleft()
+            yield (img, future.result())
+    finally:
+        for (img, future) in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class PackedFaceWriter:
+    """
+    Write aligned faces to a packed store that is read with
+    :class:`PackedFaces`.
+
+    Instead of one small image file per face, a packed store is a
+    directory with three files:
+
+    + ``faces.bin``: The RGB faces as one uint8 array. Shape: (N, imgDim, imgDim, 3)
+    + ``index.csv``: The class, name and source path of each face.
+    + ``info.json``: The store's format, such as ``imgDim``.
+
+    Faces are appended to an existing store. It can be used as a context manager.
+
+    .. code:: python
+
+        with PackedFaceWriter('aligned', 96) as writer:
+            writer.add(alignedFace, 'person-1', 'image-1', 'raw/person-1/image-1.jpg')
+    """
+
+    def __init__(self, directory, imgDim):
+        """
+        Instantiate a 'PackedFaceWriter' object.
+
+        :param directory: The store's directory. Created if it doesn't exist.
+        :type directory: str
+        :param imgDim: The edge length of the square faces.
+        :type imgDim: int
+        """
+        assert directory is not None
+        assert imgDim is not None
+
+        self.directory = directory
+        self.imgDim = imgDim
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        infoPath = os.path.join(directory, 'info.json')
+        if os.path.isfile(infoPath):
+            with open(infoPath, 'r') as f:
+                info = json.load(f)
+            if info['imgDim'] != imgDim:
+                raise Exception("Packed store {} has faces of size {}, not {}.".format(
+                    directory, info['imgDim'], imgDim))
+        else:
+            with open(infoPath, 'w') as f:
+                json.dump({'version': 1, 'imgDim': imgDim,
+                           'dtype': 'uint8', 'channels': 'RGB'}, f)
+
+        # Drop a face that was only partially written by an interrupted writer.
+        n = _packedCount(directory, imgDim)
+        self._facesFile = open(os.path.join(directory, 'faces.bin'), 'ab')
+        self._facesFile.truncate(n * imgDim * imgDim * 3)
+        _truncateIndex(os.path.join(directory, 'index.csv'), n)
+        self._indexFile = open(os.path.join(directory, 'index.csv'), 'a')
+        self._index = csv.writer(self._indexFile, lineterminator='\n')
+
+        #: The number of faces in the store.
+        self.count = n
+
+    def __enter__(self):
+        """Part of the context manger protocol. See PEP 343"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Part of the context manger protocol. See PEP 343"""
+        self.close()
+
+    def add(self, rgbImg, cls, name, path):
+        """
+        Append an aligned face to the store.
+
+        :param rgbImg: RGB face. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :param cls: The face's class; the name of the person.
+        :type cls: str
+        :param name: The face's name.
+        :type name: str
+        :param path: Path to the image the face is from.
+        :type path: str
+        :return: The face's position in the store.
+        :rtype: int
+        """
+        assert rgbImg is not None
+        assert rgbImg.shape == (self.imgDim, self.imgDim, 3)
+
+        # The face is written before its index entry so
+        # readers never see an entry without its face.
+        self._facesFile.write(np.ascontiguousarray(rgbImg, dtype=np.uint8).tobytes())
+        self._facesFile.flush()
+        self._index.writerow([cls, name, path])
+        self._indexFile.flush()
+        self.count += 1
+        return self.count - 1
+
+    def close(self):
+        """Close the store's files."""
+        self._facesFile.close()
+        self._indexFile.close()
+
+
+class PackedFaces:
+    """
+    Read a packed store of aligned faces written by :class:`PackedFaceWriter`.
+
+    The faces are memory-mapped, so indexing and slicing return
+    views of the file without copying or loading the whole store.
+
+    .. code:: python
+
+        faces = PackedFaces('aligned')
+        reps = net.forwardBatch(faces[0:64])
+        print(faces.classes[0], faces.names[0], faces.paths[0])
+    """
+
+    def __init__(self, directory):
+        """
+        Instantiate a 'PackedFaces' object.
+
+        :param directory: The store's directory.
+        :type directory: str
+        """
+        assert directory is not None
+
+        with open(os.path.join(directory, 'info.json'), 'r') as f:
+            info = json.load(f)
+
+        self.directory = directory
+        self.imgDim = info['imgDim']
+
+        n = _packedCount(directory, self.imgDim)
+        rows = []
+        if n > 0:
+            lines = _indexLines(os.path.join(directory, 'index.csv'))[0]
+            rows = [row for _, row in zip(range(n), csv.reader(lines))]
+
+        #: The class of each face.
+        self.classes = [row[0] for row in rows]
+        #: The name of each face.
+        self.names = [row[1] for row in rows]
+        #: The source path of each face.
+        self.paths = [row[2] for row in rows]
+
+        shape = (n, self.imgDim, self.imgDim, 3)
+        if n > 0:
+            #: All of the faces. Shape: (N, imgDim, imgDim, 3)
+            self.faces = np.memmap(os.path.join(directory, 'faces.bin'),
+                                   dtype=np.uint8, mode='r', shape=shape)
+        else:
+            self.faces = np.empty(shape, dtype=np.uint8)
+
+    def __len__(self):
+        """The number of faces in the store."""
+        return len(self.faces)
+
+    def __getitem__(self, i):
+        """
+        Get faces without copying them.
+
+        :param i: The index or slice of the faces.
+        :type i: int or slice
+        :return: RGB faces. Shape: (imgDim, imgDim, 3) or (N, imgDim, imgDim, 3)
+        :rtype: numpy.ndarray
+        """
+        return self.faces[i]
+
+    def image(self, i):
+        """
+        Get a face's metadata.
+
+        :param i: The index of the face.
+        :type i: int
+        :return: The face's class, name and source path.
+        :rtype: :class:`Image`
+        """
+        return Image(self.classes[i], self.names[i], self.paths[i])
+
+    def iterBatches(self, batchSize):
+        """
+        Iterate through the store in batches.
+
+        :param batchSize: The maximum number of faces in a batch.
+        :type batchSize: int
+        :return: An iterator over (index of the first face, faces) tuples, \
+                 where the faces are views of the store.
+        """
+        assert batchSize > 0
+
+        for start in range(0, len(self), batchSize):
+            yield (start, self.faces[start:start + batchSize])
+
+
+def _indexLines(indexPath):
+    # The complete lines of an index. A last line without a newline
+    # was only partially written by an interrupted writer.
+    with open(indexPath, 'r') as f:
+        lines = list(f)
+    partial = len(lines) > 0 and not lines[-1].endswith('\n')
+    return (lines[:-1] if partial else lines, partial)
+
+
+def _packedCount(directory, imgDim):
+    # The number of faces that have both their pixels and an index entry.
+    facesPath = os.path.join(directory, 'faces.bin')
+    indexPath = os.path.join(directory, 'index.csv')
+    nFaces = os.path.getsize(facesPath) // (imgDim * imgDim * 3) \
+        if os.path.isfile(facesPath) else 0
+    nRows = 0
+    if os.path.isfile(indexPath):
+        nRows = sum(1 for _ in csv.reader(_indexLines(indexPath)[0]))
+    return min(nFaces, nRows)
+
+
+def _truncateIndex(indexPath, n):
+    if not os.path.isfile(indexPath):
+        return
+    (lines, partial) = _indexLines(indexPath)
+    rows = list(csv.reader(lines))
+    if len(rows) > n or partial:
+        with open(indexPath, 'w') as f:
+            csv.writer(f, lineterminator='\n').writerows(rows[:n])
+
+
+class EmbeddingStore(object):
+    """
+    Representations of images with their labels and paths,
+    such as the output of ``batch-represent``.
+
+    In a work directory, the representations are stored as a binary
+    float32 matrix in ``reps.npy`` and the labels in ``labels.npy``,
+    which are memory-mapped so loading doesn't depend on their size.
+    The labels and paths are also in ``labels.csv``, in the same
+    format as ``batch-represent``'s output.
+    Work directories with only ``reps.csv`` and ``labels.csv``
+    can still be loaded and converted with :meth:`save`.
+
+    .. code:: python
+
+        store = EmbeddingStore.load(workDir)
+        store.save(workDir)  # Convert CSV to binary.
+        X, y = store.reps, store.labels
+    """
+
+    def __init__(self, reps, labels, paths=None, pathsFile=None):
+        """
+        Instantiate an 'EmbeddingStore' object.
+
+        :param reps: The representations, one row per image. Shape: (N, repDim)
+        :type reps: numpy.ndarray
+        :param labels: The numeric label of each image. Shape: (N,)
+        :type labels: numpy.ndarray
+        :param paths: The path of each image.
+        :type paths: list of str
+        :param pathsFile: A ``labels.csv`` file to read the paths \
+                          from when they are first used instead.
+        :type pathsFile: str
+        """
+        assert reps is not None
+        assert labels is not None
+        assert len(reps) == len(labels)
+        assert paths is not None or pathsFile is not None
+
+        self.reps = reps
+        self.labels = labels
+        self._paths = paths
+        self._pathsFile = pathsFile
+
+    def __len__(self):
+        """The number of representations."""
+        return len(self.reps)
+
+    @property
+    def paths(self):
+        """The path of each image."""
+        if self._paths is None:
+            with open(self._pathsFile, 'r') as f:
+                self._paths = [row[1] for row in csv.reader(f)]
+        return self._paths
+
+    @classmethod
+    def load(cls, workDir, mmap=True):
+        """
+        Load the representations in a work directory.
+
+        :param workDir: The directory with ``reps.npy`` and ``labels.npy``, \
+                        or ``reps.csv`` and ``labels.csv``.
+        :type workDir: str
+        :param mmap: Memory-map the binary representations instead of \
+                     reading them into memory.
+        :type mmap: bool
+        :return: The representations.
+        :rtype: :class:`EmbeddingStore`
+        """
+        assert workDir is not None
+
+        labelsCsv = os.path.join(workDir, 'labels.csv')
+        repsCsv = os.path.join(workDir, 'reps.csv')
+        repsNpy = os.path.join(workDir, 'reps.npy')
+        # Ignore binary representations older than the CSV ones,
+        # such as when ``batch-represent`` is run again.
+        if os.path.isfile(repsNpy) and \
+                (not os.path.isfile(repsCsv) or
+                 os.path.getmtime(repsNpy) >= os.path.getmtime(repsCsv)):
+            mmapMode = 'r' if mmap else None
+            return cls(np.load(repsNpy, mmap_mode=mmapMode),
+                       np.load(os.path.join(workDir, 'labels.npy'), mmap_mode=mmapMode),
+                       pathsFile=labelsCsv)
+
+        with open(labelsCsv, 'r') as f:
+            rows = list(csv.reader(f))
+        reps = np.loadtxt(repsCsv, delimiter=',', dtype=np.float32, ndmin=2)
+        return cls(reps, np.array([int(row[0]) for row in rows], dtype=np.int32),
+                   paths=[row[1] for row in rows])
+
+    def save(self, workDir):
+        """
+        Save the representations in binary format.
+
+        :param workDir: The directory to write ``reps.npy``, ``labels.npy`` \
+                        and ``labels.csv`` to.
+        :type workDir: str
+        """
+        assert workDir is not None
+
+        if not os.path.isdir(workDir):
+            os.makedirs(workDir)
+        paths = self.paths
+        # Write the index first, so `reps.npy` only exists once
+        # the directory is complete.
+        with open(os.path.join(workDir, 'labels.csv.tmp'), 'w') as f:
+            w = csv.writer(f, lineterminator='\n')
+            for label, path in zip(self.labels, paths):
+                w.writerow([int(label), path])
+        os.rename(os.path.join(workDir, 'labels.csv.tmp'),
+                  os.path.join(workDir, 'labels.csv'))
+        np.save(os.path.join(workDir, 'labels.npy'),
+                np.asarray(self.labels, dtype=np.int32))
+        with open(os.path.join(workDir, 'reps.npy.tmp'), 'wb') as f:
+            np.save(f, np.asarray(self.reps, dtype=np.float32))
+        os.rename(os.path.join(workDir, 'reps.npy.tmp'),
+                  os.path.join(workDir, 'reps.npy'))
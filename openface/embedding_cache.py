@@ -0,0 +1,234 @@
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for caching representations of aligned faces."""
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+import numpy as np
+import cv2
+
+from .helper import mkdirP
+
+
+class EmbeddingCache:
+    """
+    Cache the representations computed by a neural network.
+
+    Representations are keyed by a hash of the aligned face's pixels,
+    the network's model path and its input dimension, so the same face
+    is only passed through the network once.
+    The most recently used representations are kept in memory and,
+    if `cacheDir` is given, every representation is also stored on disk
+    so it survives between runs.
+
+    The interface is the same as :class:`openface.TorchNeuralNet`.
+
+    .. code:: python
+
+        net = EmbeddingCache(TorchNeuralNet(model=model), maxEntries=100000)
+        rep = net.forward(alignedFace)
+        print(net.hits, net.misses, net.evictions)
+    """
+
+    def __init__(self, net, maxEntries=10000, cacheDir=None):
+        """
+        Instantiate an 'EmbeddingCache' object.
+
+        :param net: The neural network to cache, such as a \
+                    :class:`openface.TorchNeuralNet`.
+        :param maxEntries: The maximum number of representations kept in memory.
+        :type maxEntries: int
+        :param cacheDir: Directory to also store representations in. \
+                         Representations are only kept in memory if `None`.
+        :type cacheDir: str
+        """
+        assert net is not None
+        assert maxEntries > 0
+
+        self.net = net
+        self.model = net.model
+        self.imgDim = net.imgDim
+        self.maxEntries = maxEntries
+        self.cacheDir = cacheDir
+        if cacheDir is not None:
+            mkdirP(cacheDir)
+
+        #: The number of representations found in the cache.
+        self.hits = 0
+        #: The number of representations found on disk.
+        self.diskHits = 0
+        #: The number of representations computed by the network.
+        self.misses = 0
+        #: The number of representations evicted from memory.
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._keyPrefix = "{}\0{}\0".format(self.model, self.imgDim).encode('utf-8')
+
+    def key(self, rgbImg):
+        """
+        Compute the cache key of an aligned face.
+
+        :param rgbImg: RGB image. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :return: The hexadecimal key.
+        :rtype: str
+        """
+        assert rgbImg is not None
+
+        rgbImg = np.ascontiguousarray(rgbImg)
+        h = hashlib.sha1(self._keyPrefix)
+        h.update(str(rgbImg.shape).encode('utf-8'))
+        h.update(rgbImg.dtype.str.encode('utf-8'))
+        h.update(rgbImg.data)
+        return h.hexdigest()
+
+    def stats(self):
+        """
+        Get the cache's counters for monitoring.
+
+        :return: The number of hits, disk hits, misses, evictions \
+                 and representations in memory.
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'diskHits': self.diskHits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+    def clear(self):
+        """Remove all representations from memory."""
+        with self._lock:
+            self._entries.clear()
+
+    def _diskPath(self, key):
+        return os.path.join(self.cacheDir, key[:2], key + '.npy')
+
+    def _get(self, key):
+        with self._lock:
+            rep = self._entries.pop(key, None)
+            if rep is not None:
+                self._entries[key] = rep
+                self.hits += 1
+                return rep
+
+        if self.cacheDir is not None:
+            try:
+                rep = np.load(self._diskPath(key))
+            except (IOError, ValueError):
+                rep = None
+            if rep is not None:
+                self._put(key, rep, False)
+                with self._lock:
+                    self.hits += 1
+                    self.diskHits += 1
+                return rep
+        return None
+
+    def _put(self, key, rep, toDisk=True):
+        with self._lock:
+            self._entries[key] = rep
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        if toDisk and self.cacheDir is not None:
+            fName = self._diskPath(key)
+            mkdirP(os.path.dirname(fName))
+            # Write to a temporary file first so readers never
+            # see a partially written representation.
+            tmpName = "{}.{}.tmp".format(fName, os.getpid())
+            with open(tmpName, 'wb') as f:
+                np.save(f, rep)
+            os.rename(tmpName, fName)
+
+    def forwardPath(self, imgPath):
+        """
+        Perform a forward network pass of an image on disk,
+        using the cached representation if there is one.
+
+        :param imgPath: The path to the image.
+        :type imgPath: str
+        :return: Vector of features extracted with the neural network.
+        :rtype: numpy.ndarray
+        """
+        assert imgPath is not None
+
+        bgrImg = cv2.imread(imgPath)
+        if bgrImg is None:
+            raise Exception("Unable to load image: {}".format(imgPath))
+        rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+        return self.forward(rgbImg)
+
+    def forward(self, rgbImg):
+        """
+        Perform a forward network pass of an RGB image,
+        using the cached representation if there is one.
+
+        :param rgbImg: RGB image to process. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :return: Vector of features extracted from the neural network.
+        :rtype: numpy.ndarray
+        """
+        assert rgbImg is not None
+
+        key = self.key(rgbImg)
+        rep = self._get(key)
+        if rep is None:
+            rep = self.net.forward(rgbImg).astype(np.float32)
+            with self._lock:
+                self.misses += 1
+            self._put(key, rep)
+        return rep.astype(np.float64)
+
+    def forwardBatch(self, rgbImgs):
+        """
+        Perform a forward network pass of a batch of RGB images.
+
+        Only the images without a cached representation are
+        passed through the network, in a single batch,
+        and repeated images are only passed through once.
+
+        :param rgbImgs: RGB images to process. Shape: (N, imgDim, imgDim, 3)
+        :type rgbImgs: list of numpy.ndarray or numpy.ndarray
+        :return: Matrix of features extracted from the neural network, \
+                 one row per image. Shape: (N, 128)
+        :rtype: numpy.ndarray
+        """
+        assert rgbImgs is not None
+
+        keys = [self.key(rgbImg) for rgbImg in rgbImgs]
+        reps = [self._get(key) for key in keys]
+        # Repeated faces are only passed through the network once.
+        missing = OrderedDict()
+        for i, rep in enumerate(reps):
+            if rep is None:
+                missing.setdefault(keys[i], []).append(i)
+        if len(missing) > 0:
+            newReps = self.net.forwardBatch([rgbImgs[idx[0]] for idx in missing.values()])
+            with self._lock:
+                self.misses += len(missing)
+            for ((key, idx), rep) in zip(missing.items(), newReps):
+                rep = rep.astype(np.float32)
+                for i in idx:
+                    reps[i] = rep
+                self._put(key, rep)
+        if len(reps) == 0:
+            return np.empty((0, 128), dtype=np.float32)
+        return np.vstack(reps)
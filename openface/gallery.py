@@ -0,0 +1,322 @@
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for persistent galleries of enrolled faces."""
+
+from collections import OrderedDict
+import json
+import os
+import threading
+
+import numpy as np
+
+from .helper import mkdirP
+
+
+class Gallery:
+    """
+    A persistent gallery of enrolled faces' representations.
+
+    Every face has a unique key, such as a hash of its image,
+    and a label, such as the index of the person it belongs to.
+    A gallery is a directory with:
+
+    + ``info.json``: The representations' dimension and the current generation.
+    + ``reps-<generation>.bin``: The representations as appended float32 rows.
+    + ``log-<generation>.jsonl``: One line per add, remove or relabel.
+
+    Changes only append to the two files, so enrolling a face costs
+    one row and one log line no matter how big the gallery is.
+    The log is replayed when a gallery is opened, and rows or lines
+    left incomplete by an interrupted writer are dropped.
+    Rows of removed or replaced faces are reclaimed by :meth:`compact`,
+    which writes the next generation of files and then switches
+    ``info.json`` to it. It runs automatically once more than
+    `autoCompact` of the rows are unused.
+    The representations are read through a memory map.
+
+    .. code:: python
+
+        with Gallery('gallery') as gallery:
+            gallery.add(phash, rep, identity)
+            gallery.relabel(phash, otherIdentity)
+            X, y = gallery.reps, gallery.labels
+    """
+
+    def __init__(self, directory, dim=128, autoCompact=0.5, sync=False):
+        """
+        Open or create a 'Gallery'.
+
+        :param directory: The gallery's directory. Created if it doesn't exist.
+        :type directory: str
+        :param dim: The dimension of the representations.
+        :type dim: int
+        :param autoCompact: Compact the gallery once more than this \
+                            fraction of its rows are unused. \
+                            Never compact automatically if `None`.
+        :type autoCompact: float
+        :param sync: Flush every change to the disk with `fsync` \
+                     so it survives a power loss, not only a crash.
+        :type sync: bool
+        """
+        assert directory is not None
+        assert dim > 0
+
+        self.directory = directory
+        self.autoCompact = autoCompact
+        self.sync = sync
+
+        mkdirP(directory)
+        infoPath = os.path.join(directory, 'info.json')
+        if os.path.isfile(infoPath):
+            with open(infoPath, 'r') as f:
+                info = json.load(f)
+            if info['dim'] != dim:
+                raise Exception("Gallery {} has representations of dimension {}, not {}.".format(
+                    directory, info['dim'], dim))
+        else:
+            info = {'version': 1, 'dim': dim, 'generation': 0}
+            self._writeInfo(info)
+
+        self.dim = dim
+        self.generation = info['generation']
+
+        self._lock = threading.Lock()
+        self._open()
+
+    def _path(self, name, generation=None):
+        if generation is None:
+            generation = self.generation
+        return os.path.join(self.directory, name.format(generation))
+
+    def _writeInfo(self, info):
+        tmpPath = os.path.join(self.directory, 'info.json.tmp')
+        with open(tmpPath, 'w') as f:
+            json.dump(info, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpPath, os.path.join(self.directory, 'info.json'))
+
+    def _open(self):
+        # Replay the log. Every add uses the next row of the representations.
+        repsPath = self._path('reps-{}.bin')
+        logPath = self._path('log-{}.jsonl')
+        nComplete = os.path.getsize(repsPath) // (4 * self.dim) \
+            if os.path.isfile(repsPath) else 0
+        self._entries = OrderedDict()
+        self._nRows = 0
+        logSize = 0
+        if os.path.isfile(logPath):
+            with open(logPath, 'rb') as f:
+                for line in f:
+                    # Stop at a line that was only partially written,
+                    # or an add whose row was.
+                    if not line.endswith(b'\n'):
+                        break
+                    op = json.loads(line.decode('utf-8'))
+                    if op[0] == 'add':
+                        if self._nRows == nComplete:
+                            break
+                        self._entries.pop(op[1], None)
+                        self._entries[op[1]] = [self._nRows, op[2]]
+                        self._nRows += 1
+                    elif op[0] == 'remove':
+                        del self._entries[op[1]]
+                    elif op[0] == 'relabel':
+                        self._entries[op[1]][1] = op[2]
+                    else:
+                        raise Exception("Unrecognized gallery log entry: {}".format(op[0]))
+                    logSize += len(line)
+
+        self._repsFile = open(repsPath, 'ab')
+        self._repsFile.truncate(self._nRows * 4 * self.dim)
+        self._logFile = open(logPath, 'ab')
+        self._logFile.truncate(logSize)
+        self._reps = None
+
+    def __enter__(self):
+        """Part of the context manger protocol. See PEP 343"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Part of the context manger protocol. See PEP 343"""
+        self.close()
+
+    def __len__(self):
+        """The number of faces in the gallery."""
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """True if a face with the key is in the gallery."""
+        return key in self._entries
+
+    @property
+    def nUnused(self):
+        """The number of rows of removed or replaced faces."""
+        return self._nRows - len(self._entries)
+
+    def _map(self):
+        # Map the file again once rows are appended past the current map.
+        if self._reps is None or len(self._reps) < self._nRows:
+            if self._nRows == 0:
+                return np.empty((0, self.dim), dtype=np.float32)
+            self._reps = np.memmap(self._path('reps-{}.bin'), dtype=np.float32,
+                                   mode='r', shape=(self._nRows, self.dim))
+        return self._reps
+
+    def _append(self, op, rep=None):
+        if rep is not None:
+            self._repsFile.write(rep.tobytes())
+            self._repsFile.flush()
+            if self.sync:
+                os.fsync(self._repsFile.fileno())
+        # The log entry is written last, so it's only
+        # replayed once the representation is complete.
+        self._logFile.write((json.dumps(op) + '\n').encode('utf-8'))
+        self._logFile.flush()
+        if self.sync:
+            os.fsync(self._logFile.fileno())
+
+    def _checkCompact(self):
+        if self.autoCompact is not None and self.nUnused >= 1024 and \
+                self.nUnused > self.autoCompact * self._nRows:
+            self._compactLocked()
+
+    def add(self, key, rep, label):
+        """
+        Enroll a face, replacing the face with the same key.
+
+        :param key: The face's unique key.
+        :type key: str
+        :param rep: The face's representation. Shape: (dim,)
+        :type rep: numpy.ndarray
+        :param label: The face's label.
+        :type label: int
+        """
+        assert key is not None
+        rep = np.ascontiguousarray(rep, dtype=np.float32).reshape(-1)
+        if len(rep) != self.dim:
+            raise Exception("Expected a representation of dimension {}, got {}.".format(
+                self.dim, len(rep)))
+
+        with self._lock:
+            self._append(['add', key, _jsonLabel(label)], rep)
+            self._entries.pop(key, None)
+            self._entries[key] = [self._nRows, _jsonLabel(label)]
+            self._nRows += 1
+            self._checkCompact()
+
+    def remove(self, key):
+        """
+        Remove a face.
+
+        :param key: The face's key.
+        :type key: str
+        """
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self._append(['remove', key])
+            del self._entries[key]
+            self._checkCompact()
+
+    def relabel(self, key, label):
+        """
+        Change the label of a face.
+
+        :param key: The face's key.
+        :type key: str
+        :param label: The face's new label.
+        :type label: int
+        """
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            self._append(['relabel', key, _jsonLabel(label)])
+            self._entries[key][1] = _jsonLabel(label)
+
+    def get(self, key):
+        """
+        Get a face's representation and label.
+
+        :param key: The face's key.
+        :type key: str
+        :return: The representation and the label.
+        :rtype: tuple of numpy.ndarray and int
+        """
+        (row, label) = self._entries[key]
+        return (np.array(self._map()[row]), label)
+
+    def keys(self):
+        """
+        Get the keys of the faces, in the order they were enrolled.
+
+        :rtype: list of str
+        """
+        return list(self._entries.keys())
+
+    @property
+    def labels(self):
+        """The label of each face, in the order of :meth:`keys`."""
+        return [label for (row, label) in self._entries.values()]
+
+    @property
+    def reps(self):
+        """The representation of each face, in the order of :meth:`keys`. Shape: (N, dim)"""
+        rows = np.array([row for (row, label) in self._entries.values()], dtype=np.int64)
+        return np.array(self._map()[rows]) if len(rows) > 0 \
+            else np.empty((0, self.dim), dtype=np.float32)
+
+    def compact(self):
+        """Rewrite the gallery without the rows of removed and replaced faces."""
+        with self._lock:
+            self._compactLocked()
+
+    def _compactLocked(self):
+        generation = self.generation + 1
+        reps = self._map()
+        with open(self._path('reps-{}.bin', generation), 'wb') as repsFile, \
+                open(self._path('log-{}.jsonl', generation), 'wb') as logFile:
+            for (key, (row, label)) in self._entries.items():
+                repsFile.write(np.asarray(reps[row]).tobytes())
+                logFile.write((json.dumps(['add', key, label]) + '\n').encode('utf-8'))
+            for f in [repsFile, logFile]:
+                f.flush()
+                os.fsync(f.fileno())
+
+        # Switching `info.json` to the new generation is atomic,
+        # so an interrupted compaction leaves the old files in use.
+        self._writeInfo({'version': 1, 'dim': self.dim, 'generation': generation})
+        self._close()
+        for name in ['reps-{}.bin', 'log-{}.jsonl']:
+            os.remove(self._path(name))
+        self.generation = generation
+        self._open()
+
+    def _close(self):
+        self._reps = None
+        self._repsFile.close()
+        self._logFile.close()
+
+    def close(self):
+        """Close the gallery's files."""
+        with self._lock:
+            self._close()
+
+
+def _jsonLabel(label):
+    # Labels from numpy arrays aren't JSON serializable.
+    if isinstance(label, np.generic):
+        return label.item()
+    return label
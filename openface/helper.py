@@ -22,3 +22,47 @@ def mkdirP(path):
             pass
         else:
             raise
+
+
+#: The backends that can run the network, for :func:`loadNet`.
+networkBackends = ['torch', 'opencv']
+
+
+def addNetworkBackendArgument(parser):
+    """
+    Add the ``--networkBackend`` option used by :func:`loadNet` to a parser.
+
+    :param parser: The command line parser.
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        '--networkBackend',
+        type=str,
+        choices=networkBackends,
+        help="Run the network model in a Torch subprocess or in-process with OpenCV's DNN module.",
+        default='torch')
+
+
+def loadNet(model, imgDim=96, cuda=False, backend='torch'):
+    """
+    Load a Torch network model with one of the `networkBackends`.
+
+    :param model: The path to the Torch model to use.
+    :type model: str
+    :param imgDim: The edge length of the square input image.
+    :type imgDim: int
+    :param cuda: Flag to use CUDA.
+    :type cuda: bool
+    :param backend: ``'torch'`` for a :class:`openface.TorchNeuralNet` \
+                    or ``'opencv'`` for an :class:`openface.OpenCVNeuralNet`.
+    :type backend: str
+    :return: The network.
+    """
+    assert backend in networkBackends
+
+    if backend == 'opencv':
+        from .opencv_neural_net import OpenCVNeuralNet
+        return OpenCVNeuralNet(model, imgDim=imgDim, cuda=cuda)
+    else:
+        from .torch_neural_net import TorchNeuralNet
+        return TorchNeuralNet(model, imgDim=imgDim, cuda=cuda)
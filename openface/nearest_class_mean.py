@@ -0,0 +1,229 @@
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for classifying representations by their nearest class mean."""
+
+import numpy as np
+
+
+def _normalize(X):
+    X = np.array(X, dtype=np.float64, ndmin=2)
+    norms = np.linalg.norm(X, axis=1)
+    norms[norms == 0] = 1
+    return X / norms[:, None]
+
+
+class NearestClassMean:
+    """
+    Classify representations by the nearest mean of each class.
+
+    Training is a single pass that sums the representations of each
+    class, so it's linear in the number of representations, and
+    :meth:`partial_fit` adds representations and new classes without
+    retraining. The interface follows scikit-learn's classifiers,
+    so it can be used in place of one in the ``(le, clf)`` pickle
+    written by ``demos/classifier.py train``.
+
+    With the cosine metric, the representations and the means are
+    L2-normalized and compared by their inner product. With the
+    L2 metric, they are compared by their squared distance.
+    If `threshold` is set, :meth:`predict` returns `unknownLabel` for
+    representations that aren't close enough to any class mean.
+
+    .. code:: python
+
+        clf = NearestClassMean(metric='cosine', threshold=0.5).fit(X, y)
+        clf.partial_fit(newX, newY)
+        probabilities = clf.predict_proba(reps)
+    """
+
+    def __init__(self, metric='cosine', threshold=None, temperature=0.05,
+                 unknownLabel=-1):
+        """
+        Instantiate a 'NearestClassMean' object.
+
+        :param metric: How representations are compared: \
+                       ``'cosine'`` or ``'l2'``.
+        :type metric: str
+        :param threshold: The minimum cosine similarity, or the maximum \
+                          squared L2 distance, to a class mean for a \
+                          representation to be predicted as that class.
+        :type threshold: float
+        :param temperature: The softmax temperature that turns the \
+                            similarities into probabilities. Lower values \
+                            give more confident probabilities.
+        :type temperature: float
+        :param unknownLabel: The label predicted for representations \
+                             beyond the threshold.
+        """
+        assert metric in ['cosine', 'l2']
+        assert temperature > 0
+
+        self.metric = metric
+        self.threshold = threshold
+        self.temperature = temperature
+        self.unknownLabel = unknownLabel
+
+        #: The labels of the classes, sorted.
+        self.classes_ = None
+        #: The number of representations of each class.
+        self.counts_ = None
+        #: The mean representation of each class. Shape: (nClasses, dim)
+        self.means_ = None
+        self._sums = None
+
+    def get_params(self, deep=True):
+        """Get the parameters, for compatibility with scikit-learn."""
+        return {'metric': self.metric, 'threshold': self.threshold,
+                'temperature': self.temperature, 'unknownLabel': self.unknownLabel}
+
+    def set_params(self, **params):
+        """Set the parameters, for compatibility with scikit-learn."""
+        for (name, value) in params.items():
+            setattr(self, name, value)
+        return self
+
+    def fit(self, X, y):
+        """
+        Compute the class means, forgetting previous training.
+
+        :param X: The representations. Shape: (N, dim)
+        :type X: numpy.ndarray
+        :param y: The label of each representation. Shape: (N,)
+        :type y: numpy.ndarray
+        :return: self
+        """
+        self.classes_ = None
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y, classes=None):
+        """
+        Update the class means with more representations.
+
+        :param X: The representations. Shape: (N, dim)
+        :type X: numpy.ndarray
+        :param y: The label of each representation. Labels that \
+                  haven't been seen before add classes. Shape: (N,)
+        :type y: numpy.ndarray
+        :param classes: Labels of classes to add even if they have \
+                        no representations yet.
+        :type classes: numpy.ndarray
+        :return: self
+        """
+        assert X is not None
+        assert y is not None
+
+        X = _normalize(X) if self.metric == 'cosine' else np.array(X, dtype=np.float64, ndmin=2)
+        y = np.asarray(y)
+        assert len(X) == len(y)
+
+        # Add the new classes, keeping the existing sums in sorted order.
+        newClasses = np.unique(y) if classes is None else np.union1d(np.unique(y), classes)
+        if self.classes_ is None:
+            self.classes_ = newClasses
+            self.counts_ = np.zeros(len(newClasses), dtype=np.int64)
+            self._sums = np.zeros((len(newClasses), X.shape[1]))
+        elif len(np.setdiff1d(newClasses, self.classes_)) > 0:
+            classes = np.union1d(self.classes_, newClasses)
+            old = np.searchsorted(classes, self.classes_)
+            (counts, sums) = (np.zeros(len(classes), dtype=np.int64),
+                              np.zeros((len(classes), self._sums.shape[1])))
+            counts[old] = self.counts_
+            sums[old] = self._sums
+            (self.classes_, self.counts_, self._sums) = (classes, counts, sums)
+
+        # Sum the representations of each class after sorting them by class.
+        cls = np.searchsorted(self.classes_, y)
+        order = np.argsort(cls, kind='mergesort')
+        (present, starts, counts) = np.unique(cls[order], return_index=True,
+                                              return_counts=True)
+        if len(present) > 0:
+            self._sums[present] += np.add.reduceat(X[order], starts, axis=0)
+            self.counts_[present] += counts
+
+        means = self._sums / np.maximum(self.counts_, 1)[:, None]
+        self.means_ = _normalize(means) if self.metric == 'cosine' else means
+        return self
+
+    def decision_function(self, X):
+        """
+        Compare representations with the class means.
+
+        :param X: The representations. Shape: (N, dim)
+        :type X: numpy.ndarray
+        :return: The similarity of each representation to each class; \
+                 the cosine similarity or the negated squared L2 distance. \
+                 Shape: (N, nClasses)
+        :rtype: numpy.ndarray
+        """
+        assert X is not None
+        if self.means_ is None:
+            raise Exception("The classifier must be fit before it's used.")
+
+        if self.metric == 'cosine':
+            return np.dot(_normalize(X), self.means_.T)
+        X = np.array(X, dtype=np.float64, ndmin=2)
+        distances = np.sum(X * X, axis=1)[:, None] - 2.0 * np.dot(X, self.means_.T) + \
+            np.sum(self.means_ * self.means_, axis=1)[None, :]
+        return -np.maximum(distances, 0.0)
+
+    def predict_proba(self, X):
+        """
+        Estimate the probability of each class.
+
+        :param X: The representations. Shape: (N, dim)
+        :type X: numpy.ndarray
+        :return: The probabilities, in the order of `classes_`. Shape: (N, nClasses)
+        :rtype: numpy.ndarray
+        """
+        scores = self.decision_function(X) / self.temperature
+        scores -= np.max(scores, axis=1)[:, None]
+        p = np.exp(scores)
+        return p / np.sum(p, axis=1)[:, None]
+
+    def isKnown(self, X):
+        """
+        Check if representations are close enough to a class mean.
+
+        :param X: The representations. Shape: (N, dim)
+        :type X: numpy.ndarray
+        :return: True for the representations within the threshold. Shape: (N,)
+        :rtype: numpy.ndarray
+        """
+        return self._isKnown(self.decision_function(X))
+
+    def _isKnown(self, scores):
+        best = np.max(scores, axis=1)
+        if self.threshold is None:
+            return np.ones(len(best), dtype=bool)
+        elif self.metric == 'cosine':
+            return best >= self.threshold
+        else:
+            return -best <= self.threshold
+
+    def predict(self, X):
+        """
+        Predict the class of representations.
+
+        :param X: The representations. Shape: (N, dim)
+        :type X: numpy.ndarray
+        :return: The predicted labels, or `unknownLabel` \
+                 beyond the threshold. Shape: (N,)
+        :rtype: numpy.ndarray
+        """
+        scores = self.decision_function(X)
+        labels = self.classes_[np.argmax(scores, axis=1)]
+        if self.threshold is not None:
+            labels = np.where(self._isKnown(scores), labels, self.unknownLabel)
+        return labels
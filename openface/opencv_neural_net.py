@@ -0,0 +1,138 @@
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for OpenCV DNN-based neural network usage."""
+
+import os
+
+import numpy as np
+import cv2
+
+myDir = os.path.dirname(os.path.realpath(__file__))
+
+
+class OpenCVNeuralNet:
+    """
+    Use `OpenCV's DNN module <http://docs.opencv.org/master/d6/d0f/group__dnn.html>`_
+    for feature extraction.
+
+    The Torch model is loaded with OpenCV's Torch importer and
+    run in-process, so neither Torch nor Lua needs to be installed
+    and there is no subprocess to communicate with.
+    This requires OpenCV 3.3 or later.
+
+    The interface is the same as :class:`openface.TorchNeuralNet`
+    and it also can be used as a context manager.
+    """
+
+    #: The default Torch model to use.
+    defaultModel = os.path.join(myDir, '..', 'models', 'openface', 'nn4.small2.v1.t7')
+
+    def __init__(self, model=defaultModel, imgDim=96, cuda=False):
+        """__init__(self, model=defaultModel, imgDim=96, cuda=False)
+
+        Instantiate an 'OpenCVNeuralNet' object.
+
+        :param model: The path to the Torch model to use.
+        :type model: str
+        :param imgDim: The edge length of the square input image.
+        :type imgDim: int
+        :param cuda: Flag to run the network with OpenCV's CUDA backend.
+        :type cuda: bool
+        """
+        assert model is not None
+        assert imgDim is not None
+        assert cuda is not None
+
+        if not hasattr(cv2, 'dnn') or not hasattr(cv2.dnn, 'readNetFromTorch'):
+            raise Exception("""
+OpenFace: OpenCV {} does not include the DNN module's Torch importer.
+
+OpenCVNeuralNet requires OpenCV 3.3 or later built with the dnn module.
+Use openface.TorchNeuralNet instead if it is not available.""".format(cv2.__version__))
+
+        self.model = model
+        self.imgDim = imgDim
+        self.cuda = cuda
+
+        self.net = cv2.dnn.readNetFromTorch(model)
+        if cuda:
+            if not hasattr(cv2.dnn, 'DNN_BACKEND_CUDA'):
+                raise Exception("OpenFace: OpenCV {} does not support CUDA in "
+                                "the DNN module.".format(cv2.__version__))
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+
+    def __enter__(self):
+        """Part of the context manger protocol. See PEP 343"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Part of the context manger protocol. See PEP 343"""
+        pass
+
+    def forwardPath(self, imgPath):
+        """
+        Perform a forward network pass of an image on disk.
+
+        :param imgPath: The path to the image.
+        :type imgPath: str
+        :return: Vector of features extracted with the neural network.
+        :rtype: numpy.ndarray
+        """
+        assert imgPath is not None
+
+        bgrImg = cv2.imread(imgPath)
+        if bgrImg is None:
+            raise Exception("Unable to load image: {}".format(imgPath))
+        rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+        return self.forward(rgbImg)
+
+    def forward(self, rgbImg):
+        """
+        Perform a forward network pass of an RGB image.
+
+        :param rgbImg: RGB image to process. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :return: Vector of features extracted from the neural network.
+        :rtype: numpy.ndarray
+        """
+        assert rgbImg is not None
+
+        return self.forwardBatch([rgbImg])[0].astype(np.float64)
+
+    def forwardBatch(self, rgbImgs):
+        """
+        Perform a forward network pass of a batch of RGB images.
+
+        :param rgbImgs: RGB images to process, either as a list of images \
+                        or as a single array. Shape: (N, imgDim, imgDim, 3)
+        :type rgbImgs: list of numpy.ndarray or numpy.ndarray
+        :return: Matrix of features extracted from the neural network, \
+                 one row per image. Shape: (N, 128)
+        :rtype: numpy.ndarray
+        """
+        assert rgbImgs is not None
+
+        if len(rgbImgs) == 0:
+            return np.empty((0, 128), dtype=np.float32)
+
+        # The Torch models take RGB images scaled to [0, 1],
+        # so the channels must not be swapped.
+        blob = cv2.dnn.blobFromImages(list(rgbImgs), 1.0 / 255,
+                                      (self.imgDim, self.imgDim), (0, 0, 0),
+                                      swapRB=False, crop=False)
+        self.net.setInput(blob)
+        reps = self.net.forward()
+        return reps.reshape(len(rgbImgs), -1).astype(np.float32)
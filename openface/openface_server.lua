@@ -20,6 +20,8 @@ require 'nn'
 require 'dpnn'
 require 'image'
 
+local ffi = require 'ffi'
+
 io.stdout:setvbuf 'no'
 torch.setdefaulttensortype('torch.FloatTensor')
 
@@ -38,6 +40,9 @@ cmd:text('Options:')
 cmd:option('-model', './models/openface/nn4.v1.t7', 'Path to model.')
 cmd:option('-imgDim', 96, 'Image dimension. nn1=224, nn4=96')
 cmd:option('-cuda', false)
+cmd:option('-binary', false, 'Use the binary protocol on stdin/stdout.')
+cmd:option('-shm', '', 'Shared memory file to read images from. Implies -binary.')
+cmd:option('-shmSlots', 0, 'Number of images in the shared memory file.')
 cmd:text()
 
 opt = cmd:parse(arg or {})
@@ -56,28 +61,148 @@ if opt.cuda then
 end
 
 local img = torch.Tensor(1, 3, opt.imgDim, opt.imgDim)
-while true do
-   -- Read a path to an image on stdin and output the representation
-   -- as a CSV.
-   local imgPath = io.read("*line")
-   if imgPath and imgPath:len() ~= 0 then
-      img[1] = image.load(imgPath, 3, 'float')
-      img[1] = image.scale(img[1], opt.imgDim, opt.imgDim)
-      local rep
-      if opt.cuda then
-         imgCuda:copy(img)
-         rep = net:forward(imgCuda):float()
-      else
-         rep = net:forward(img)
+
+-- Images written by the Python process, as (shmSlots, imgDim, imgDim, 3)
+-- uint8 RGB pixels in a shared memory-mapped file.
+local shmImgs = nil
+if opt.shm ~= '' then
+   opt.binary = true
+   local sz = opt.shmSlots * opt.imgDim * opt.imgDim * 3
+   local storage = torch.ByteStorage(opt.shm, true, sz)
+   shmImgs = torch.ByteTensor(storage):view(opt.shmSlots, opt.imgDim,
+                                            opt.imgDim, 3)
+end
+
+-- Run the network on the first `n` images of `img` and return
+-- the representations as an (n, repDim) tensor.
+local function forward(n)
+   local batch = img:narrow(1, 1, n)
+   local reps
+   if opt.cuda then
+      imgCuda:resize(batch:size()):copy(batch)
+      reps = net:forward(imgCuda):float()
+   else
+      reps = net:forward(batch)
+   end
+   if reps:dim() == 1 then
+      reps = reps:view(1, reps:size(1))
+   end
+   return reps
+end
+
+-- Read a little-endian unsigned 32-bit integer from stdin.
+-- Returns nil at the end of the stream.
+local function readUInt32()
+   local s = io.stdin:read(4)
+   if s == nil or s:len() ~= 4 then
+      return nil
+   end
+   local b1, b2, b3, b4 = s:byte(1, 4)
+   return b1 + 256 * (b2 + 256 * (b3 + 256 * b4))
+end
+
+local function writeUInt32(x)
+   local bytes = {}
+   for i = 1,4 do
+      bytes[i] = x % 256
+      x = math.floor(x / 256)
+   end
+   io.stdout:write(string.char(unpack(bytes)))
+end
+
+-- Binary protocol.
+--
+-- Request:  uint32 n, followed by n * imgDim * imgDim * 3 uint8
+--           RGB pixels in (n, imgDim, imgDim, 3) order.
+--           With -shm, uint32 n is followed by the n uint32 indices
+--           of the images in the shared memory file instead.
+-- Response: uint32 n, uint32 repDim, followed by n * repDim
+--           float32 representations.
+--
+-- Integers and floats are little-endian.
+local littleEndian = ffi.abi('le')
+
+local function floatsToString(t)
+   local s = ffi.string(torch.data(t), t:nElement() * 4)
+   if not littleEndian then
+      s = s:gsub('(.)(.)(.)(.)', function(a, b, c, d) return d .. c .. b .. a end)
+   end
+   return s
+end
+
+local function serveBinary()
+   local imgSz = 3 * opt.imgDim * opt.imgDim
+   while true do
+      local n = readUInt32()
+      if n == nil then
+         break
+      end
+      if img:size(1) < n then
+         img:resize(n, 3, opt.imgDim, opt.imgDim)
       end
-      local sz = rep:size(1)
-      for i = 1,sz do
-         io.write(rep[i])
-         if i < sz then
-            io.write(',')
+      if shmImgs then
+         for i = 1,n do
+            local slot = readUInt32()
+            assert(slot and slot < opt.shmSlots, 'Invalid slot.')
+            img[i]:copy(shmImgs[slot + 1]:permute(3, 1, 2))
          end
+         img:narrow(1, 1, n):div(255)
+      else
+         local buf = io.stdin:read(n * imgSz)
+         assert(buf and buf:len() == n * imgSz, 'Truncated request.')
+         local pixels = torch.ByteTensor(torch.ByteStorage():string(buf))
+         pixels = pixels:view(n, opt.imgDim, opt.imgDim, 3):permute(1, 4, 2, 3)
+         img:narrow(1, 1, n):copy(pixels):div(255)
       end
-      io.write('\n')
+      local reps = forward(n):contiguous()
+      writeUInt32(n)
+      writeUInt32(reps:size(2))
+      io.stdout:write(floatsToString(reps))
       io.stdout:flush()
    end
 end
+
+-- Text protocol.
+local function serveText()
+   while true do
+      -- Read tab-separated paths to images on stdin and output the
+      -- representation of each image as a CSV line, in the same order.
+      local line = io.read("*line")
+      if line == nil then
+         break
+      end
+      if line:len() ~= 0 then
+         local imgPaths = {}
+         for imgPath in line:gmatch('[^\t]+') do
+            table.insert(imgPaths, imgPath)
+         end
+         local n = #imgPaths
+         if img:size(1) < n then
+            img:resize(n, 3, opt.imgDim, opt.imgDim)
+         end
+         for i, imgPath in ipairs(imgPaths) do
+            img[i] = image.scale(image.load(imgPath, 3, 'float'),
+                                 opt.imgDim, opt.imgDim)
+         end
+         local reps = forward(n)
+         local sz = reps:size(2)
+         for j = 1,n do
+            local rep = reps[j]
+            for i = 1,sz do
+               io.write(rep[i])
+               if i < sz then
+                  io.write(',')
+               end
+            end
+            io.write('\n')
+         end
+         io.stdout:flush()
+      end
+   end
+end
+
+if opt.binary then
+   serveBinary()
+else
+   serveText()
+end
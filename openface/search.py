@@ -0,0 +1,583 @@
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for searching galleries of representations."""
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+import json
+import os
+
+import numpy as np
+
+
+def normalize(reps):
+    """
+    L2-normalize representations.
+
+    :param reps: The representations, one row per face. Shape: (N, dim)
+    :type reps: numpy.ndarray
+    :return: The normalized float32 representations. Shape: (N, dim)
+    :rtype: numpy.ndarray
+    """
+    reps = np.array(reps, dtype=np.float32, ndmin=2)
+    norms = np.sqrt(np.einsum('ij,ij->i', reps, reps))
+    norms[norms == 0] = 1
+    reps /= norms[:, None]
+    return reps
+
+
+def _take(a, idx):
+    # Select the columns `idx` of every row.
+    return a[np.arange(len(a))[:, None], idx]
+
+
+def _topK(sims, k, offset=0):
+    # The `k` largest similarities of every row, in no particular order.
+    if sims.shape[1] > k:
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        sims = _take(sims, idx)
+    else:
+        idx = np.tile(np.arange(sims.shape[1]), (sims.shape[0], 1))
+    return sims, idx + offset
+
+
+def _assign(x, centroids, blockSize=16384):
+    # The nearest centroid of every row, since
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2.
+    cNorms = np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.empty(len(x), dtype=np.int64)
+    for i in range(0, len(x), blockSize):
+        scores = 2.0 * np.dot(x[i:i + blockSize], centroids.T) - cNorms
+        assignments[i:i + blockSize] = np.argmax(scores, axis=1)
+    return assignments
+
+
+def kmeans(x, k, nIter=20, rng=None):
+    """
+    Cluster vectors with Lloyd's k-means algorithm.
+
+    :param x: The vectors to cluster. Shape: (N, dim)
+    :type x: numpy.ndarray
+    :param k: The number of clusters.
+    :type k: int
+    :param nIter: The number of iterations.
+    :type nIter: int
+    :param rng: The random state used to initialize the centroids.
+    :type rng: numpy.random.RandomState
+    :return: The centroids. Shape: (k, dim)
+    :rtype: numpy.ndarray
+    """
+    assert x is not None
+    if len(x) < k:
+        raise Exception("Unable to find {} clusters in {} vectors.".format(k, len(x)))
+
+    rng = rng or np.random.RandomState(0)
+    x = np.asarray(x, dtype=np.float32)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(nIter):
+        assignments = _assign(x, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        nonEmpty = counts > 0
+        # Sum the vectors of each cluster after sorting them by cluster.
+        order = np.argsort(assignments, kind='mergesort')
+        starts = (np.cumsum(counts) - counts)[nonEmpty]
+        sums = np.add.reduceat(x[order], starts, axis=0, dtype=np.float64)
+        centroids[nonEmpty] = sums / counts[nonEmpty, None]
+        # Restart empty clusters at random vectors.
+        empty = np.flatnonzero(~nonEmpty)
+        centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+class FlatIndex:
+    """
+    Exact nearest neighbour search of L2-normalized representations.
+
+    The gallery is kept as a contiguous float32 matrix. Queries are
+    compared with blocks of the gallery with one matrix product per
+    block, and the blocks are searched by a pool of threads since
+    numpy releases the GIL during matrix products.
+    For normalized representations, the squared distance
+    is ``2 - 2 * cos``, so the nearest neighbours are the
+    gallery faces with the largest inner product.
+
+    .. code:: python
+
+        index = FlatIndex.fromStore(EmbeddingStore.load(workDir))
+        distances, idx = index.search(reps, k=5)
+        identities = index.labels[idx]
+    """
+
+    def __init__(self, dim=128, blockSize=16384, queryBatchSize=256, nThreads=None):
+        """
+        Instantiate a 'FlatIndex' object.
+
+        :param dim: The dimension of the representations.
+        :type dim: int
+        :param blockSize: The number of gallery faces compared \
+                          with the queries in one matrix product.
+        :type blockSize: int
+        :param queryBatchSize: The number of queries compared \
+                               with the gallery at a time.
+        :type queryBatchSize: int
+        :param nThreads: The number of threads searching blocks of \
+                         the gallery. Defaults to the number of CPUs.
+        :type nThreads: int
+        """
+        assert dim > 0
+        assert blockSize > 0
+        assert queryBatchSize > 0
+
+        self.dim = dim
+        self.blockSize = blockSize
+        self.queryBatchSize = queryBatchSize
+        self.nThreads = nThreads or cpu_count()
+
+        self._reps = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._n = 0
+        self._executor = None
+
+    @classmethod
+    def fromStore(cls, store, **kwargs):
+        """
+        Create an index of the representations in an embedding store.
+
+        :param store: The representations and their labels.
+        :type store: :class:`openface.data.EmbeddingStore`
+        :param kwargs: Arguments for the 'FlatIndex' constructor.
+        :return: The index.
+        :rtype: :class:`FlatIndex`
+        """
+        assert store is not None
+
+        index = cls(dim=store.reps.shape[1], **kwargs)
+        index.add(store.reps, store.labels)
+        return index
+
+    def __len__(self):
+        """The number of faces in the gallery."""
+        return self._n
+
+    @property
+    def reps(self):
+        """The normalized representations of the gallery. Shape: (N, dim)"""
+        return self._reps[:self._n]
+
+    @property
+    def labels(self):
+        """The label of each face in the gallery. Shape: (N,)"""
+        return self._labels[:self._n]
+
+    def add(self, reps, labels=None):
+        """
+        Add faces to the gallery.
+
+        :param reps: The representations of the faces. Shape: (N, dim)
+        :type reps: numpy.ndarray
+        :param labels: The label of each face, such as a person's identifier. \
+                       Defaults to the faces' indices.
+        :type labels: numpy.ndarray
+        :return: The indices of the faces in the gallery.
+        :rtype: numpy.ndarray
+        """
+        assert reps is not None
+
+        reps = normalize(reps)
+        if reps.shape[1] != self.dim:
+            raise Exception("Expected representations with {} dimensions, got {}.".format(
+                self.dim, reps.shape[1]))
+        n = len(reps)
+        idx = np.arange(self._n, self._n + n)
+        if labels is None:
+            labels = idx
+        assert len(labels) == n
+
+        # Grow the matrix geometrically so adding is amortized O(n).
+        if self._n + n > len(self._reps):
+            capacity = max(self._n + n, 2 * len(self._reps))
+            reps_ = np.empty((capacity, self.dim), dtype=np.float32)
+            reps_[:self._n] = self._reps[:self._n]
+            labels_ = np.empty(capacity, dtype=np.int64)
+            labels_[:self._n] = self._labels[:self._n]
+            (self._reps, self._labels) = (reps_, labels_)
+        self._reps[self._n:self._n + n] = reps
+        self._labels[self._n:self._n + n] = labels
+        self._n += n
+        return idx
+
+    def _searchBlock(self, queries, k, start):
+        block = self._reps[start:min(start + self.blockSize, self._n)]
+        return _topK(np.dot(queries, block.T), k, start)
+
+    def search(self, queries, k=1):
+        """
+        Find the nearest gallery faces of each query.
+
+        :param queries: The representations to search for. Shape: (M, dim) or (dim,)
+        :type queries: numpy.ndarray
+        :param k: The number of neighbours to return.
+        :type k: int
+        :return: The squared distances and gallery indices of the neighbours \
+                 of each query, nearest first. There are fewer than `k` \
+                 neighbours if the gallery is smaller. Shapes: (M, k), (M, k)
+        :rtype: tuple of numpy.ndarray
+        """
+        assert queries is not None
+        assert k > 0
+
+        queries = normalize(queries)
+        k = min(k, self._n)
+        nQueries = len(queries)
+        sims = np.empty((nQueries, k), dtype=np.float32)
+        idx = np.empty((nQueries, k), dtype=np.int64)
+        if k == 0:
+            return sims, idx
+
+        starts = range(0, self._n, self.blockSize)
+        if len(starts) > 1 and self.nThreads > 1 and self._executor is None:
+            self._executor = ThreadPoolExecutor(self.nThreads)
+        for q0 in range(0, nQueries, self.queryBatchSize):
+            batch = queries[q0:q0 + self.queryBatchSize]
+            if len(starts) > 1 and self.nThreads > 1:
+                results = list(self._executor.map(
+                    lambda start: self._searchBlock(batch, k, start), starts))
+            else:
+                results = [self._searchBlock(batch, k, start) for start in starts]
+
+            # Merge the candidates of all blocks.
+            (batchSims, batchIdx) = (np.hstack([r[0] for r in results]),
+                                     np.hstack([r[1] for r in results]))
+            (batchSims, best) = _topK(batchSims, k)
+            batchIdx = _take(batchIdx, best)
+            order = np.argsort(-batchSims, axis=1, kind='mergesort')
+            sims[q0:q0 + len(batch)] = _take(batchSims, order)
+            idx[q0:q0 + len(batch)] = _take(batchIdx, order)
+
+        distances = np.maximum(2.0 - 2.0 * sims, 0.0)
+        return distances, idx
+
+    def close(self):
+        """Stop the search threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __del__(self):
+        self.close()
+
+
+class IVFPQIndex:
+    """
+    Approximate nearest neighbour search for large galleries.
+
+    Representations are partitioned into `nList` inverted lists by
+    k-means, and the residual of each representation from its list's
+    centroid is compressed with product quantization: it is split
+    into `nSubquantizers` parts, each stored as the one byte index
+    of its nearest sub-centroid. A 128-d representation takes
+    `nSubquantizers` bytes instead of 512.
+
+    A query only searches the `nProbe` lists with the nearest centroids,
+    and the distances to their faces are computed from tables of the
+    distances between the query's residual and the sub-centroids.
+    Increasing `nProbe` trades speed for recall.
+
+    An index is saved to a directory of ``.npy`` files, and
+    the codes are memory-mapped when it's loaded.
+
+    .. code:: python
+
+        index = IVFPQIndex.fromStore(EmbeddingStore.load(workDir), nList=1024)
+        index.save('index')
+        index = IVFPQIndex.load('index')
+        distances, idx = index.search(reps, k=5, nProbe=16)
+    """
+
+    def __init__(self, dim=128, nList=1024, nSubquantizers=16, nProbe=8):
+        """
+        Instantiate an untrained 'IVFPQIndex' object.
+
+        :param dim: The dimension of the representations.
+        :type dim: int
+        :param nList: The number of inverted lists.
+        :type nList: int
+        :param nSubquantizers: The number of bytes each representation \
+                               is compressed to. Must divide `dim`.
+        :type nSubquantizers: int
+        :param nProbe: The default number of lists searched per query.
+        :type nProbe: int
+        """
+        assert dim > 0
+        assert nList > 0
+        assert nSubquantizers > 0 and dim % nSubquantizers == 0
+        assert nProbe > 0
+
+        self.dim = dim
+        self.nList = nList
+        self.nSubquantizers = nSubquantizers
+        self.nProbe = nProbe
+
+        #: The centroids of the inverted lists. Shape: (nList, dim)
+        self.centroids = None
+        #: The sub-centroids. Shape: (nSubquantizers, 256, dim / nSubquantizers)
+        self.codebooks = None
+
+        # The faces sorted by inverted list, with the faces of
+        # list `i` in rows `offsets[i]` to `offsets[i + 1]`.
+        self._codes = np.empty((0, nSubquantizers), dtype=np.uint8)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(nList + 1, dtype=np.int64)
+        # The faces added since they were last merged into the lists,
+        # as (lists, codes, ids, labels) arrays.
+        self._added = []
+        self._nAdded = 0
+
+    @classmethod
+    def fromStore(cls, store, maxTrain=262144, nIter=20, seed=0, **kwargs):
+        """
+        Train an index on the representations in an embedding store and add them.
+
+        :param store: The representations and their labels.
+        :type store: :class:`openface.data.EmbeddingStore`
+        :param maxTrain: The maximum number of representations to train on.
+        :type maxTrain: int
+        :param nIter: The number of k-means iterations.
+        :type nIter: int
+        :param seed: The seed for sampling the training representations.
+        :type seed: int
+        :param kwargs: Arguments for the 'IVFPQIndex' constructor.
+        :return: The index.
+        :rtype: :class:`IVFPQIndex`
+        """
+        assert store is not None
+
+        index = cls(dim=store.reps.shape[1], **kwargs)
+        rng = np.random.RandomState(seed)
+        n = len(store)
+        sample = np.sort(rng.choice(n, min(n, maxTrain), replace=False))
+        index.train(store.reps[sample], nIter=nIter, rng=rng)
+        # Add in chunks so a memory-mapped store isn't read at once.
+        for i in range(0, n, 65536):
+            index.add(store.reps[i:i + 65536], store.labels[i:i + 65536])
+        return index
+
+    def __len__(self):
+        """The number of faces in the index."""
+        return len(self._ids) + self._nAdded
+
+    @property
+    def isTrained(self):
+        """True if the centroids and codebooks have been trained."""
+        return self.centroids is not None
+
+    @property
+    def labels(self):
+        """The label of each face, in the order they were added. Shape: (N,)"""
+        self._merge()
+        labels = np.empty(len(self._ids), dtype=np.int64)
+        labels[self._ids] = self._labels
+        return labels
+
+    def train(self, reps, nIter=20, rng=None):
+        """
+        Learn the inverted list centroids and the product quantizer.
+
+        :param reps: Representations like the ones that will be added. Shape: (N, dim)
+        :type reps: numpy.ndarray
+        :param nIter: The number of k-means iterations.
+        :type nIter: int
+        :param rng: The random state used to initialize k-means.
+        :type rng: numpy.random.RandomState
+        """
+        assert reps is not None
+
+        rng = rng or np.random.RandomState(0)
+        reps = normalize(reps)
+        self.centroids = kmeans(reps, self.nList, nIter, rng)
+        residuals = reps - self.centroids[_assign(reps, self.centroids)]
+        subDim = self.dim // self.nSubquantizers
+        self.codebooks = np.empty((self.nSubquantizers, 256, subDim), dtype=np.float32)
+        for m in range(self.nSubquantizers):
+            self.codebooks[m] = kmeans(residuals[:, m * subDim:(m + 1) * subDim],
+                                       256, nIter, rng)
+
+    def _encode(self, residuals):
+        subDim = self.dim // self.nSubquantizers
+        codes = np.empty((len(residuals), self.nSubquantizers), dtype=np.uint8)
+        for m in range(self.nSubquantizers):
+            codes[:, m] = _assign(residuals[:, m * subDim:(m + 1) * subDim],
+                                  self.codebooks[m])
+        return codes
+
+    def add(self, reps, labels=None):
+        """
+        Add faces to the index.
+
+        :param reps: The representations of the faces. Shape: (N, dim)
+        :type reps: numpy.ndarray
+        :param labels: The label of each face, such as a person's identifier. \
+                       Defaults to the faces' indices.
+        :type labels: numpy.ndarray
+        :return: The indices of the faces in the index.
+        :rtype: numpy.ndarray
+        """
+        assert reps is not None
+        if not self.isTrained:
+            raise Exception("The index must be trained before adding faces.")
+
+        reps = normalize(reps)
+        if reps.shape[1] != self.dim:
+            raise Exception("Expected representations with {} dimensions, got {}.".format(
+                self.dim, reps.shape[1]))
+        ids = np.arange(len(self), len(self) + len(reps))
+        if labels is None:
+            labels = ids
+        assert len(labels) == len(reps)
+
+        lists = _assign(reps, self.centroids)
+        codes = self._encode(reps - self.centroids[lists])
+
+        # The faces are only merged into the lists once they're used,
+        # so adding many small batches doesn't re-sort the index each time.
+        self._added.append((lists, codes, ids, np.asarray(labels, dtype=np.int64)))
+        self._nAdded += len(ids)
+        return ids
+
+    def _merge(self):
+        # Insert the added faces at the end of their lists in one pass,
+        # sorting only them. The sort is stable, so the faces in a list
+        # stay in the order they were added.
+        if len(self._added) == 0:
+            return
+        (lists, codes, ids, labels) = [np.concatenate(a) for a in zip(*self._added)]
+        self._added = []
+        self._nAdded = 0
+        order = np.argsort(lists, kind='mergesort')
+        positions = self._offsets[lists[order] + 1]
+        self._codes = np.insert(self._codes, positions, codes[order], axis=0)
+        self._ids = np.insert(self._ids, positions, ids[order])
+        self._labels = np.insert(self._labels, positions, labels[order])
+        self._offsets = self._offsets + np.concatenate(
+            ([0], np.cumsum(np.bincount(lists, minlength=self.nList))))
+
+    def search(self, queries, k=1, nProbe=None):
+        """
+        Find the approximate nearest faces of each query.
+
+        :param queries: The representations to search for. Shape: (M, dim) or (dim,)
+        :type queries: numpy.ndarray
+        :param k: The number of neighbours to return.
+        :type k: int
+        :param nProbe: The number of inverted lists to search. \
+                       Defaults to the index's `nProbe`.
+        :type nProbe: int
+        :return: The approximate squared distances and indices of the \
+                 neighbours of each query, nearest first. Missing neighbours \
+                 have an index of -1 and an infinite distance. Shapes: (M, k), (M, k)
+        :rtype: tuple of numpy.ndarray
+        """
+        assert queries is not None
+        assert k > 0
+        if not self.isTrained:
+            raise Exception("The index must be trained before searching.")
+
+        self._merge()
+        queries = normalize(queries)
+        nProbe = min(nProbe or self.nProbe, self.nList)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        idx = np.full((len(queries), k), -1, dtype=np.int64)
+
+        (_, probes) = _topK(np.dot(queries, self.centroids.T) -
+                            0.5 * np.einsum('ij,ij->i', self.centroids, self.centroids),
+                            nProbe)
+        subDim = self.dim // self.nSubquantizers
+        # The offset of each subquantizer's entries in a flattened distance table.
+        tableOffsets = np.arange(self.nSubquantizers) * 256
+        for (i, query) in enumerate(queries):
+            candDistances, candIds = [], []
+            for l in probes[i]:
+                (start, stop) = (self._offsets[l], self._offsets[l + 1])
+                if start == stop:
+                    continue
+                residual = (query - self.centroids[l]).reshape(self.nSubquantizers, 1, subDim)
+                tables = np.sum((self.codebooks - residual) ** 2, axis=2).ravel()
+                codes = np.asarray(self._codes[start:stop], dtype=np.int64)
+                candDistances.append(np.sum(tables[codes + tableOffsets], axis=1))
+                candIds.append(self._ids[start:stop])
+            if len(candDistances) == 0:
+                continue
+            candDistances = np.concatenate(candDistances)
+            candIds = np.concatenate(candIds)
+            n = min(k, len(candDistances))
+            best = np.argpartition(candDistances, n - 1)[:n]
+            best = best[np.argsort(candDistances[best], kind='mergesort')]
+            distances[i, :n] = candDistances[best]
+            idx[i, :n] = candIds[best]
+        return distances, idx
+
+    def save(self, directory):
+        """
+        Save the index.
+
+        :param directory: The directory to write the index's files to.
+        :type directory: str
+        """
+        assert directory is not None
+        if not self.isTrained:
+            raise Exception("Unable to save an untrained index.")
+        self._merge()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for (name, a) in [('centroids', self.centroids), ('codebooks', self.codebooks),
+                          ('codes', self._codes), ('ids', self._ids),
+                          ('labels', self._labels), ('offsets', self._offsets)]:
+            np.save(os.path.join(directory, name + '.npy'), a)
+        # Write the description last, so it only exists once the index is complete.
+        with open(os.path.join(directory, 'info.json.tmp'), 'w') as f:
+            json.dump({'version': 1, 'dim': self.dim, 'nList': self.nList,
+                       'nSubquantizers': self.nSubquantizers,
+                       'nProbe': self.nProbe}, f)
+        os.rename(os.path.join(directory, 'info.json.tmp'),
+                  os.path.join(directory, 'info.json'))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Load a saved index.
+
+        :param directory: The directory the index was saved to.
+        :type directory: str
+        :param mmap: Memory-map the codes instead of reading them into memory.
+        :type mmap: bool
+        :return: The index.
+        :rtype: :class:`IVFPQIndex`
+        """
+        assert directory is not None
+
+        with open(os.path.join(directory, 'info.json'), 'r') as f:
+            info = json.load(f)
+        index = cls(dim=info['dim'], nList=info['nList'],
+                    nSubquantizers=info['nSubquantizers'], nProbe=info['nProbe'])
+        mmapMode = 'r' if mmap else None
+        (index.centroids, index.codebooks, index._offsets) = [
+            np.load(os.path.join(directory, name + '.npy'))
+            for name in ['centroids', 'codebooks', 'offsets']]
+        (index._codes, index._ids, index._labels) = [
+            np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmapMode)
+            for name in ['codes', 'ids', 'labels']]
+        return index
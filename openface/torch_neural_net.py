@@ -16,10 +16,19 @@
 
 import atexit
 import binascii
+from collections import deque
+import mmap
+from concurrent.futures import Future
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
 import os
 import os.path
+import struct
 import sys
+import tempfile
+import threading
+import time
 
 import numpy as np
 import cv2
@@ -57,8 +66,10 @@ class TorchNeuralNet:
     #: The default Torch model to use.
     defaultModel = os.path.join(myDir, '..', 'models', 'openface', 'nn4.small2.v1.t7')
 
-    def __init__(self, model=defaultModel, imgDim=96, cuda=False):
-        """__init__(self, model=defaultModel, imgDim=96, cuda=False)
+    def __init__(self, model=defaultModel, imgDim=96, cuda=False,
+                 protocol='binary', shmSlots=64, supervised=False,
+                 maxRestarts=3):
+        """__init__(self, model=defaultModel, imgDim=96, cuda=False, protocol='binary', shmSlots=64, supervised=False, maxRestarts=3)
 
         Instantiate a 'TorchNeuralNet' object.
 
@@ -72,22 +83,80 @@ class TorchNeuralNet:
         :type imgDim: int
         :param cuda: Flag to use CUDA in the subprocess.
         :type cuda: bool
+        :param protocol: How images and representations are exchanged \
+                         with the subprocess. \
+                         ``'binary'`` sends raw pixels and receives raw \
+                         float32 representations over the pipes. \
+                         ``'text'`` writes each image to a temporary PNG \
+                         and parses a CSV line, which also works with \
+                         older versions of `openface_server.lua`. \
+                         ``'shm'`` writes images into a shared memory \
+                         ring buffer and only sends their slot indices.
+        :type protocol: str
+        :param shmSlots: The number of images in the shared memory ring \
+                         buffer with the ``'shm'`` protocol.
+        :type shmSlots: int
+        :param supervised: Restart the subprocess if it dies or returns \
+                           an invalid response and send the requests \
+                           in flight again, instead of exiting. \
+                           The subprocess is also warmed up on startup.
+        :type supervised: bool
+        :param maxRestarts: The number of consecutive restarts to try \
+                            before failing a request when `supervised`.
+        :type maxRestarts: int
         """
         assert model is not None
         assert imgDim is not None
         assert cuda is not None
+        assert protocol in ('binary', 'text', 'shm')
+        assert shmSlots > 0
+
+        self.model = model
+        self.imgDim = imgDim
+        self.cuda = cuda
+        self.protocol = protocol
+        self.shmSlots = shmSlots
+        self.supervised = supervised
+        self.maxRestarts = maxRestarts
+        #: The number of times the subprocess has been restarted.
+        self.restarts = 0
 
         self.cmd = ['/usr/bin/env', 'th', os.path.join(myDir, 'openface_server.lua'),
                     '-model', model, '-imgDim', str(imgDim)]
         if cuda:
             self.cmd.append('-cuda')
-        self.p = Popen(self.cmd, stdin=PIPE, stdout=PIPE, bufsize=0, universal_newlines=True)
+        if protocol == 'binary':
+            self.cmd.append('-binary')
+        self.shmPath = None
+        if protocol == 'shm':
+            self._openShm()
+            self.cmd += ['-shm', self.shmPath, '-shmSlots', str(shmSlots)]
+        self._spawn()
+
+        # Requests waiting for a response, used once requests are
+        # pipelined with `forwardAsync`.
+        self._lock = threading.Lock()
+        self._pendingCond = threading.Condition(self._lock)
+        self._pending = deque()
+        self._reader = None
+
+        self._ready = False
+        self._failures = 0
+        self._nRequests = 0
+        self._latencies = deque(maxlen=100)
 
         def exitHandler():
             if self.p.poll() is None:
                 self.p.kill()
+            self._closeShm()
         atexit.register(exitHandler)
 
+        if supervised:
+            with self._lock:
+                if self._warmUpLocked() is not None and not self._restartLocked():
+                    self._checkAlive()
+                    raise Exception("OpenFace: Unable to warm up `openface_server.lua`.")
+
     def __enter__(self):
         """Part of the context manger protocol. See PEP 343"""
         return self
@@ -100,6 +169,7 @@ class TorchNeuralNet:
         """
         if self.p.poll() is None:
             self.p.kill()
+        self._closeShm()
 
 
     def __del__(self):
@@ -108,6 +178,7 @@ class TorchNeuralNet:
         """
         if self.p.poll() is None:
             self.p.kill()
+        self._closeShm()
 
     def forwardPath(self, imgPath):
         """
@@ -120,6 +191,162 @@ class TorchNeuralNet:
         """
         assert imgPath is not None
 
+        if self.protocol == 'binary':
+            bgrImg = cv2.imread(imgPath)
+            if bgrImg is None:
+                raise Exception("Unable to load image: {}".format(imgPath))
+            rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+            return self.forward(rgbImg)
+        else:
+            assert '\t' not in imgPath and '\n' not in imgPath
+            return self._call(imgPaths=[imgPath])[0]
+
+    def forward(self, rgbImg):
+        """
+        Perform a forward network pass of an RGB image.
+
+        :param rgbImg: RGB image to process. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :return: Vector of features extracted from the neural network.
+        :rtype: numpy.ndarray
+        """
+        assert rgbImg is not None
+
+        return self._call(rgbImgs=[rgbImg])[0].astype(np.float64)
+
+    def forwardBatch(self, rgbImgs):
+        """
+        Perform a forward network pass of a batch of RGB images.
+
+        With the ``'binary'`` and ``'shm'`` protocols, this uses a single
+        round trip to the Torch subprocess, which is much faster than
+        calling :meth:`forward` on each face in images containing many
+        faces. With the ``'text'`` protocol, the images are sent one per
+        line so older versions of `openface_server.lua` answer them too.
+
+        :param rgbImgs: RGB images to process, either as a list of images \
+                        or as a single array. Shape: (N, imgDim, imgDim, 3)
+        :type rgbImgs: list of numpy.ndarray or numpy.ndarray
+        :return: Matrix of features extracted from the neural network, \
+                 one row per image. Shape: (N, 128)
+        :rtype: numpy.ndarray
+        """
+        assert rgbImgs is not None
+
+        if len(rgbImgs) == 0:
+            return np.empty((0, 128), dtype=np.float32)
+        if self.protocol == 'shm' and len(rgbImgs) > self.shmSlots:
+            n = self.shmSlots
+            return np.vstack([self.forwardBatch(rgbImgs[i:i + n])
+                              for i in range(0, len(rgbImgs), n)])
+        return self._call(rgbImgs=rgbImgs).astype(np.float32)
+
+    def forwardAsync(self, rgbImg):
+        """
+        Start a forward network pass of an RGB image without waiting for it.
+
+        Many requests can be in flight on the pipe to the Torch
+        subprocess at once, so the caller can keep detecting and
+        aligning faces while earlier faces are being processed.
+        Requests are answered in the order they were submitted.
+
+        :param rgbImg: RGB image to process. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :return: A future for the vector of features extracted from \
+                 the neural network.
+        :rtype: concurrent.futures.Future
+        """
+        assert rgbImg is not None
+
+        return self._submit([rgbImg], None,
+                            lambda reps: reps[0].astype(np.float64))
+
+    def forwardBatchAsync(self, rgbImgs):
+        """
+        Start a forward network pass of a batch of RGB images
+        without waiting for it. See :meth:`forwardAsync`.
+
+        :param rgbImgs: RGB images to process. Shape: (N, imgDim, imgDim, 3)
+        :type rgbImgs: list of numpy.ndarray or numpy.ndarray
+        :return: A future for the matrix of features extracted from \
+                 the neural network. Shape: (N, 128)
+        :rtype: concurrent.futures.Future
+        """
+        assert rgbImgs is not None
+
+        if len(rgbImgs) == 0:
+            future = Future()
+            future.set_result(np.empty((0, 128), dtype=np.float32))
+            return future
+        if self.protocol == 'shm' and len(rgbImgs) > self.shmSlots:
+            raise Exception("Batch of {} images does not fit in {} shared "
+                            "memory slots.".format(len(rgbImgs), self.shmSlots))
+        return self._submit(rgbImgs, None,
+                            lambda reps: reps.astype(np.float32))
+
+    def forwardAsyncio(self, rgbImg, loop=None):
+        """
+        Perform a forward network pass of an RGB image from asyncio code.
+
+        .. code:: python
+
+            rep = await net.forwardAsyncio(alignedFace)
+
+        :param rgbImg: RGB image to process. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :param loop: The event loop. Defaults to the current event loop.
+        :type loop: asyncio.AbstractEventLoop
+        :return: An awaitable for the vector of features extracted from \
+                 the neural network.
+        :rtype: asyncio.Future
+        """
+        # Only import in this mode; asyncio is not available in Python 2.
+        import asyncio
+        return asyncio.wrap_future(self.forwardAsync(rgbImg), loop=loop)
+
+    def warmUp(self):
+        """
+        Run a forward pass on a blank image so the Torch subprocess
+        loads the model and allocates its buffers before the first
+        real request. This is done automatically when `supervised`.
+        """
+        self.forward(np.zeros((self.imgDim, self.imgDim, 3), dtype=np.uint8))
+
+    def isReady(self):
+        """
+        Readiness probe.
+
+        :return: True if the Torch subprocess is running and has \
+                 successfully processed a request or the warm-up.
+        :rtype: bool
+        """
+        return self._ready and self.p.poll() is None
+
+    def health(self):
+        """
+        Health and latency probe.
+
+        :return: Whether the subprocess is alive and ready, the number of \
+                 restarts, requests and pending requests, and the last, \
+                 mean and maximum latency in seconds of the recent requests.
+        :rtype: dict
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            h = {'alive': self.p.poll() is None,
+                 'ready': self._ready and self.p.poll() is None,
+                 'restarts': self.restarts,
+                 'requests': self._nRequests,
+                 'pending': len(self._pending)}
+        if len(latencies) > 0:
+            h['latencyLast'] = latencies[-1]
+            h['latencyMean'] = float(np.mean(latencies))
+            h['latencyMax'] = max(latencies)
+        else:
+            h['latencyLast'] = h['latencyMean'] = h['latencyMax'] = None
+        return h
+
+    def _checkAlive(self):
         rc = self.p.poll()
         if rc is not None and rc != 0:
             raise Exception("""
@@ -160,16 +387,10 @@ cmd: {}
 stdout: {}
 """.format(self.cmd, self.p.stdout.read()))
 
-        self.p.stdin.write(imgPath + '\n')
-        output = self.p.stdout.readline()
-        try:
-            rep = [float(x) for x in output.strip().split(',')]
-            rep = np.array(rep)
-            return rep
-        except Exception as e:
-            self.p.kill()
-            stdout, stderr = self.p.communicate()
-            print("""
+    def _readFailed(self, output, e):
+        self.p.kill()
+        stdout, stderr = self.p.communicate()
+        print("""
 
 
 Error getting result from Torch subprocess.
@@ -184,7 +405,452 @@ Exception:
 
 stdout: {}
 """.format(output, str(e), stdout))
-            sys.exit(-1)
+        sys.exit(-1)
+
+    def _openShm(self):
+        shmDir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.shmPath = os.path.join(shmDir, 'openface-torchwrap-{}.shm'.format(
+            binascii.b2a_hex(os.urandom(8)).decode('ascii')))
+        size = self.shmSlots * self.imgDim * self.imgDim * 3
+        fd = os.open(self.shmPath, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            self._shm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._shmImgs = np.ndarray((self.shmSlots, self.imgDim, self.imgDim, 3),
+                                   dtype=np.uint8, buffer=self._shm)
+        self._freeSlots = deque(range(self.shmSlots))
+        self._slotsCond = threading.Condition()
+
+    def _closeShm(self):
+        if self.shmPath is not None and os.path.exists(self.shmPath):
+            os.remove(self.shmPath)
+
+    def _acquireSlots(self, n):
+        # Wait until `n` slots of the ring buffer are not used by
+        # requests that are still in flight.
+        with self._slotsCond:
+            while len(self._freeSlots) < n:
+                self._slotsCond.wait()
+            return [self._freeSlots.popleft() for _ in range(n)]
+
+    def _releaseSlots(self, slots):
+        if len(slots) == 0:
+            return
+        with self._slotsCond:
+            self._freeSlots.extend(slots)
+            self._slotsCond.notify_all()
+
+    def _prepare(self, rgbImgs, imgPaths, slots):
+        # Build a request for the subprocess without sending it.
+        # Returns the number of images, the chunks to write, and
+        # a function to call once the response has been read.
+        # The chunks are kept so the request can be sent again
+        # if the subprocess has to be restarted.
+        if self.protocol == 'binary':
+            batch = self._toBatch(rgbImgs)
+            return (len(batch), [struct.pack('<I', len(batch)), batch.tobytes()],
+                    lambda: None)
+
+        if self.protocol == 'shm':
+            dim = self.imgDim
+            for slot, rgbImg in zip(slots, rgbImgs):
+                if rgbImg.shape[:2] != (dim, dim):
+                    rgbImg = cv2.resize(rgbImg, (dim, dim))
+                self._shmImgs[slot] = rgbImg
+            n = len(slots)
+            return (n, [struct.pack('<I{}I'.format(n), n, *slots)],
+                    lambda: self._releaseSlots(slots))
+
+        ts = []
+        if imgPaths is None:
+            try:
+                for rgbImg in rgbImgs:
+                    t = '/tmp/openface-torchwrap-{}.png'.format(
+                        binascii.b2a_hex(os.urandom(8)).decode('ascii'))
+                    bgrImg = cv2.cvtColor(rgbImg, cv2.COLOR_RGB2BGR)
+                    cv2.imwrite(t, bgrImg)
+                    ts.append(t)
+            except:
+                for t in ts:
+                    os.remove(t)
+                raise
+            imgPaths = ts
+
+        def removeTempFiles():
+            for t in ts:
+                os.remove(t)
+        # Every path is sent on its own line, which older versions of
+        # `openface_server.lua` answer one at a time like any request.
+        return (len(imgPaths), [imgPath + '\n' for imgPath in imgPaths], removeTempFiles)
+
+    def _write(self, request):
+        for chunk in request[1]:
+            self.p.stdin.write(chunk)
+
+    def _receive(self, n):
+        # Read the representations of `n` images. Returns (reps, None)
+        # on success and (None, (output, exception)) on failure.
+        if self.protocol in ('binary', 'shm'):
+            header = self._readExactly(8)
+            try:
+                (nReps, repDim) = struct.unpack('<II', header)
+                assert nReps == n
+                body = self._readExactly(4 * nReps * repDim)
+                reps = np.frombuffer(body, dtype='<f4')
+                return (reps.reshape(nReps, repDim), None)
+            except Exception as e:
+                return (None, (header, e))
+
+        reps = []
+        for _ in range(n):
+            output = self.p.stdout.readline()
+            try:
+                rep = [float(x) for x in output.strip().split(',')]
+                reps.append(rep)
+            except Exception as e:
+                return (None, (output, e))
+        return (np.array(reps), None)
+
+    def _succeeded(self, start):
+        self._ready = True
+        self._failures = 0
+        self._nRequests += 1
+        self._latencies.append(time.time() - start)
+
+    def _call(self, rgbImgs=None, imgPaths=None):
+        # Send a request and wait for its response.
+        start = time.time()
+        slots = self._requestSlots(rgbImgs)
+        try:
+            request = self._prepare(rgbImgs, imgPaths, slots)
+        except:
+            self._releaseSlots(slots)
+            raise
+        pipelined = False
+        try:
+            with self._lock:
+                # Checked under the lock since `forwardAsync` can start
+                # the reader thread, which then owns the subprocess's stdout.
+                if self._reader is not None:
+                    # The request is cleaned up once it's answered or fails.
+                    pipelined = True
+                    future = self._enqueueLocked(request, lambda reps: reps, start)
+                else:
+                    return self._roundTripLocked(request, start)
+        finally:
+            if not pipelined:
+                request[2]()
+        return future.result()
+
+    def _roundTripLocked(self, request, start):
+        while True:
+            try:
+                self._checkAlive()
+                self._write(request)
+                (reps, err) = self._receive(request[0])
+            except Exception as e:
+                if not self.supervised:
+                    raise
+                err = ('', e)
+            if err is None:
+                self._succeeded(start)
+                return reps
+            if not self.supervised:
+                self._readFailed(*err)
+            if not self._restartLocked():
+                raise Exception(
+                    "OpenFace: `openface_server.lua` failed after {} restarts.\n\n"
+                    "Output read: {}\n\nException: {}".format(
+                        self.maxRestarts, *err))
+
+    def _submit(self, rgbImgs, imgPaths, transform):
+        # Send a request and return a future for its response.
+        start = time.time()
+        slots = self._requestSlots(rgbImgs)
+        try:
+            request = self._prepare(rgbImgs, imgPaths, slots)
+        except:
+            self._releaseSlots(slots)
+            raise
+        with self._lock:
+            return self._enqueueLocked(request, transform, start)
+
+    def _enqueueLocked(self, request, transform, start):
+        future = Future()
+        try:
+            if not self.supervised:
+                self._checkAlive()
+            self._write(request)
+        except Exception:
+            # A supervised subprocess is restarted by the reader
+            # thread, which sends all pending requests again.
+            if not self.supervised:
+                request[2]()
+                raise
+        if self._reader is None:
+            self._reader = threading.Thread(target=self._readResponses)
+            self._reader.daemon = True
+            self._reader.start()
+        self._pending.append((future, request, transform, start))
+        self._pendingCond.notify()
+        return future
+
+    def _requestSlots(self, rgbImgs):
+        # Slots are acquired before taking the lock because waiting for
+        # them needs the reader thread to make progress.
+        if self.protocol == 'shm':
+            return self._acquireSlots(len(rgbImgs))
+        return []
+
+    def _readResponses(self):
+        # The subprocess answers requests in order, so every response
+        # belongs to the oldest pending request.
+        while True:
+            with self._pendingCond:
+                while len(self._pending) == 0:
+                    self._pendingCond.wait()
+                (future, request, transform, start) = self._pending[0]
+
+            (reps, err) = self._receive(request[0])
+
+            if err is not None and self.supervised:
+                with self._lock:
+                    recovered = self._restartLocked()
+                    while recovered:
+                        try:
+                            # Replay the requests in flight in their original order.
+                            for pending in self._pending:
+                                self._write(pending[1])
+                            break
+                        except Exception:
+                            recovered = self._restartLocked()
+                if recovered:
+                    continue
+
+            request[2]()
+            with self._lock:
+                self._pending.popleft()
+                if err is None:
+                    self._succeeded(start)
+                else:
+                    failed = [future] + [f[0] for f in self._pending]
+                    for f in self._pending:
+                        f[1][2]()
+                    self._pending.clear()
+
+            if err is None:
+                future.set_result(transform(reps))
+            else:
+                self._kill()
+                e = Exception("Error getting result from Torch subprocess.\n\n"
+                              "Output read: {}\n\nException: {}".format(*err))
+                for f in failed:
+                    f.set_exception(e)
+                return
+
+    def _spawn(self):
+        self.p = Popen(self.cmd, stdin=PIPE, stdout=PIPE, bufsize=0,
+                       universal_newlines=(self.protocol == 'text'))
+
+    def _kill(self):
+        if self.p.poll() is None:
+            self.p.kill()
+        self.p.wait()
+
+    def _restartLocked(self):
+        # Replace a failed subprocess with a new, warmed up one.
+        # Returns False once `maxRestarts` consecutive restarts
+        # haven't led to a successful response.
+        while self._failures < self.maxRestarts:
+            self._failures += 1
+            self.restarts += 1
+            self._ready = False
+            self._kill()
+            self._spawn()
+            if self._warmUpLocked() is None:
+                return True
+        return False
+
+    def _warmUpLocked(self):
+        # Run one forward pass so the subprocess has loaded the model and
+        # allocated its buffers before the first real request.
+        # Returns None on success and (output, exception) on failure.
+        dim = self.imgDim
+        ts = []
+        if self.protocol == 'binary':
+            chunks = [struct.pack('<I', 1), b'\0' * (dim * dim * 3)]
+        elif self.protocol == 'shm':
+            # The pixels in the slot don't matter.
+            chunks = [struct.pack('<II', 1, 0)]
+        else:
+            t = '/tmp/openface-torchwrap-{}.png'.format(
+                binascii.b2a_hex(os.urandom(8)).decode('ascii'))
+            cv2.imwrite(t, np.zeros((dim, dim, 3), dtype=np.uint8))
+            ts.append(t)
+            chunks = [t + '\n']
+        try:
+            self._write((1, chunks, None))
+            (reps, err) = self._receive(1)
+        except Exception as e:
+            err = ('', e)
+        finally:
+            for t in ts:
+                os.remove(t)
+        if err is None:
+            self._ready = True
+        return err
+
+    def _toBatch(self, rgbImgs):
+        # Stack the images into a contiguous (N, imgDim, imgDim, 3)
+        # uint8 array, resizing any that have a different size.
+        dim = self.imgDim
+        if isinstance(rgbImgs, np.ndarray) and rgbImgs.ndim == 4 and \
+           rgbImgs.shape[1:] == (dim, dim, 3):
+            return np.ascontiguousarray(rgbImgs, dtype=np.uint8)
+        batch = np.empty((len(rgbImgs), dim, dim, 3), dtype=np.uint8)
+        for i, rgbImg in enumerate(rgbImgs):
+            if rgbImg.shape[:2] != (dim, dim):
+                rgbImg = cv2.resize(rgbImg, (dim, dim))
+            batch[i] = rgbImg
+        return batch
+
+    def _readExactly(self, nBytes):
+        chunks = []
+        while nBytes > 0:
+            chunk = self.p.stdout.read(nBytes)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            nBytes -= len(chunk)
+        return b''.join(chunks)
+
+
+class TorchNeuralNetPool:
+    """
+    Use a pool of `Torch <http://torch.ch>`_ subprocesses for feature extraction.
+
+    Each :class:`TorchNeuralNet` is a single-threaded Lua subprocess.
+    This pool starts several of them and sends every request to the
+    worker with the fewest faces in flight, so concurrent callers
+    and :meth:`map` use all of the available cores.
+
+    The pool is thread-safe and can be used as a context manager
+    like :class:`TorchNeuralNet`.
+
+    .. code:: python
+
+        with TorchNeuralNetPool(model=model, nWorkers=8) as pool:
+            reps = pool.map(alignedFaces)
+    """
+
+    def __init__(self, model=TorchNeuralNet.defaultModel, imgDim=96,
+                 cuda=False, nWorkers=None, protocol='binary', shmSlots=64,
+                 supervised=False, maxRestarts=3):
+        """__init__(self, model=defaultModel, imgDim=96, cuda=False, nWorkers=None, protocol='binary', shmSlots=64, supervised=False, maxRestarts=3)
+
+        Instantiate a 'TorchNeuralNetPool' object.
+
+        :param model: The path to the Torch model to use.
+        :type model: str
+        :param imgDim: The edge length of the square input image.
+        :type imgDim: int
+        :param cuda: Flag to use CUDA in the subprocesses.
+        :type cuda: bool
+        :param nWorkers: The number of subprocesses to start. \
+                         Defaults to the number of CPUs.
+        :type nWorkers: int
+        :param protocol: The protocol used by each subprocess. \
+                         See :class:`TorchNeuralNet`.
+        :type protocol: str
+        :param shmSlots: The size of each subprocess's shared memory \
+                         ring buffer with the ``'shm'`` protocol.
+        :type shmSlots: int
+        :param supervised: Restart subprocesses that fail. \
+                           See :class:`TorchNeuralNet`.
+        :type supervised: bool
+        :param maxRestarts: The number of consecutive restarts to try \
+                            before failing a request when `supervised`.
+        :type maxRestarts: int
+        """
+        if nWorkers is None:
+            nWorkers = cpu_count()
+        assert nWorkers > 0
+
+        self.model = model
+        self.imgDim = imgDim
+        self.cuda = cuda
+        self.nets = [TorchNeuralNet(model, imgDim=imgDim, cuda=cuda,
+                                    protocol=protocol, shmSlots=shmSlots,
+                                    supervised=supervised,
+                                    maxRestarts=maxRestarts)
+                     for _ in range(nWorkers)]
+        self._netLocks = [threading.Lock() for _ in self.nets]
+        self._loads = [0] * nWorkers
+        self._lock = threading.Lock()
+        self._threads = ThreadPool(nWorkers)
+
+    def __enter__(self):
+        """Part of the context manger protocol. See PEP 343"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Clean up resources when leaves `with` block.
+
+        Kill the Lua subprocesses to prevent zombie processes.
+        """
+        self.close()
+
+    def close(self):
+        """
+        Kill the Lua subprocesses to prevent zombie processes.
+        """
+        self._threads.terminate()
+        for net in self.nets:
+            net.__exit__(None, None, None)
+
+    def health(self):
+        """
+        Health and latency probe of every subprocess.
+
+        :return: :meth:`TorchNeuralNet.health` of each subprocess.
+        :rtype: list of dict
+        """
+        return [net.health() for net in self.nets]
+
+    def _acquire(self, nFaces):
+        # Choose the worker with the fewest faces in flight.
+        with self._lock:
+            i = min(range(len(self.nets)), key=lambda j: self._loads[j])
+            self._loads[i] += nFaces
+        return i
+
+    def _release(self, i, nFaces):
+        with self._lock:
+            self._loads[i] -= nFaces
+
+    def _call(self, nFaces, fn, *args):
+        i = self._acquire(nFaces)
+        try:
+            with self._netLocks[i]:
+                return fn(self.nets[i], *args)
+        finally:
+            self._release(i, nFaces)
+
+    def forwardPath(self, imgPath):
+        """
+        Perform a forward network pass of an image on disk.
+
+        :param imgPath: The path to the image.
+        :type imgPath: str
+        :return: Vector of features extracted with the neural network.
+        :rtype: numpy.ndarray
+        """
+        assert imgPath is not None
+
+        return self._call(1, TorchNeuralNet.forwardPath, imgPath)
 
     def forward(self, rgbImg):
         """
@@ -197,10 +863,68 @@ stdout: {}
         """
         assert rgbImg is not None
 
-        t = '/tmp/openface-torchwrap-{}.png'.format(
-            binascii.b2a_hex(os.urandom(8)))
-        bgrImg = cv2.cvtColor(rgbImg, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(t, bgrImg)
-        rep = self.forwardPath(t)
-        os.remove(t)
-        return rep
+        return self._call(1, TorchNeuralNet.forward, rgbImg)
+
+    def forwardAsync(self, rgbImg):
+        """
+        Start a forward network pass of an RGB image on the least-loaded
+        worker without waiting for it. See :meth:`TorchNeuralNet.forwardAsync`.
+
+        :param rgbImg: RGB image to process. Shape: (imgDim, imgDim, 3)
+        :type rgbImg: numpy.ndarray
+        :return: A future for the vector of features extracted from \
+                 the neural network.
+        :rtype: concurrent.futures.Future
+        """
+        assert rgbImg is not None
+
+        # The request is submitted under the same lock as the
+        # synchronous calls, so they're sent to a worker one at a time.
+        i = self._acquire(1)
+        try:
+            with self._netLocks[i]:
+                future = self.nets[i].forwardAsync(rgbImg)
+        except:
+            self._release(i, 1)
+            raise
+        future.add_done_callback(lambda f: self._release(i, 1))
+        return future
+
+    def forwardBatch(self, rgbImgs):
+        """
+        Perform a forward network pass of a batch of RGB images
+        on a single worker.
+
+        :param rgbImgs: RGB images to process. Shape: (N, imgDim, imgDim, 3)
+        :type rgbImgs: list of numpy.ndarray or numpy.ndarray
+        :return: Matrix of features extracted from the neural network, \
+                 one row per image. Shape: (N, 128)
+        :rtype: numpy.ndarray
+        """
+        assert rgbImgs is not None
+
+        return self._call(len(rgbImgs), TorchNeuralNet.forwardBatch, rgbImgs)
+
+    def map(self, rgbImgs, batchSize=16):
+        """
+        Perform forward network passes of many RGB images in parallel.
+
+        The images are split into batches that are spread over the workers.
+
+        :param rgbImgs: RGB images to process. Shape: (N, imgDim, imgDim, 3)
+        :type rgbImgs: list of numpy.ndarray or numpy.ndarray
+        :param batchSize: The number of images sent to a worker at once.
+        :type batchSize: int
+        :return: Matrix of features extracted from the neural network, \
+                 one row per image in the input order. Shape: (N, 128)
+        :rtype: numpy.ndarray
+        """
+        assert rgbImgs is not None
+        assert batchSize > 0
+
+        batches = [rgbImgs[i:i + batchSize]
+                   for i in range(0, len(rgbImgs), batchSize)]
+        if len(batches) == 0:
+            return np.empty((0, 128), dtype=np.float32)
+        reps = self._threads.map(self.forwardBatch, batches)
+        return np.vstack(reps)
@@ -0,0 +1,210 @@
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Module for aligning faces in video streams."""
+
+import dlib
+
+from .align_dlib import AlignDlib
+
+
+def iou(a, b):
+    """
+    Compute the intersection over union of two bounding boxes.
+
+    :param a: A bounding box.
+    :type a: dlib.rectangle
+    :param b: A bounding box.
+    :type b: dlib.rectangle
+    :return: The overlap of the boxes, between 0 and 1.
+    :rtype: float
+    """
+    w = min(a.right(), b.right()) - max(a.left(), b.left())
+    h = min(a.bottom(), b.bottom()) - max(a.top(), b.top())
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = float(w * h)
+    return inter / (a.width() * a.height() + b.width() * b.height() - inter)
+
+
+class FaceTrack:
+    """
+    A face followed across the frames of a video by :class:`VideoAligner`.
+    """
+
+    def __init__(self, trackId, rgbImg, bb):
+        #: Identifier of the track, unique within its :class:`VideoAligner`.
+        self.trackId = trackId
+        #: Bounding box of the face in the current frame.
+        self.bb = bb
+        #: Confidence of the correlation tracker in the current frame.
+        self.confidence = None
+        #: The aligned face in the current frame. Shape: (imgDim, imgDim, 3)
+        self.alignedFace = None
+        #: True if the face was found by the detector in the current frame.
+        self.detected = True
+        #: The number of frames the face has been tracked for.
+        self.age = 0
+
+        self._tracker = dlib.correlation_tracker()
+        self._tracker.start_track(rgbImg, bb)
+        self._misses = 0
+
+    def _update(self, rgbImg):
+        self.confidence = self._tracker.update(rgbImg)
+        p = self._tracker.get_position()
+        self.bb = dlib.rectangle(int(round(p.left())), int(round(p.top())),
+                                 int(round(p.right())), int(round(p.bottom())))
+        self.detected = False
+
+    def _restart(self, rgbImg, bb):
+        self._tracker.start_track(rgbImg, bb)
+        self.bb = bb
+        self.detected = True
+        self._misses = 0
+
+
+class VideoAligner:
+    """
+    Align the faces in consecutive frames of a video.
+
+    Running the face detector on every frame is the bottleneck of
+    live demos. The detector only runs every `detectEvery` frames,
+    or when a tracker loses confidence, and the faces are followed
+    with dlib's correlation tracker in between. Each face keeps the
+    same track identifier while it is followed.
+
+    .. code:: python
+
+        videoAligner = VideoAligner(AlignDlib(facePredictor), 96)
+        for rgbFrame in frames:
+            for track in videoAligner.process(rgbFrame):
+                rep = net.forward(track.alignedFace)
+    """
+
+    def __init__(self, align, imgDim, detectEvery=10, minConfidence=7.0,
+                 minIoU=0.3, maxMisses=1,
+                 landmarkIndices=AlignDlib.OUTER_EYES_AND_NOSE):
+        """
+        Instantiate a 'VideoAligner' object.
+
+        :param align: The aligner used to detect and align faces.
+        :type align: :class:`openface.AlignDlib`
+        :param imgDim: The edge length in pixels of the aligned faces.
+        :type imgDim: int
+        :param detectEvery: Run the face detector every this many frames.
+        :type detectEvery: int
+        :param minConfidence: Run the face detector if a tracker's \
+                              confidence drops below this value.
+        :type minConfidence: float
+        :param minIoU: The minimum intersection over union of a detection \
+                       and a track's bounding box to continue the track.
+        :type minIoU: float
+        :param maxMisses: The number of consecutive detections that may \
+                          miss a face before its track is dropped.
+        :type maxMisses: int
+        :param landmarkIndices: The indices to transform to.
+        :type landmarkIndices: list of ints
+        """
+        assert align is not None
+        assert imgDim is not None
+        assert detectEvery > 0
+
+        self.align = align
+        self.imgDim = imgDim
+        self.detectEvery = detectEvery
+        self.minConfidence = minConfidence
+        self.minIoU = minIoU
+        self.maxMisses = maxMisses
+        self.landmarkIndices = landmarkIndices
+
+        #: The faces currently being tracked.
+        self.tracks = []
+        #: The number of frames processed.
+        self.nFrames = 0
+        #: The number of frames the detector ran on.
+        self.nDetections = 0
+
+        self._nextTrackId = 0
+        self._framesSinceDetection = 0
+
+    def reset(self):
+        """Drop all tracks, such as when the video source changes."""
+        self.tracks = []
+        self._framesSinceDetection = 0
+
+    def process(self, rgbImg):
+        """
+        Find and align the faces in the next frame.
+
+        :param rgbImg: RGB frame to process. Shape: (height, width, 3)
+        :type rgbImg: numpy.ndarray
+        :return: The faces in the frame with their aligned images.
+        :rtype: list of :class:`FaceTrack`
+        """
+        assert rgbImg is not None
+
+        self.nFrames += 1
+        self._framesSinceDetection += 1
+
+        lost = False
+        for track in self.tracks:
+            track._update(rgbImg)
+            track.age += 1
+            if track.confidence < self.minConfidence:
+                lost = True
+
+        if len(self.tracks) == 0 or lost or \
+           self._framesSinceDetection >= self.detectEvery:
+            self._detect(rgbImg)
+
+        alignedFaces = self.align.alignMany(self.imgDim, rgbImg,
+                                            [track.bb for track in self.tracks],
+                                            landmarkIndices=self.landmarkIndices)
+        for track, alignedFace in zip(self.tracks, alignedFaces):
+            track.alignedFace = alignedFace
+        return list(self.tracks)
+
+    def _detect(self, rgbImg):
+        self.nDetections += 1
+        self._framesSinceDetection = 0
+        bbs = list(self.align.getAllFaceBoundingBoxes(rgbImg))
+
+        # Greedily continue the tracks that overlap the detections the most.
+        pairs = [(iou(track.bb, bb), i, j)
+                 for i, track in enumerate(self.tracks)
+                 for j, bb in enumerate(bbs)]
+        pairs.sort(reverse=True)
+        matchedTracks, matchedBbs = set(), set()
+        for (overlap, i, j) in pairs:
+            if overlap < self.minIoU:
+                break
+            if i in matchedTracks or j in matchedBbs:
+                continue
+            self.tracks[i]._restart(rgbImg, bbs[j])
+            matchedTracks.add(i)
+            matchedBbs.add(j)
+
+        tracks = []
+        for i, track in enumerate(self.tracks):
+            if i not in matchedTracks:
+                track._misses += 1
+                if track._misses > self.maxMisses:
+                    continue
+            tracks.append(track)
+        for j, bb in enumerate(bbs):
+            if j not in matchedBbs:
+                tracks.append(FaceTrack(self._nextTrackId, rgbImg, bb))
+                self._nextTrackId += 1
+        self.tracks = tracks
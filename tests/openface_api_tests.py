@@ -67,3 +67,98 @@ def test_pipeline():
     cosDist = scipy.spatial.distance.cosine(rep, np.ones(128))
     print(cosDist)
     assert np.isclose(cosDist, 0.938840385931)
+
+
+def test_forward_batch():
+    imgPath = os.path.join(exampleImages, 'longoria-cooper.jpg')
+    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        raise Exception("Unable to load image: {}".format(imgPath))
+    rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+
+    bbs = align.getAllFaceBoundingBoxes(rgbImg)
+    assert len(bbs) == 2
+    alignedFaces = [align.align(imgDim, rgbImg, bb,
+                                landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+                    for bb in bbs]
+
+    reps = net.forwardBatch(alignedFaces)
+    assert reps.shape == (2, 128)
+    assert reps.dtype == np.float32
+    for alignedFace, rep in zip(alignedFaces, reps):
+        assert np.allclose(rep, net.forward(alignedFace), atol=1e-5)
+
+    reps = net.forwardBatch(np.array(alignedFaces))
+    assert reps.shape == (2, 128)
+
+
+def test_align_many():
+    imgPath = os.path.join(exampleImages, 'longoria-cooper.jpg')
+    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        raise Exception("Unable to load image: {}".format(imgPath))
+    rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+
+    bbs = align.getAllFaceBoundingBoxes(rgbImg)
+    alignedFaces = align.alignMany(imgDim, rgbImg, bbs,
+                                   landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+    assert alignedFaces.shape == (len(bbs), imgDim, imgDim, 3)
+    assert alignedFaces.dtype == np.uint8
+    for bb, alignedFace in zip(bbs, alignedFaces):
+        assert np.array_equal(alignedFace,
+                              align.align(imgDim, rgbImg, bb,
+                                          landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE))
+
+    assert align.alignMany(imgDim, rgbImg, []).shape == (0, imgDim, imgDim, 3)
+
+
+def test_video_aligner():
+    imgPath = os.path.join(exampleImages, 'longoria-cooper.jpg')
+    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        raise Exception("Unable to load image: {}".format(imgPath))
+    rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+
+    videoAligner = openface.VideoAligner(align, imgDim, detectEvery=5)
+    trackIds = None
+    for i in range(10):
+        tracks = videoAligner.process(rgbImg)
+        assert len(tracks) == 2
+        for track in tracks:
+            assert track.alignedFace.shape == (imgDim, imgDim, 3)
+        if trackIds is None:
+            trackIds = sorted(track.trackId for track in tracks)
+        assert sorted(track.trackId for track in tracks) == trackIds
+    assert videoAligner.nDetections < videoAligner.nFrames
+
+
+def test_forward_async():
+    imgPath = os.path.join(exampleImages, 'lennon-1.jpg')
+    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        raise Exception("Unable to load image: {}".format(imgPath))
+    rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+    alignedFace = align.align(imgDim, rgbImg,
+                              landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+
+    asyncNet = openface.TorchNeuralNet(model, imgDim=imgDim)
+    futures = [asyncNet.forwardAsync(alignedFace) for _ in range(5)]
+    rep = net.forward(alignedFace)
+    for future in futures:
+        assert np.allclose(future.result(), rep, atol=1e-5)
+
+
+def test_opencv_forward():
+    imgPath = os.path.join(exampleImages, 'lennon-1.jpg')
+    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        raise Exception("Unable to load image: {}".format(imgPath))
+    rgbImg = cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB)
+    alignedFace = align.align(imgDim, rgbImg,
+                              landmarkIndices=openface.AlignDlib.OUTER_EYES_AND_NOSE)
+
+    cvNet = openface.OpenCVNeuralNet(model, imgDim=imgDim)
+    rep = cvNet.forward(alignedFace)
+    assert np.allclose(rep, net.forward(alignedFace), atol=1e-3)
+    reps = cvNet.forwardBatch([alignedFace, alignedFace])
+    assert reps.shape == (2, 128)
@@ -22,10 +22,12 @@ import sys
 
 import numpy as np
 np.set_printoptions(precision=2)
-import pandas as pd
+
 import scipy
 import scipy.spatial
 
+import openface.data
+
 from subprocess import Popen, PIPE
 
 openfaceDir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -68,13 +70,16 @@ def test_batch_represent():
     print(err)
     assert p.returncode == 0
 
-    fname = os.path.join(workDir, 'reps', 'labels.csv')
-    labels = pd.read_csv(fname, header=None).as_matrix()
-    fname = os.path.join(workDir, 'reps', 'reps.csv')
-    embeddings = pd.read_csv(fname, header=None).as_matrix()
+    store = openface.data.EmbeddingStore.load(os.path.join(workDir, 'reps'))
+    # Convert to binary and check the same representations are loaded.
+    store.save(os.path.join(workDir, 'reps'))
+    binaryStore = openface.data.EmbeddingStore.load(os.path.join(workDir, 'reps'))
+    assert np.allclose(binaryStore.reps, store.reps)
+    assert binaryStore.paths == store.paths
+    embeddings = binaryStore.reps
 
     brody1 = brody2 = None
-    for i, (cls, label) in enumerate(labels):
+    for i, label in enumerate(binaryStore.paths):
         if "Brody_0001" in label:
             brody1 = embeddings[i]
         elif "Brody_0002" in label:
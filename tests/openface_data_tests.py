@@ -0,0 +1,145 @@
+# OpenFace data tests.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+import openface.data
+
+imgDim = 96
+
+
+def test_packed_faces():
+    d = tempfile.mkdtemp()
+    try:
+        faces = np.random.randint(0, 256, (5, imgDim, imgDim, 3)).astype(np.uint8)
+        with openface.data.PackedFaceWriter(d, imgDim) as writer:
+            for i, face in enumerate(faces[:3]):
+                assert writer.add(face, 'person-{}'.format(i % 2), str(i),
+                                  '/raw/{}.jpg'.format(i)) == i
+        # Faces are appended to an existing store.
+        with openface.data.PackedFaceWriter(d, imgDim) as writer:
+            for i, face in enumerate(faces[3:], 3):
+                writer.add(face, 'person-{}'.format(i % 2), str(i),
+                           '/raw/{}.jpg'.format(i))
+
+        packed = openface.data.PackedFaces(d)
+        assert len(packed) == 5
+        assert np.array_equal(packed[1:4], faces[1:4])
+        assert np.array_equal(packed[4], faces[4])
+        assert packed.classes == ['person-0', 'person-1'] * 2 + ['person-0']
+        assert packed.paths[2] == '/raw/2.jpg'
+        assert [start for (start, batch) in packed.iterBatches(2)] == [0, 2, 4]
+
+        # A partially written face is ignored.
+        with open(os.path.join(d, 'faces.bin'), 'ab') as f:
+            f.write(b'\0' * 10)
+        assert len(openface.data.PackedFaces(d)) == 5
+
+        # So is a partially written index entry, which isn't joined with the next one.
+        with open(os.path.join(d, 'faces.bin'), 'ab') as f:
+            f.write(b'\0' * (imgDim * imgDim * 3 - 10))
+        with open(os.path.join(d, 'index.csv'), 'a') as f:
+            f.write('person-1,5,/raw')
+        assert len(openface.data.PackedFaces(d)) == 5
+        with openface.data.PackedFaceWriter(d, imgDim) as writer:
+            assert writer.add(faces[0], 'person-0', '6', '/raw/6.jpg') == 5
+        packed = openface.data.PackedFaces(d)
+        assert packed.paths[4:] == ['/raw/4.jpg', '/raw/6.jpg']
+        assert np.array_equal(packed[5], faces[0])
+    finally:
+        shutil.rmtree(d)
+
+
+def test_iter_rgb():
+    d = tempfile.mkdtemp()
+    try:
+        imgs = []
+        for i in range(10):
+            bgr = np.full((64, 48, 3), i, dtype=np.uint8)
+            path = os.path.join(d, '{}.png'.format(i))
+            cv2.imwrite(path, bgr)
+            imgs.append(openface.data.Image('person', str(i), path))
+        imgs.append(openface.data.Image('person', 'missing', os.path.join(d, 'missing.png')))
+
+        loaded = list(openface.data.iterRGB(imgs, nWorkers=3, prefetch=4))
+        assert [img for (img, rgb) in loaded] == imgs
+        for i, (img, rgb) in enumerate(loaded[:-1]):
+            assert rgb.shape == (64, 48, 3)
+            assert rgb[0, 0, 0] == i
+        assert loaded[-1][1] is None
+
+        (img, rgb) = next(openface.data.iterRGB(imgs, reduce=2))
+        assert rgb.shape == (32, 24, 3)
+    finally:
+        shutil.rmtree(d)
+
+
+def test_image_catalog():
+    d = tempfile.mkdtemp()
+    try:
+        for cls in ['person-1', 'person-2']:
+            os.mkdir(os.path.join(d, cls))
+            for name in ['image-1', 'image-2']:
+                open(os.path.join(d, cls, name + '.jpg'), 'w').close()
+        open(os.path.join(d, 'person-2', 'notes.txt'), 'w').close()
+
+        catalog = openface.data.ImageCatalog.build(d)
+        assert len(catalog) == 4
+        assert sorted(img.path for img in catalog) == \
+            sorted(img.path for img in openface.data.iterImgs(d))
+        assert catalog.classes == ['person-1', 'person-2']
+        assert catalog[2].cls == 'person-2'
+        assert catalog[2].name == 'image-1'
+
+        fName = os.path.join(d, 'catalog.npz')
+        catalog.save(fName)
+        loaded = openface.data.ImageCatalog.load(fName)
+        assert [img.path for img in loaded] == [img.path for img in catalog]
+        assert loaded.classes == catalog.classes
+    finally:
+        shutil.rmtree(d)
+
+
+def test_embedding_store():
+    d = tempfile.mkdtemp()
+    try:
+        reps = np.random.randn(4, 128)
+        with open(os.path.join(d, 'reps.csv'), 'w') as f:
+            for rep in reps:
+                f.write(",".join(str(x) for x in rep) + "\n")
+        with open(os.path.join(d, 'labels.csv'), 'w') as f:
+            for i in range(4):
+                f.write("{},./aligned/person-{}/image-{}.png\n".format(i // 2 + 1, i // 2, i))
+
+        store = openface.data.EmbeddingStore.load(d)
+        assert store.reps.shape == (4, 128)
+        assert list(store.labels) == [1, 1, 2, 2]
+
+        binDir = os.path.join(d, 'bin')
+        store.save(binDir)
+        binStore = openface.data.EmbeddingStore.load(binDir)
+        assert binStore.reps.dtype == np.float32
+        assert np.allclose(binStore.reps, reps, atol=1e-6)
+        assert list(binStore.labels) == [1, 1, 2, 2]
+        assert binStore.paths == store.paths
+    finally:
+        shutil.rmtree(d)
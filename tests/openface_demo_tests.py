@@ -19,6 +19,7 @@ import os
 import re
 import shutil
 import tempfile
+import time
 import sys
 
 from subprocess import Popen, PIPE
@@ -66,6 +67,36 @@ def test_classification_demo_pretrained_multi():
     assert 'Predict BradleyCooper @ x=191 with 0.99 confidence.' in out
 
 
+def test_classification_demo_server():
+    sockDir = tempfile.mkdtemp(prefix='OpenFaceServe-')
+    sock = os.path.join(sockDir, 'classifier.sock')
+    classifierModel = os.path.join(openfaceDir, 'models', 'openface',
+                                   'celeb-classifier.nn4.small2.v1.pkl')
+    server = Popen([sys.executable, os.path.join(openfaceDir, 'demos', 'classifier.py'),
+                    'serve', '--socket', sock, classifierModel],
+                   stdout=PIPE, stderr=PIPE, universal_newlines=True)
+    try:
+        for _ in range(600):
+            if os.path.exists(sock) or server.poll() is not None:
+                break
+            time.sleep(0.1)
+        assert os.path.exists(sock)
+
+        # The server's classifier is selected by its name.
+        for name in [classifierModel, 'celeb-classifier.nn4.small2.v1']:
+            cmd = [sys.executable, os.path.join(openfaceDir, 'demos', 'classifier.py'),
+                   'infer', '--server', sock, name, os.path.join(exampleImages, 'carell.jpg')]
+            p = Popen(cmd, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+            (out, err) = p.communicate()
+            print(out)
+            print(err)
+            assert 'Predict SteveCarell with 0.97 confidence.' in out
+    finally:
+        server.terminate()
+        server.communicate()
+        shutil.rmtree(sockDir)
+
+
 def test_classification_demo_training():
     assert os.path.isdir(lfwSubset), 'Get lfw-subset by running ./data/download-lfw-subset.sh'
 
@@ -0,0 +1,99 @@
+# OpenFace embedding cache tests.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import shutil
+import tempfile
+
+import numpy as np
+
+import openface
+
+
+class FakeNet:
+    # Records the images it's asked for instead of running a network.
+
+    model = 'fake.t7'
+    imgDim = 4
+
+    def __init__(self):
+        self.calls = []
+
+    def rep(self, rgbImg):
+        rep = np.zeros(128)
+        rep[0] = rgbImg[0, 0, 0]
+        return rep
+
+    def forward(self, rgbImg):
+        self.calls.append(1)
+        return self.rep(rgbImg)
+
+    def forwardBatch(self, rgbImgs):
+        self.calls.append(len(rgbImgs))
+        return np.vstack([self.rep(rgbImg) for rgbImg in rgbImgs])
+
+
+def face(i):
+    return np.full((4, 4, 3), i, dtype=np.uint8)
+
+
+def test_embedding_cache_memory():
+    net = FakeNet()
+    cache = openface.EmbeddingCache(net, maxEntries=2)
+
+    assert cache.forward(face(1))[0] == 1
+    assert cache.forward(face(1))[0] == 1
+    assert net.calls == [1]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The least recently used face is evicted.
+    cache.forward(face(2))
+    cache.forward(face(1))
+    cache.forward(face(3))
+    assert cache.evictions == 1
+    assert cache.stats()['size'] == 2
+    cache.forward(face(1))
+    assert len(net.calls) == 3
+    cache.forward(face(2))
+    assert len(net.calls) == 4
+
+
+def test_embedding_cache_batch():
+    net = FakeNet()
+    cache = openface.EmbeddingCache(net)
+    cache.forward(face(1))
+
+    # Only the uncached faces are sent, once each.
+    reps = cache.forwardBatch([face(1), face(2), face(3), face(2)])
+    assert net.calls == [1, 2]
+    np.testing.assert_array_equal(reps[:, 0], [1, 2, 3, 2])
+    assert reps.shape == (4, 128)
+    assert cache.misses == 3
+
+
+def test_embedding_cache_disk():
+    cacheDir = tempfile.mkdtemp(prefix='OpenFaceCache-')
+    try:
+        net = FakeNet()
+        openface.EmbeddingCache(net, cacheDir=cacheDir).forwardBatch([face(1), face(2)])
+
+        # A new cache finds the representations on disk.
+        cache = openface.EmbeddingCache(net, cacheDir=cacheDir)
+        np.testing.assert_array_equal(cache.forwardBatch([face(2), face(1)])[:, 0], [2, 1])
+        assert net.calls == [2]
+        assert cache.diskHits == 2
+    finally:
+        shutil.rmtree(cacheDir)
@@ -0,0 +1,52 @@
+# OpenFace gallery tests.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import shutil
+import tempfile
+
+import numpy as np
+
+import openface
+
+
+def test_gallery():
+    d = tempfile.mkdtemp()
+    try:
+        reps = np.random.randn(4, 128).astype(np.float32)
+        with openface.Gallery(d) as gallery:
+            for i in range(3):
+                gallery.add('face-{}'.format(i), reps[i], i)
+            gallery.relabel('face-0', 5)
+            gallery.remove('face-1')
+            # Adding a key again replaces its face.
+            gallery.add('face-2', reps[3], 2)
+
+        gallery = openface.Gallery(d)
+        assert gallery.keys() == ['face-0', 'face-2']
+        assert gallery.labels == [5, 2]
+        assert np.array_equal(gallery.reps, reps[[0, 3]])
+        assert gallery.nUnused == 2
+
+        gallery.compact()
+        assert gallery.nUnused == 0
+        gallery.close()
+        gallery = openface.Gallery(d)
+        assert gallery.keys() == ['face-0', 'face-2']
+        assert np.array_equal(gallery.get('face-2')[0], reps[3])
+        gallery.close()
+    finally:
+        shutil.rmtree(d)
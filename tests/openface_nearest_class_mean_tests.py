@@ -0,0 +1,38 @@
+# OpenFace nearest class mean classifier tests.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+import openface
+
+
+def test_nearest_class_mean():
+    rng = np.random.RandomState(0)
+    centers = rng.randn(5, 128)
+    y = np.arange(100) % 5
+    X = centers[y] + 0.1 * rng.randn(100, 128)
+
+    clf = openface.NearestClassMean(threshold=0.5).fit(X[y < 3], y[y < 3])
+    clf.partial_fit(X[y >= 3], y[y >= 3])
+    assert list(clf.classes_) == list(range(5))
+    assert np.array_equal(clf.predict(X), y)
+    probabilities = clf.predict_proba(X)
+    assert probabilities.shape == (100, 5)
+    assert np.allclose(probabilities.sum(axis=1), 1)
+
+    # Faces far from every class mean are unknown.
+    assert np.all(clf.predict(rng.randn(5, 128)) == -1)
@@ -0,0 +1,84 @@
+# OpenFace gallery search tests.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import shutil
+import tempfile
+
+import numpy as np
+
+import openface
+import openface.search
+
+
+def test_flat_index():
+    rng = np.random.RandomState(0)
+    gallery = rng.randn(1000, 128)
+    queries = rng.randn(20, 128)
+
+    index = openface.FlatIndex(blockSize=300, queryBatchSize=8, nThreads=2)
+    index.add(gallery[:500])
+    index.add(gallery[500:], labels=np.arange(500) + 1000)
+    assert len(index) == 1000
+
+    (distances, idx) = index.search(queries, k=5)
+    assert distances.shape == (20, 5)
+    gallery = openface.search.normalize(gallery)
+    queries = openface.search.normalize(queries)
+    exact = np.sum((queries[:, None, :] - gallery[None, :, :]) ** 2, axis=2)
+    assert np.array_equal(idx, np.argsort(exact, axis=1)[:, :5])
+    assert np.allclose(distances, np.sort(exact, axis=1)[:, :5], atol=1e-5)
+    assert index.labels[idx[0, 0]] == (idx[0, 0] if idx[0, 0] < 500 else idx[0, 0] + 500)
+
+    # A query in the gallery is its own nearest neighbour.
+    (distances, idx) = index.search(gallery[42], k=1)
+    assert idx[0, 0] == 42
+    index.close()
+
+
+def test_ivfpq_index():
+    rng = np.random.RandomState(0)
+    centers = rng.randn(50, 128)
+    gallery = centers[np.arange(2000) % 50] + 0.1 * rng.randn(2000, 128)
+    queries = centers[:10] + 0.1 * rng.randn(10, 128)
+
+    index = openface.IVFPQIndex(nList=8, nSubquantizers=16, nProbe=8)
+    index.train(gallery, nIter=5)
+    index.add(gallery[:1000])
+    index.add(gallery[1000:], labels=np.arange(1000, 2000))
+    assert len(index) == 2000
+    assert np.array_equal(index.labels, np.arange(2000))
+
+    # The faces of a query's identity are its nearest neighbours.
+    (distances, idx) = index.search(queries, k=5)
+    assert distances.shape == (10, 5)
+    assert np.all(np.diff(distances, axis=1) >= 0)
+    assert np.all(idx % 50 == np.arange(10)[:, None])
+
+    d = tempfile.mkdtemp()
+    try:
+        index.save(d)
+        loaded = openface.IVFPQIndex.load(d)
+        assert len(loaded) == 2000
+        assert np.array_equal(loaded.search(queries, k=5)[1], idx)
+
+        # Faces added after searching are merged into the memory-mapped lists.
+        loaded.add(gallery[:50])
+        assert len(loaded) == 2050
+        assert np.array_equal(loaded.labels[2000:], np.arange(2000, 2050))
+        assert np.all(loaded.search(queries, k=5)[1] % 50 == np.arange(10)[:, None])
+    finally:
+        shutil.rmtree(d)
@@ -16,14 +16,22 @@
 
 import argparse
 import cv2
+import multiprocessing
 import numpy as np
 import os
-import random
 import shutil
+import sqlite3
+import time
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
 
 import openface
+import openface.data
 import openface.helper
-from openface.data import iterImgs
+from openface.data import iterRGB
 
 fileDir = os.path.dirname(os.path.realpath(__file__))
 modelDir = os.path.join(fileDir, '..', 'models')
@@ -41,25 +49,109 @@ def write(vals, fName):
             f.write("\n")
 
 
+class LandmarkStats:
+    """
+    Running mean and variance of normalized landmarks, updated with
+    Welford's algorithm so memory doesn't grow with the number of faces.
+    Partial statistics from different workers are combined with `merge`.
+    """
+
+    def __init__(self, n=0, mean=None, m2=None):
+        self.n = n
+        self.mean = np.zeros((68, 2)) if mean is None else mean
+        self.m2 = np.zeros((68, 2)) if m2 is None else m2
+
+    def add(self, points):
+        self.n += 1
+        delta = points - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (points - self.mean)
+
+    def merge(self, other):
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+
+    def std(self):
+        return np.sqrt(self.m2 / self.n)
+
+
+def normalizedLandmarks(align, rgb):
+    # Landmarks relative to the face's bounding box, as in
+    # openface.align_dlib.TEMPLATE.
+    bb = align.getLargestFaceBoundingBox(rgb)
+    if bb is None:
+        return None
+    landmarks = np.float64(align.findLandmarks(rgb, bb))
+    return (landmarks - (bb.left(), bb.top())) / (bb.width(), bb.height())
+
+
+def initMeanWorker(args, catalog, indices):
+    global workerAlign, workerReduce, workerCatalog, workerIndices
+    workerAlign = openface.AlignDlib(args.dlibFacePredictor)
+    workerReduce = args.reduce
+    workerCatalog = catalog
+    workerIndices = indices
+
+
+def landmarkStatsShard(shard):
+    # A shard is a range of positions in the sampled indices,
+    # or in the catalog if every image is used.
+    (start, stop) = shard
+    indices = range(start, stop) if workerIndices is None else workerIndices[start:stop]
+    imgs = (workerCatalog[i] for i in indices)
+    stats = LandmarkStats()
+    # The landmarks are normalized by the bounding box,
+    # so they can be found on reduced resolution images.
+    for (img, rgb) in iterRGB(imgs, nWorkers=2, reduce=workerReduce):
+        if rgb is None:
+            continue
+        points = normalizedLandmarks(workerAlign, rgb)
+        if points is not None:
+            stats.add(points)
+    # Only send the arrays back so the result is easy to pickle.
+    return (stats.n, stats.mean, stats.m2)
+
+
 def computeMeanMain(args):
-    align = openface.AlignDlib(args.dlibFacePredictor)
+    # The catalog keeps the paths in one buffer and the workers are only
+    # sent ranges of images, so memory doesn't grow with every image.
+    catalog = openface.data.ImageCatalog.build(args.inputDir)
+    indices = None
+    n = len(catalog)
+    if 0 < args.numImages < n:
+        indices = np.sort(np.random.choice(n, args.numImages, replace=False))
+        n = args.numImages
 
-    imgs = list(iterImgs(args.inputDir))
-    if args.numImages > 0:
-        imgs = random.sample(imgs, args.numImages)
+    shardSize = 1000
+    shards = [(i, min(i + shardSize, n)) for i in range(0, n, shardSize)]
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=initMeanWorker,
+                                    initargs=(args, catalog, indices))
+        partialStats = pool.imap_unordered(landmarkStatsShard, shards)
+    else:
+        pool = None
+        initMeanWorker(args, catalog, indices)
+        partialStats = (landmarkStatsShard(shard) for shard in shards)
 
-    facePoints = []
-    for img in imgs:
-        rgb = img.getRGB()
-        bb = align.getLargestFaceBoundingBox(rgb)
-        alignedPoints = align.align(rgb, bb)
-        if alignedPoints:
-            facePoints.append(alignedPoints)
+    stats = LandmarkStats()
+    for partial in partialStats:
+        stats.merge(LandmarkStats(*partial))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if stats.n == 0:
+        raise Exception("Unable to find a face in any of the images.")
+    print("Computed the landmark statistics of {} faces.".format(stats.n))
 
-    facePointsNp = np.array(facePoints)
-    mean = np.mean(facePointsNp, axis=0)
-    std = np.std(facePointsNp, axis=0)
+    mean = stats.mean
+    std = stats.std()
 
+    openface.helper.mkdirP(args.modelDir)
     write(mean, "{}/mean.csv".format(args.modelDir))
     write(std, "{}/std.csv".format(args.modelDir))
 
@@ -76,13 +168,184 @@ def computeMeanMain(args):
     plt.savefig("{}/mean.png".format(args.modelDir))
 
 
+# Messages printed with --verbose for each alignment status.
+statusMessages = {
+    'unreadable': "  + Unable to load.",
+    'no-face': "  + Unable to align.",
+    'aligned': "  + Aligned.",
+    'failed': "  + The worker aligning it died."
+}
+
+
+def openManifest(fName):
+    """
+    Open the manifest recording the status of every input image,
+    so re-runs skip the images that haven't changed, including the
+    ones that couldn't be aligned.
+    """
+    manifest = sqlite3.connect(fName)
+    manifest.execute("""CREATE TABLE IF NOT EXISTS images (
+                            path TEXT PRIMARY KEY,
+                            status TEXT NOT NULL,
+                            output TEXT,
+                            mtime REAL NOT NULL,
+                            size INTEGER NOT NULL,
+                            settings TEXT NOT NULL,
+                            updated REAL NOT NULL)""")
+    manifest.execute("CREATE INDEX IF NOT EXISTS images_status ON images (status)")
+    return manifest
+
+
+def manifestSettings(args):
+    # Images are aligned again if any of these change.
+    return "{},{},{},{},{}".format(os.path.abspath(args.outputDir), args.landmarks,
+                                   args.size, args.skipMulti, args.packed)
+
+
+def outputPath(args, imgObject, status):
+    outputPrefix = os.path.join(args.outputDir, imgObject.cls, imgObject.name)
+    if status == 'aligned':
+        return outputPrefix + ".png"
+    elif args.fallbackLfw:
+        return outputPrefix + ".jpg"
+    else:
+        return None
+
+
+def alignImage(align, imgObject, rgb, args, landmarkIndices):
+    """
+    Align one loaded image and return its status, one of `statusMessages`,
+    and with --packed the aligned image to add to the packed store.
+    """
+    outDir = os.path.join(args.outputDir, imgObject.cls)
+    outputPrefix = os.path.join(outDir, imgObject.name)
+    imgName = outputPrefix + ".png"
+
+    if rgb is None:
+        status = 'unreadable'
+        outRgb = None
+    else:
+        outRgb = align.align(args.size, rgb,
+                             landmarkIndices=landmarkIndices,
+                             skipMulti=args.skipMulti)
+        status = 'no-face' if outRgb is None else 'aligned'
+
+    if args.fallbackLfw and outRgb is None:
+        openface.helper.mkdirP(outDir)
+        deepFunneled = "{}/{}.jpg".format(os.path.join(args.fallbackLfw,
+                                                       imgObject.cls),
+                                          imgObject.name)
+        shutil.copy(deepFunneled, "{}/{}.jpg".format(os.path.join(args.outputDir,
+                                                                  imgObject.cls),
+                                                     imgObject.name))
+
+    if args.packed:
+        return (status, outRgb)
+
+    if outRgb is not None:
+        openface.helper.mkdirP(outDir)
+        outBgr = cv2.cvtColor(outRgb, cv2.COLOR_RGB2BGR)
+        cv2.imwrite(imgName, outBgr)
+    return (status, None)
+
+
+def iterAligned(align, catalog, indices, args, landmarkIndices):
+    # Decode the next images while the current one is aligned.
+    imgs = (catalog[i] for i in indices)
+    for (i, (imgObject, rgb)) in zip(indices, iterRGB(imgs, nWorkers=2)):
+        yield (i,) + alignImage(align, imgObject, rgb, args, landmarkIndices)
+
+
+def alignShard(args, catalog, shard, indices, landmarkIndices, queue):
+    # Every worker process loads its own copy of dlib's models.
+    align = openface.AlignDlib(args.dlibFacePredictor)
+    for result in iterAligned(align, catalog, indices, args, landmarkIndices):
+        queue.put((shard, result))
+
+
+def iterAlignedParallel(catalog, indices, args, landmarkIndices):
+    # Each worker aligns a fixed shard of the images, so no image
+    # is aligned twice, and reports every image back through a queue
+    # in the order of its shard.
+    queue = multiprocessing.Queue()
+    shards = [indices[i::args.workers] for i in range(args.workers)]
+    workers = [multiprocessing.Process(target=alignShard,
+                                       args=(args, catalog, k, shard, landmarkIndices, queue))
+               for (k, shard) in enumerate(shards)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    nDone = [0] * len(shards)
+    running = set(range(len(shards)))
+    dead = set()
+    while len(running) > 0:
+        try:
+            (k, result) = queue.get(timeout=1)
+            nDone[k] += 1
+            yield result
+            continue
+        except Empty:
+            pass
+
+        for k in sorted(running):
+            if nDone[k] == len(shards[k]):
+                running.remove(k)
+            elif k in dead:
+                # The worker died, such as from an exception or being killed,
+                # and the queue has been empty for a second since, so the
+                # rest of its shard is reported as failed.
+                print("Worker {} exited with code {} before aligning {} images.".format(
+                    k, workers[k].exitcode, len(shards[k]) - nDone[k]))
+                running.remove(k)
+                for i in shards[k][nDone[k]:]:
+                    yield (i, 'failed', None)
+            elif not workers[k].is_alive():
+                dead.add(k)
+
+    for worker in workers:
+        worker.join()
+
+
+def manifestStatsMain(args):
+    manifest = openManifest(args.manifest)
+
+    # Only report the images in the input directory.
+    prefix = os.path.join(args.inputDir, '')
+    where = "WHERE substr(path, 1, ?) = ?"
+    params = (len(prefix), prefix)
+
+    print("{:>12} {:>10}".format("Status", "Images"))
+    for (status, n) in manifest.execute(
+            "SELECT status, COUNT(*) FROM images {} GROUP BY status ORDER BY status".format(where),
+            params):
+        print("{:>12} {:>10}".format(status, n))
+
+    if args.list:
+        for (path,) in manifest.execute(
+                "SELECT path FROM images {} AND status = ? ORDER BY path".format(where),
+                params + (args.list,)):
+            print(path)
+    manifest.close()
+
+
 def alignMain(args):
     openface.helper.mkdirP(args.outputDir)
 
-    imgs = list(iterImgs(args.inputDir))
+    if args.catalog and os.path.isfile(args.catalog):
+        catalog = openface.data.ImageCatalog.load(args.catalog)
+    else:
+        catalog = openface.data.ImageCatalog.build(args.inputDir)
+        if args.catalog:
+            catalog.save(args.catalog)
 
-    # Shuffle so multiple versions can be run at once.
-    random.shuffle(imgs)
+    if args.workers > 1:
+        # The catalog is sorted, so the images are
+        # sharded the same way on every run.
+        indices = np.arange(len(catalog))
+    else:
+        # Shuffle so multiple versions can be run at once.
+        indices = np.random.permutation(len(catalog))
 
     landmarkMap = {
         'outerEyesAndNose': openface.AlignDlib.OUTER_EYES_AND_NOSE,
@@ -93,49 +356,107 @@ def alignMain(args):
 
     landmarkIndices = landmarkMap[args.landmarks]
 
-    align = openface.AlignDlib(args.dlibFacePredictor)
+    def skip(keep, reason):
+        toAlign = indices[np.fromiter((keep(i) for i in indices), dtype=bool,
+                                      count=len(indices))]
+        print("Skipping {} images that are {}.".format(len(indices) - len(toAlign), reason))
+        return toAlign
 
-    nFallbacks = 0
-    for imgObject in imgs:
-        print("=== {} ===".format(imgObject.path))
-        outDir = os.path.join(args.outputDir, imgObject.cls)
-        openface.helper.mkdirP(outDir)
-        outputPrefix = os.path.join(outDir, imgObject.name)
-        imgName = outputPrefix + ".png"
+    if not args.packed and not args.manifest:
+        # With a manifest, only new or changed images are aligned
+        # and their previous output is replaced.
+        def keep(i):
+            imgObject = catalog[i]
+            return not os.path.isfile(os.path.join(args.outputDir, imgObject.cls,
+                                                   imgObject.name + ".png"))
+        indices = skip(keep, "already aligned")
+    elif args.packed and not args.manifest and \
+            os.path.isfile(os.path.join(args.outputDir, 'index.csv')):
+        packedPaths = set(openface.data.PackedFaces(args.outputDir).paths)
+        indices = skip(lambda i: catalog.path(i) not in packedPaths,
+                       "already in the packed store")
 
-        if os.path.isfile(imgName):
-            if args.verbose:
-                print("  + Already found, skipping.")
-        else:
-            rgb = imgObject.getRGB()
-            if rgb is None:
-                if args.verbose:
-                    print("  + Unable to load.")
-                outRgb = None
-            else:
-                outRgb = align.align(args.size, rgb,
-                                     landmarkIndices=landmarkIndices,
-                                     skipMulti=args.skipMulti)
-                if outRgb is None and args.verbose:
-                    print("  + Unable to align.")
-
-            if args.fallbackLfw and outRgb is None:
-                nFallbacks += 1
-                deepFunneled = "{}/{}.jpg".format(os.path.join(args.fallbackLfw,
-                                                               imgObject.cls),
-                                                  imgObject.name)
-                shutil.copy(deepFunneled, "{}/{}.jpg".format(os.path.join(args.outputDir,
-                                                                          imgObject.cls),
-                                                             imgObject.name))
+    if args.manifest:
+        manifest = openManifest(args.manifest)
+        settings = manifestSettings(args)
+        done = {}
+        recorded = set()
+        for (path, mtime, size, pathSettings) in manifest.execute(
+                "SELECT path, mtime, size, settings FROM images"):
+            recorded.add(path)
+            if pathSettings == settings:
+                done[path] = (mtime, size)
+        # Faces packed by a run that was interrupted before
+        # committing the manifest are recorded instead of packed again.
+        packedRows = {}
+        if args.packed and os.path.isfile(os.path.join(args.outputDir, 'index.csv')):
+            for (row, path) in enumerate(openface.data.PackedFaces(args.outputDir).paths):
+                if path not in recorded:
+                    packedRows[path] = row
+        mtimes = np.zeros(len(catalog))
+        sizes = np.zeros(len(catalog), dtype=np.int64)
+
+        def keep(i):
+            path = catalog.path(i)
+            st = os.stat(path)
+            mtimes[i] = st.st_mtime
+            sizes[i] = st.st_size
+            if path in packedRows:
+                output = "{}:{}".format(os.path.join(args.outputDir, 'faces.bin'),
+                                        packedRows[path])
+                manifest.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (path, 'aligned', output, st.st_mtime, st.st_size,
+                                  settings, time.time()))
+                return False
+            return done.get(path) != (st.st_mtime, st.st_size)
+        indices = skip(keep, "unchanged in the manifest")
+        manifest.commit()
+
+    if args.packed:
+        packedWriter = openface.data.PackedFaceWriter(args.outputDir, args.size)
 
+    if args.workers > 1:
+        results = iterAlignedParallel(catalog, indices, args, landmarkIndices)
+    else:
+        align = openface.AlignDlib(args.dlibFacePredictor)
+        results = iterAligned(align, catalog, indices, args, landmarkIndices)
+
+    counts = {}
+    for n, (i, status, outRgb) in enumerate(results):
+        imgObject = catalog[i]
+        print("=== [{}/{}] {} ===".format(n + 1, len(indices), imgObject.path))
+        if args.verbose:
+            print(statusMessages[status])
+        counts[status] = counts.get(status, 0) + 1
+
+        if args.packed:
             if outRgb is not None:
-                if args.verbose:
-                    print("  + Writing aligned file to disk.")
-                outBgr = cv2.cvtColor(outRgb, cv2.COLOR_RGB2BGR)
-                cv2.imwrite(imgName, outBgr)
+                row = packedWriter.add(outRgb, imgObject.cls, imgObject.name,
+                                       imgObject.path)
+                output = "{}:{}".format(os.path.join(args.outputDir, 'faces.bin'), row)
+            else:
+                output = None
+        else:
+            output = outputPath(args, imgObject, status)
+
+        # Failed images aren't recorded, so they're aligned again on the next run.
+        if args.manifest and status != 'failed':
+            manifest.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (imgObject.path, status, output, float(mtimes[i]),
+                              int(sizes[i]), settings, time.time()))
+            if (n + 1) % 1000 == 0:
+                manifest.commit()
+
+    if args.packed:
+        packedWriter.close()
+    if args.manifest:
+        manifest.commit()
+        manifest.close()
 
+    for status in sorted(counts):
+        print("{}: {}".format(status, counts[status]))
     if args.fallbackLfw:
-        print('nFallbacks:', nFallbacks)
+        print('nFallbacks:', counts.get('unreadable', 0) + counts.get('no-face', 0))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -149,6 +470,13 @@ if __name__ == '__main__':
         'computeMean', help='Compute the image mean of a directory of images.')
     computeMeanParser.add_argument('--numImages', type=int, help="The number of images. '0' for all images.",
                                    default=0)  # <= 0 ===> all imgs
+    computeMeanParser.add_argument('--modelDir', type=str,
+                                   help="Directory to write mean.csv, std.csv and mean.png to.",
+                                   default=dlibModelDir)
+    computeMeanParser.add_argument('--workers', type=int, default=1,
+                                   help="Number of processes to find landmarks with.")
+    computeMeanParser.add_argument('--reduce', type=int, choices=[1, 2, 4, 8], default=1,
+                                   help="Decode images at 1/reduce of their resolution.")
     alignmentParser = subparsers.add_parser(
         'align', help='Align a directory of images.')
     alignmentParser.add_argument('landmarks', type=str,
@@ -164,11 +492,32 @@ if __name__ == '__main__':
                                  help="If alignment doesn't work, fallback to copying the deep funneled version from this directory..")
     alignmentParser.add_argument(
         '--skipMulti', action='store_true', help="Skip images with more than one face.")
+    alignmentParser.add_argument('--workers', type=int, default=1,
+                                 help="Number of processes to align images with.")
+    alignmentParser.add_argument('--manifest', type=str,
+                                 help="SQLite file recording the status of every image. "
+                                 "Images that haven't changed since they were recorded are skipped.")
+    alignmentParser.add_argument('--packed', action='store_true',
+                                 help="Append the aligned images to a packed store in outputDir "
+                                 "(see openface.data.PackedFaces) instead of writing one PNG per image.")
+    alignmentParser.add_argument('--catalog', type=str,
+                                 help="Load the list of input images from this file "
+                                 "(see openface.data.ImageCatalog), or save it there if it doesn't exist.")
     alignmentParser.add_argument('--verbose', action='store_true')
+    manifestStatsParser = subparsers.add_parser(
+        'manifestStats', help="Summarize the alignment status of the images in an alignment manifest.")
+    manifestStatsParser.add_argument('manifest', type=str, help="The alignment manifest.")
+    manifestStatsParser.add_argument('--list', type=str,
+                                     choices=['aligned', 'no-face', 'unreadable'],
+                                     help="Also list the images with this status.")
 
     args = parser.parse_args()
 
     if args.mode == 'computeMean':
         computeMeanMain(args)
+    elif args.mode == 'manifestStats':
+        manifestStatsMain(args)
     else:
+        if args.packed and args.fallbackLfw:
+            raise Exception("--fallbackLfw can't be used with --packed.")
         alignMain(args)
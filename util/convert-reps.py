@@ -0,0 +1,46 @@
+#!/usr/bin/env python2
+#
+# Convert the reps.csv and labels.csv written by batch-represent
+# to the binary format of openface.data.EmbeddingStore.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+start = time.time()
+
+import argparse
+import os
+
+from openface.data import EmbeddingStore
+
+parser = argparse.ArgumentParser()
+parser.add_argument('workDirs', type=str, nargs='+',
+                    help="Work directories containing 'reps.csv' and 'labels.csv'.")
+parser.add_argument('--outDir', type=str,
+                    help="Directory to write the binary files to. Defaults to the work directory. "
+                    "Only valid with a single work directory.")
+args = parser.parse_args()
+
+if args.outDir and len(args.workDirs) > 1:
+    raise Exception("--outDir can only be used with a single work directory.")
+
+for workDir in args.workDirs:
+    start = time.time()
+    store = EmbeddingStore.load(workDir)
+    outDir = args.outDir or workDir
+    store.save(outDir)
+    print("Converted {} representations in {} to {} in {:0.2f} seconds.".format(
+        len(store), workDir, os.path.join(outDir, 'reps.npy'), time.time() - start))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python2
+# Compare the speed and recall of face detection on
+# downscaled images with detection at full resolution.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+start = time.time()
+
+import argparse
+import cv2
+import os
+
+import numpy as np
+np.set_printoptions(precision=2)
+
+import openface
+from openface.video_align import iou
+
+fileDir = os.path.dirname(os.path.realpath(__file__))
+modelDir = os.path.join(fileDir, '..', 'models')
+dlibModelDir = os.path.join(modelDir, 'dlib')
+
+
+def nMatched(refBbs, bbs, minIoU):
+    # Greedily match every reference box to its best unused detection.
+    unused = list(bbs)
+    n = 0
+    for ref in refBbs:
+        if len(unused) == 0:
+            break
+        best = max(unused, key=lambda bb: iou(ref, bb))
+        if iou(ref, best) >= minIoU:
+            unused.remove(best)
+            n += 1
+    return n
+
+
+def timeDetection(rgbImg, scale, upsample):
+    start = time.time()
+    for i in range(args.numIters):
+        bbs = align.getAllFaceBoundingBoxes(rgbImg, detectionScale=scale,
+                                            upsample=upsample)
+    return (time.time() - start) / args.numIters, bbs
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('imgs', type=str, nargs='+', help="Input images.")
+parser.add_argument('--dlibFacePredictor', type=str, help="Path to dlib's face predictor.",
+                    default=os.path.join(dlibModelDir, "shape_predictor_68_face_landmarks.dat"))
+parser.add_argument('--scales', type=float, nargs='+',
+                    help="Detection scales to profile.",
+                    default=[1.0, 0.75, 0.5, 0.25])
+parser.add_argument('--upsample', type=int, nargs='+',
+                    help="Upsample counts to profile.", default=[0, 1])
+parser.add_argument('--minIoU', type=float,
+                    help="Minimum overlap with a full resolution detection to count as found.",
+                    default=0.5)
+parser.add_argument('--numIters', type=int,
+                    help="Number of iterations per image.", default=5)
+
+args = parser.parse_args()
+
+print("Argument parsing and loading libraries took {:0.4f} seconds.".format(
+    time.time() - start))
+
+align = openface.AlignDlib(args.dlibFacePredictor)
+
+rgbImgs = []
+for imgPath in args.imgs:
+    bgrImg = cv2.imread(imgPath)
+    if bgrImg is None:
+        raise Exception("Unable to load image: {}".format(imgPath))
+    rgbImgs.append(cv2.cvtColor(bgrImg, cv2.COLOR_BGR2RGB))
+
+# Full resolution detection with the default upsampling is the reference.
+refTimes, refBbs = [], []
+for rgbImg in rgbImgs:
+    t, bbs = timeDetection(rgbImg, 1.0, 1)
+    refTimes.append(t)
+    refBbs.append(bbs)
+refTime = np.mean(refTimes)
+nRef = sum(len(bbs) for bbs in refBbs)
+
+print("Number of images: {}".format(len(rgbImgs)))
+print("Faces found at full resolution: {}".format(nRef))
+print("{:>8} {:>9} {:>12} {:>9} {:>8} {:>7}".format(
+    "Scale", "Upsample", "Time (ms)", "Speedup", "Recall", "Extra"))
+for upsample in args.upsample:
+    for scale in args.scales:
+        times, nFound, nExtra = [], 0, 0
+        for rgbImg, ref in zip(rgbImgs, refBbs):
+            t, bbs = timeDetection(rgbImg, scale, upsample)
+            times.append(t)
+            n = nMatched(ref, bbs, args.minIoU)
+            nFound += n
+            nExtra += len(bbs) - n
+        t = np.mean(times)
+        recall = float(nFound) / nRef if nRef > 0 else float('nan')
+        print("{:>8.2f} {:>9} {:>12.2f} {:>8.2f}x {:>8.3f} {:>7}".format(
+            scale, upsample, 1000. * t, refTime / t, recall, nExtra))
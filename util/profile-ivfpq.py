@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+# Measure the recall and query speed of approximate nearest
+# neighbour search with openface.IVFPQIndex against exact
+# search with openface.FlatIndex.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+start = time.time()
+
+import argparse
+import shutil
+import tempfile
+
+import numpy as np
+np.set_printoptions(precision=2)
+
+import openface
+from openface.data import EmbeddingStore
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--workDir', type=str,
+                    help="""Work directory with the representations to index.
+                    By default, clustered random representations are generated.""")
+parser.add_argument('--gallerySize', type=int,
+                    help="Number of generated representations.", default=1000000)
+parser.add_argument('--numIdentities', type=int,
+                    help="Number of generated identities.", default=100000)
+parser.add_argument('--numQueries', type=int,
+                    help="Number of queries, held out from the gallery.", default=1000)
+parser.add_argument('--nList', type=int, help="Number of inverted lists.", default=1024)
+parser.add_argument('--nSubquantizers', type=int,
+                    help="Number of bytes per representation.", default=16)
+parser.add_argument('--nProbe', type=int, nargs='+',
+                    help="Numbers of lists to search.", default=[1, 4, 16, 64])
+parser.add_argument('--k', type=int, help="Number of neighbours.", default=10)
+
+args = parser.parse_args()
+
+print("Argument parsing and loading libraries took {:0.4f} seconds.".format(
+    time.time() - start))
+
+rng = np.random.RandomState(0)
+if args.workDir is not None:
+    reps = EmbeddingStore.load(args.workDir).reps
+else:
+    # Faces of the same person are near each other.
+    centers = rng.randn(args.numIdentities, 128)
+    reps = np.empty((args.gallerySize, 128), dtype=np.float32)
+    for i in range(0, args.gallerySize, 100000):
+        n = min(100000, args.gallerySize - i)
+        reps[i:i + n] = centers[rng.randint(args.numIdentities, size=n)] + \
+            0.5 * rng.randn(n, 128)
+
+queryIdx = rng.choice(len(reps), args.numQueries, replace=False)
+galleryMask = np.ones(len(reps), dtype=bool)
+galleryMask[queryIdx] = False
+queries = np.asarray(reps[queryIdx])
+store = EmbeddingStore(reps[galleryMask], np.arange(galleryMask.sum()),
+                       paths=[])
+print("Gallery size: {}, queries: {}".format(len(store), len(queries)))
+
+start = time.time()
+flat = openface.FlatIndex.fromStore(store)
+(_, exact) = flat.search(queries, k=args.k)
+print("Exact search: {:0.3f} ms/query".format(
+    1000. * (time.time() - start) / len(queries)))
+
+start = time.time()
+index = openface.IVFPQIndex.fromStore(store, nList=args.nList,
+                                      nSubquantizers=args.nSubquantizers)
+print("Training and adding took {:0.2f} seconds.".format(time.time() - start))
+print("Bytes per face: {} (exact: {})".format(
+    index.nSubquantizers, 4 * index.dim))
+
+# Search the index as it's used after being loaded from disk.
+indexDir = tempfile.mkdtemp()
+try:
+    index.save(indexDir)
+    index = openface.IVFPQIndex.load(indexDir)
+
+    print("{:>7} {:>10} {:>10} {:>12}".format(
+        "nProbe", "ms/query", "Recall@1", "Recall@{}".format(args.k)))
+    for nProbe in args.nProbe:
+        start = time.time()
+        (_, idx) = index.search(queries, k=args.k, nProbe=nProbe)
+        t = time.time() - start
+        recall1 = np.mean(idx[:, 0] == exact[:, 0])
+        recallK = np.mean([len(np.intersect1d(a, b)) for (a, b) in zip(idx, exact)]) / \
+            float(args.k)
+        print("{:>7} {:>10.3f} {:>10.3f} {:>12.3f}".format(
+            nProbe, 1000. * t / len(queries), recall1, recallK))
+finally:
+    shutil.rmtree(indexDir)
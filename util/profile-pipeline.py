@@ -46,6 +46,10 @@ parser.add_argument('--imgDim', type=int,
                     help="Default image dimension.", default=96)
 parser.add_argument('--numIters', type=int,
                     help="Number of iterations.", default=100)
+parser.add_argument('--detectionScale', type=float,
+                    help="Scale images by this factor before detecting faces.", default=1.0)
+parser.add_argument('--upsample', type=int,
+                    help="Number of times the face detector upsamples images.", default=1)
 
 args = parser.parse_args()
 
@@ -53,7 +57,9 @@ print("Argument parsing and loading libraries took {:0.4f} seconds.".format(
     time.time() - start))
 
 start = time.time()
-align = openface.AlignDlib(args.dlibFacePredictor)
+align = openface.AlignDlib(args.dlibFacePredictor,
+                           detectionScale=args.detectionScale,
+                           upsample=args.upsample)
 net = openface.TorchNeuralNet(args.networkModel, args.imgDim)
 print("Loading the dlib and OpenFace models took {:0.4f} seconds.".format(
     time.time() - start))
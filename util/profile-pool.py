@@ -0,0 +1,77 @@
+#!/usr/bin/env python2
+# Measure the embedding throughput of TorchNeuralNetPool
+# with different numbers of workers.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+start = time.time()
+
+import argparse
+import os
+from multiprocessing import cpu_count
+
+import numpy as np
+np.set_printoptions(precision=2)
+
+import openface
+
+fileDir = os.path.dirname(os.path.realpath(__file__))
+modelDir = os.path.join(fileDir, '..', 'models')
+openfaceModelDir = os.path.join(modelDir, 'openface')
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--networkModel', type=str, help="Path to Torch network model.",
+                    default=os.path.join(openfaceModelDir, 'nn4.small2.v1.t7'))
+parser.add_argument('--imgDim', type=int,
+                    help="Default image dimension.", default=96)
+parser.add_argument('--numFaces', type=int,
+                    help="Number of faces to embed per run.", default=1000)
+parser.add_argument('--batchSize', type=int,
+                    help="Number of faces sent to a worker at once.", default=16)
+parser.add_argument('--workers', type=int, nargs='+',
+                    help="Numbers of workers to profile.",
+                    default=sorted(set([1, 2, 4, 8, cpu_count()])))
+parser.add_argument('--cuda', action='store_true')
+
+args = parser.parse_args()
+
+print("Argument parsing and loading libraries took {:0.4f} seconds.".format(
+    time.time() - start))
+
+# The network's run time doesn't depend on the image content.
+faces = np.random.randint(0, 256, (args.numFaces, args.imgDim, args.imgDim, 3))
+faces = faces.astype(np.uint8)
+
+print("Number of faces: {}".format(args.numFaces))
+print("{:>8} {:>12} {:>10}".format("Workers", "Faces/sec", "Speedup"))
+baseline = None
+for nWorkers in args.workers:
+    with openface.TorchNeuralNetPool(args.networkModel, args.imgDim,
+                                     cuda=args.cuda,
+                                     nWorkers=nWorkers) as pool:
+        # Warm up every worker before timing.
+        pool.map(faces[:nWorkers], batchSize=1)
+
+        start = time.time()
+        pool.map(faces, batchSize=args.batchSize)
+        facesPerSec = args.numFaces / (time.time() - start)
+
+    if baseline is None:
+        baseline = facesPerSec
+    print("{:>8} {:>12.2f} {:>9.2f}x".format(nWorkers, facesPerSec,
+                                            facesPerSec / baseline))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python2
+# Measure the query throughput of exact nearest neighbour
+# search with openface.FlatIndex at different gallery sizes.
+#
+# Copyright 2015-2016 Carnegie Mellon University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+start = time.time()
+
+import argparse
+from multiprocessing import cpu_count
+
+import numpy as np
+np.set_printoptions(precision=2)
+
+import openface
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--gallerySizes', type=int, nargs='+',
+                    help="Gallery sizes to profile.",
+                    default=[10000, 100000, 1000000])
+parser.add_argument('--batchSizes', type=int, nargs='+',
+                    help="Numbers of queries searched at once.", default=[1, 64])
+parser.add_argument('--threads', type=int, nargs='+',
+                    help="Numbers of search threads to profile.",
+                    default=sorted(set([1, cpu_count()])))
+parser.add_argument('--numQueries', type=int,
+                    help="Number of queries per run.", default=256)
+parser.add_argument('--k', type=int, help="Number of neighbours.", default=5)
+parser.add_argument('--dim', type=int, help="Representation dimension.", default=128)
+
+args = parser.parse_args()
+
+print("Argument parsing and loading libraries took {:0.4f} seconds.".format(
+    time.time() - start))
+
+# The search time doesn't depend on the representations.
+rng = np.random.RandomState(0)
+queries = rng.randn(args.numQueries, args.dim).astype(np.float32)
+
+print("{:>10} {:>7} {:>8} {:>14} {:>12}".format(
+    "Gallery", "Batch", "Threads", "ms/query", "Queries/sec"))
+for gallerySize in args.gallerySizes:
+    index = openface.FlatIndex(dim=args.dim)
+    # Add the gallery in parts to limit the memory used to generate it.
+    for i in range(0, gallerySize, 100000):
+        index.add(rng.randn(min(100000, gallerySize - i), args.dim))
+
+    for nThreads in args.threads:
+        index.close()
+        index.nThreads = nThreads
+        for batchSize in args.batchSizes:
+            # Warm up the threads before timing.
+            index.search(queries[:batchSize], k=args.k)
+
+            start = time.time()
+            for q0 in range(0, args.numQueries, batchSize):
+                index.search(queries[q0:q0 + batchSize], k=args.k)
+            t = time.time() - start
+            print("{:>10} {:>7} {:>8} {:>14.3f} {:>12.1f}".format(
+                gallerySize, batchSize, nThreads, 1000. * t / args.numQueries,
+                args.numQueries / t))
+    index.close()
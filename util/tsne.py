@@ -1,7 +1,8 @@
 #!/usr/bin/env python2
 
 import numpy as np
-import pandas as pd
+
+from openface.data import EmbeddingStore
 
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
@@ -26,8 +27,9 @@ parser.add_argument('workDir', type=str)
 parser.add_argument('--names', type=str, nargs='+', required=True)
 args = parser.parse_args()
 
-y = pd.read_csv("{}/labels.csv".format(args.workDir)).as_matrix()[:, 0]
-X = pd.read_csv("{}/reps.csv".format(args.workDir)).as_matrix()
+store = EmbeddingStore.load(args.workDir)
+y = store.labels
+X = store.reps
 
 target_names = np.array(args.names)
 colors = cm.Dark2(np.linspace(0, 1, len(target_names)))